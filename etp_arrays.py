@@ -0,0 +1,531 @@
+import collections
+import hashlib
+import zlib
+
+import numpy as np
+
+from etptypes.energistics.etp.v12.datatypes.any_array import AnyArray
+from etptypes.energistics.etp.v12.datatypes.array_of_boolean import ArrayOfBoolean
+from etptypes.energistics.etp.v12.datatypes.array_of_int import ArrayOfInt
+from etptypes.energistics.etp.v12.datatypes.array_of_long import ArrayOfLong
+from etptypes.energistics.etp.v12.datatypes.array_of_float import ArrayOfFloat
+from etptypes.energistics.etp.v12.datatypes.array_of_double import ArrayOfDouble
+from etptypes.energistics.etp.v12.datatypes.message_header import MessageHeader
+from etptypes.energistics.etp.v12.datatypes.data_array_types.data_array import DataArray
+from etptypes.energistics.etp.v12.protocol.data_array.get_data_arrays_response import (
+    GetDataArraysResponse,
+)
+from etptypes.energistics.etp.v12.protocol.data_array.get_data_subarrays_response import (
+    GetDataSubarraysResponse,
+)
+
+
+# ETP AnyArrayType of each transport array variant, with its NumPy dtype
+TRANSPORT_DTYPES = {
+    "arrayOfBoolean": np.dtype(np.bool_),
+    "arrayOfInt": np.dtype(np.int32),
+    "arrayOfLong": np.dtype(np.int64),
+    "arrayOfFloat": np.dtype(np.float32),
+    "arrayOfDouble": np.dtype(np.float64),
+}
+
+# etptypes class of each transport array variant
+TRANSPORT_CLASSES = {
+    "arrayOfBoolean": ArrayOfBoolean,
+    "arrayOfInt": ArrayOfInt,
+    "arrayOfLong": ArrayOfLong,
+    "arrayOfFloat": ArrayOfFloat,
+    "arrayOfDouble": ArrayOfDouble,
+}
+
+# Largest Avro encoding of one element of each transport variant (ints and
+# longs are zig-zag varints)
+TRANSPORT_ITEMSIZE = {
+    "arrayOfBoolean": 1,
+    "arrayOfInt": 5,
+    "arrayOfLong": 10,
+    "arrayOfFloat": 4,
+    "arrayOfDouble": 8,
+}
+
+# ETP AnyLogicalArrayType describing how an array is stored
+LOGICAL_TYPES = {
+    np.dtype(np.bool_): "arrayOfBoolean",
+    np.dtype(np.int8): "arrayOfInt8",
+    np.dtype(np.uint8): "arrayOfUInt8",
+    np.dtype(np.int16): "arrayOfInt16LE",
+    np.dtype(np.int32): "arrayOfInt32LE",
+    np.dtype(np.int64): "arrayOfInt64LE",
+    np.dtype(np.uint16): "arrayOfUInt16LE",
+    np.dtype(np.uint32): "arrayOfUInt32LE",
+    np.dtype(np.uint64): "arrayOfUInt64LE",
+    np.dtype(np.float32): "arrayOfFloat32LE",
+    np.dtype(np.float64): "arrayOfDouble64LE",
+}
+LOGICAL_DTYPES = {name: dtype for dtype, name in LOGICAL_TYPES.items()}
+
+# customData key of the content hash of an uploaded array or object
+CONTENT_HASH = "contentHash"
+
+
+def transport_type(metadata):
+    """The AnyArrayType name of a DataArrayMetadata."""
+    transport = metadata.transport_array_type
+    return getattr(transport, "value", transport)
+
+
+def transport_dtype(metadata):
+    """NumPy dtype of the transport type named in a DataArrayMetadata."""
+    return TRANSPORT_DTYPES[transport_type(metadata)]
+
+
+def any_array_item(array):
+    """The AnyArray item holding `array`, and its AnyArrayType name."""
+    array = np.asarray(array)
+    name = transport_for(array.dtype)
+    cls = TRANSPORT_CLASSES[name]
+    return cls(values=array.ravel().astype(TRANSPORT_DTYPES[name], copy=False).tolist()), name
+
+
+def item_dtype(item):
+    """NumPy dtype of the values of an AnyArray item, e.g. float32 for ArrayOfFloat."""
+    return TRANSPORT_DTYPES[next(k for k, cls in TRANSPORT_CLASSES.items() if isinstance(item, cls))]
+
+
+def content_hash(data):
+    """BLAKE2b digest of an object's bytes, or of an array's dtype, shape and buffer."""
+    h = hashlib.blake2b(digest_size=16)
+    if isinstance(data, np.ndarray):
+        h.update(f"{data.dtype.str}{data.shape}".encode())
+        data = np.ascontiguousarray(data).reshape(-1).view(np.uint8)
+    h.update(data)
+    return h.hexdigest()
+
+
+def array_metadata(array, store_last_write=0, custom_data=None):
+    """
+    A DataArrayMetadata dict describing `array`, for PutUninitializedDataArrays;
+    `custom_data` maps names to string values.
+    """
+    return {
+        "dimensions": list(array.shape),
+        "preferredSubarrayDimensions": [],
+        "transportArrayType": transport_for(array.dtype),
+        "logicalArrayType": logical_type(array.dtype),
+        "storeLastWrite": store_last_write,
+        "storeCreated": store_last_write,
+        "customData": {k: {"item": v} for k, v in (custom_data or {}).items()},
+    }
+
+
+def transport_for(dtype):
+    """
+    The AnyArrayType used to send arrays of `dtype`: the narrowest variant
+    holding every value, so that float32 is not widened to double and small
+    integers are not sent as longs.
+    """
+    dtype = np.dtype(dtype)
+    if dtype == np.bool_:
+        return "arrayOfBoolean"
+    if np.issubdtype(dtype, np.integer):
+        if dtype.itemsize < 4 or (dtype.itemsize == 4 and dtype.kind == "i"):
+            return "arrayOfInt"
+        return "arrayOfLong"
+    if np.issubdtype(dtype, np.floating) and dtype.itemsize <= 4:
+        return "arrayOfFloat"
+    return "arrayOfDouble"
+
+
+def logical_type(dtype):
+    """The AnyLogicalArrayType of arrays of `dtype`."""
+    return LOGICAL_TYPES.get(np.dtype(dtype).newbyteorder("="), "arrayOfCustom")
+
+
+def array_dtype(metadata):
+    """
+    NumPy dtype of the array described by a DataArrayMetadata: its logical type
+    where known (e.g. int8 sent as arrayOfInt), else its transport type.
+    """
+    logical = metadata.logical_array_type
+    return LOGICAL_DTYPES.get(getattr(logical, "value", logical), transport_dtype(metadata))
+
+
+#
+# Avro encoding of DataArray messages straight from the ndarray buffer.  This
+# avoids turning every element into a Python object and validating it through
+# pydantic; floating point data is passed on as a view of the array.
+#
+CORE_PROTOCOL = 0
+DATA_ARRAY_PROTOCOL = 9
+GET_DATA_ARRAYS_RESPONSE = 1
+PUT_DATA_ARRAYS = 4
+PUT_DATA_SUBARRAYS = 5
+GET_DATA_SUBARRAYS_RESPONSE = 8
+FINALPART = 0x2
+COMPRESSED = 0x8
+HAS_HEADER_EXTENSION = 0x20
+
+# branch of each variant in the AnyArray.item union
+ANY_ARRAY_BRANCH = {
+    "arrayOfBoolean": 0,
+    "arrayOfInt": 1,
+    "arrayOfLong": 2,
+    "arrayOfFloat": 3,
+    "arrayOfDouble": 4,
+}
+
+# branch of string in the DataValue.item union
+DATA_VALUE_STRING = 6
+
+VARINT_BLOCK = 1 << 20
+
+
+def _long(n):
+    """Avro int/long: zig-zag varint."""
+    n = (n << 1) ^ (n >> 63)
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _string(s):
+    b = s.encode("utf-8")
+    return _long(len(b)) + b
+
+
+def _string_map(values):
+    """Avro map<string, DataValue> of string values, as customData."""
+    if not values:
+        return b"\x00"
+    return _long(len(values)) + b"".join(
+        _string(k) + _long(DATA_VALUE_STRING) + _string(v) for k, v in values.items()
+    ) + b"\x00"
+
+
+def _long_array(values):
+    values = [int(v) for v in values]
+    if not values:
+        return b"\x00"
+    return _long(len(values)) + b"".join(_long(v) for v in values) + b"\x00"
+
+
+def _varints(values):
+    """Zig-zag varint encoding of an integer ndarray, vectorized in blocks."""
+    out = []
+    shifts = np.arange(10, dtype=np.uint64) * np.uint64(7)
+    for start in range(0, values.size, VARINT_BLOCK):
+        v = values[start:start + VARINT_BLOCK].astype(np.int64)
+        z = ((v << 1) ^ (v >> 63)).view(np.uint64)
+        groups = (z[:, None] >> shifts) & np.uint64(0x7F)
+        lengths = 1 + np.count_nonzero((z[:, None] >> shifts[1:]) != 0, axis=1)
+        used = np.arange(10) < lengths[:, None]
+        more = np.arange(10) < (lengths[:, None] - 1)
+        groups = groups.astype(np.uint8) | (more.astype(np.uint8) << 7)
+        out.append(groups[used].tobytes())
+    return b"".join(out)
+
+
+def encode_header(protocol, message_type, message_id, correlation_id=0, message_flags=FINALPART):
+    return (
+        _long(protocol) + _long(message_type) + _long(correlation_id)
+        + _long(message_id) + _long(message_flags)
+    )
+
+
+def encode_any_array(array, transport=None):
+    """Avro encoding of an AnyArray holding `array`, as a list of buffers."""
+    transport = transport or transport_for(array.dtype)
+    flat = np.ascontiguousarray(array).reshape(-1)
+    head = _long(ANY_ARRAY_BRANCH[transport])
+    if flat.size == 0:
+        return [head + b"\x00"]
+    head += _long(flat.size)
+    if transport == "arrayOfDouble":
+        values = memoryview(flat.astype("<f8", copy=False)).cast("B")
+    elif transport == "arrayOfFloat":
+        values = memoryview(flat.astype("<f4", copy=False)).cast("B")
+    elif transport == "arrayOfBoolean":
+        values = memoryview(flat.astype(np.bool_, copy=False).view(np.uint8)).cast("B")
+    else:
+        values = _varints(flat)
+    return [head, values, b"\x00"]
+
+
+def encode_put_data_arrays(arrays, message_id, custom_data=None):
+    """
+    A complete PutDataArrays message for `arrays`, a list of
+    (uri, pathInResource, ndarray), as a list of buffers.  `custom_data` maps
+    (uri, pathInResource) to the string customData of that array.
+    """
+    custom_data = custom_data or {}
+    out = [encode_header(DATA_ARRAY_PROTOCOL, PUT_DATA_ARRAYS, message_id)]
+    if not arrays:
+        return out + [b"\x00"]
+    out.append(_long(len(arrays)))
+    for i, (uri, pir, array) in enumerate(arrays):
+        out.append(_string(str(i)) + _string(uri) + _string(pir) + _long_array(array.shape))
+        out.extend(encode_any_array(array))
+        out.append(_string_map(custom_data.get((uri, pir))))
+    out.append(b"\x00")
+    return out
+
+
+def encode_put_data_subarrays(uri, pir, block, starts, counts, message_id):
+    """A complete PutDataSubarrays message for one block, as a list of buffers."""
+    return [
+        encode_header(DATA_ARRAY_PROTOCOL, PUT_DATA_SUBARRAYS, message_id),
+        _long(1) + _string("0") + _string(uri) + _string(pir),
+        *encode_any_array(block),
+        _long_array(starts) + _long_array(counts) + b"\x00",
+    ]
+
+
+def encoded_size(buffers):
+    return sum(memoryview(b).nbytes for b in buffers)
+
+
+def coalesce(buffers, min_size=1 << 16):
+    """Join runs of small buffers, leaving large ones (array views) as they are."""
+    out, small = [], []
+    for b in buffers:
+        if memoryview(b).nbytes < min_size:
+            small.append(bytes(b))
+            continue
+        if small:
+            out.append(b"".join(small))
+            small = []
+        out.append(b)
+    if small:
+        out.append(b"".join(small))
+    return out if len(out) > 1 else out[0]
+
+
+#
+# Avro decoding of GetDataArraysResponse and GetDataSubarraysResponse straight
+# into typed ndarrays.  Fixed-width values are read as views of the received
+# message, varints are decoded vectorized.
+#
+DecodedMessage = collections.namedtuple("DecodedMessage", "header body")
+
+# AnyArray.item branch -> (item class, dtype of fixed-width values or None)
+ANY_ARRAY_VARIANTS = {
+    0: (ArrayOfBoolean, np.dtype(np.bool_)),
+    1: (ArrayOfInt, None),
+    2: (ArrayOfLong, None),
+    3: (ArrayOfFloat, np.dtype("<f4")),
+    4: (ArrayOfDouble, np.dtype("<f8")),
+}
+
+DATA_ARRAY_RESPONSES = {
+    GET_DATA_ARRAYS_RESPONSE: (GetDataArraysResponse, "data_arrays"),
+    GET_DATA_SUBARRAYS_RESPONSE: (GetDataSubarraysResponse, "data_subarrays"),
+}
+
+
+def _read_long(buf, pos):
+    n = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return (n >> 1) ^ -(n & 1), pos
+        shift += 7
+
+
+def _read_string(buf, pos):
+    size, pos = _read_long(buf, pos)
+    return buf[pos:pos + size].decode("utf-8"), pos + size
+
+
+def _read_block_count(buf, pos):
+    # a negative count is followed by the size of the block in bytes
+    count, pos = _read_long(buf, pos)
+    if count < 0:
+        _, pos = _read_long(buf, pos)
+        count = -count
+    return count, pos
+
+
+def _read_long_array(buf, pos):
+    values = []
+    while True:
+        count, pos = _read_block_count(buf, pos)
+        if count == 0:
+            return values, pos
+        for _ in range(count):
+            v, pos = _read_long(buf, pos)
+            values.append(v)
+
+
+def _read_varints(buf, pos, count):
+    """`count` zig-zag varints starting at `pos`, as an int64 ndarray."""
+    b = np.frombuffer(buf, np.uint8, min(len(buf) - pos, 10 * count), pos)
+    ends = np.flatnonzero(b < 0x80)[:count]
+    if ends.size < count:
+        raise ValueError("truncated varint array")
+    b = b[:ends[-1] + 1]
+    starts = np.empty(count, np.intp)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    shift = np.arange(b.size, dtype=np.uint64) - np.repeat(starts, ends - starts + 1).astype(np.uint64)
+    z = np.bitwise_or.reduceat((b & 0x7F).astype(np.uint64) << (shift * np.uint64(7)), starts)
+    values = (z >> np.uint64(1)).view(np.int64) ^ -(z & np.uint64(1)).view(np.int64)
+    return values, pos + b.size
+
+
+def decode_header(data):
+    """
+    The MessageHeader fields (protocol, messageType, correlationId, messageId,
+    messageFlags) of an encoded message, and the position of its body.
+    """
+    fields, pos = [], 0
+    for _ in range(5):
+        value, pos = _read_long(data, pos)
+        fields.append(value)
+    return fields, pos
+
+
+def set_message_id(data, message_id):
+    """An encoded message with its header rewritten to carry `message_id`."""
+    (protocol, message_type, correlation_id, _, message_flags), pos = decode_header(data)
+    return encode_header(protocol, message_type, message_id, correlation_id, message_flags) + data[pos:]
+
+
+def decode_any_array(buf, pos):
+    """
+    Decode an AnyArray at `pos` into (item class, flat ndarray, end position).
+    The ndarray is None for string and bytes arrays.
+    """
+    branch, pos = _read_long(buf, pos)
+    variant = ANY_ARRAY_VARIANTS.get(branch)
+    if variant is None:
+        return None, None, pos
+    cls, dtype = variant
+    pieces = []
+    while True:
+        count, pos = _read_block_count(buf, pos)
+        if count == 0:
+            break
+        if dtype is None:
+            values, pos = _read_varints(buf, pos, count)
+        else:
+            values = np.frombuffer(buf, dtype, count, pos)
+            pos += count * dtype.itemsize
+        pieces.append(values)
+    if not pieces:
+        values = np.empty(0, np.int64 if dtype is None else dtype)
+    elif len(pieces) == 1:
+        values = pieces[0]
+    else:
+        values = np.concatenate(pieces)
+    if cls is ArrayOfInt:
+        values = values.astype(np.int32)
+    return cls, values, pos
+
+
+def decode_data_array_response(data):
+    """
+    Decode a GetDataArraysResponse or GetDataSubarraysResponse message without
+    building per-element Python objects: the item values of each DataArray are
+    an ndarray of the transport dtype (read-only for fixed-width types).
+    Returns None for any other message, or one this decoder does not handle
+    (compressed, header extension, string arrays); decode those with etpproto.
+    """
+    (protocol, message_type, correlation_id, message_id, message_flags), pos = decode_header(data)
+    if protocol != DATA_ARRAY_PROTOCOL or message_type not in DATA_ARRAY_RESPONSES:
+        return None
+    if message_flags & (COMPRESSED | HAS_HEADER_EXTENSION):
+        return None
+    data_arrays = {}
+    while True:
+        count, pos = _read_block_count(data, pos)
+        if count == 0:
+            break
+        for _ in range(count):
+            key, pos = _read_string(data, pos)
+            dimensions, pos = _read_long_array(data, pos)
+            cls, values, pos = decode_any_array(data, pos)
+            if values is None:
+                return None
+            data_arrays[key] = DataArray.construct(
+                dimensions=dimensions,
+                data=AnyArray.construct(item=cls.construct(values=values)),
+            )
+    response, field = DATA_ARRAY_RESPONSES[message_type]
+    header = MessageHeader.construct(
+        protocol=protocol,
+        message_type=message_type,
+        correlation_id=correlation_id,
+        message_id=message_id,
+        message_flags=message_flags,
+    )
+    return DecodedMessage(header, response.construct(**{field: data_arrays}))
+
+
+#
+# ETP message compression: the body of a message is gzipped and its header,
+# which stays plain, carries the Compressed flag.  Core messages are never
+# compressed.
+#
+def compress_message(data, level=zlib.Z_DEFAULT_COMPRESSION):
+    """
+    Gzip the body of an encoded message, given as bytes or as a list of buffers
+    whose first buffer is the header (see encode_put_data_arrays).
+    """
+    if isinstance(data, list):
+        header, body = data[0], data[1:]
+        (protocol, message_type, correlation_id, message_id, message_flags), _ = decode_header(header)
+    else:
+        (protocol, message_type, correlation_id, message_id, message_flags), pos = decode_header(data)
+        body = [memoryview(data)[pos:]]
+    if protocol == CORE_PROTOCOL or message_flags & COMPRESSED:
+        return data
+    gzip = zlib.compressobj(level, zlib.DEFLATED, 31)
+    out = [encode_header(protocol, message_type, message_id, correlation_id, message_flags | COMPRESSED)]
+    out.extend(gzip.compress(b) for b in body)
+    out.append(gzip.flush())
+    return b"".join(out)
+
+
+def decompress_message(data):
+    """The plain encoding of a message that may have a compressed body."""
+    (protocol, message_type, correlation_id, message_id, message_flags), pos = decode_header(data)
+    if not message_flags & COMPRESSED:
+        return data
+    return (
+        encode_header(protocol, message_type, message_id, correlation_id, message_flags & ~COMPRESSED)
+        + zlib.decompress(memoryview(data)[pos:], 31)
+    )
+
+
+def is_compressed(data):
+    return bool(decode_header(data)[0][4] & COMPRESSED)
+
+
+def subarray_blocks(shape, itemsize, max_bytes):
+    """
+    Split an array of `shape` into (starts, counts) blocks of at most
+    `max_bytes`, along the leading dimension.  When a single slice of the
+    leading dimension is too large, that slice is split along the next one.
+    """
+    shape = list(shape)
+    if not shape:
+        yield [], []
+        return
+    row_bytes = int(np.prod(shape[1:], dtype=np.int64)) * itemsize
+    if row_bytes <= max_bytes or len(shape) == 1:
+        rows = max(1, max_bytes // max(row_bytes, 1))
+        for start in range(0, shape[0], rows):
+            yield [start] + [0] * (len(shape) - 1), [min(rows, shape[0] - start)] + shape[1:]
+    else:
+        for i in range(shape[0]):
+            for starts, counts in subarray_blocks(shape[1:], itemsize, max_bytes):
+                yield [i] + starts, [1] + counts
+
+
+def block_slices(starts, counts):
+    return tuple(slice(s, s + c) for s, c in zip(starts, counts))
@@ -0,0 +1,731 @@
+"""
+Benchmarks for the ETP client, run against the in-process stand-in server.
+
+    python etp_benchmarks.py connect
+    python etp_benchmarks.py all
+"""
+import argparse
+import asyncio
+import contextlib
+import multiprocessing
+import resource
+import socket
+import statistics
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+
+from etptypes.energistics.etp.v12.datatypes.object.data_object import DataObject
+from etptypes.energistics.etp.v12.protocol.store.put_data_objects import PutDataObjects
+from etptypes.energistics.etp.v12.protocol.data_array.put_data_arrays import PutDataArrays
+from etptypes.energistics.etp.v12.protocol.data_array.get_data_arrays_response import GetDataArraysResponse
+from etpproto.connection import ETPConnection
+from etpproto.messages import Message
+
+from etp_arrays import (
+    any_array_item,
+    encode_put_data_arrays,
+    encoded_size,
+    decode_data_array_response,
+    compress_message,
+    decompress_message,
+)
+from etpclient_helper import putDataObjectArray, hdfArrayRefs
+from etp_upload import UploadJob, UploadLedger
+from etp_session import EtpSession, EtpSessionPool, EtpConnectionError, encode_message
+from etp_standin_server import StandinEtpServer, dataspace_uri, now_us
+
+
+DATASPACE = "bench/standin"
+
+
+def report(name, values, unit="ms"):
+    print(
+        f"{name:<40s} median {statistics.median(values):9.3f} {unit}"
+        f"   min {min(values):9.3f} {unit}   max {max(values):9.3f} {unit}"
+    )
+
+
+def report_rate(name, count, nbytes, seconds):
+    print(f"{name:<40s} {count / seconds:10.1f} obj/s   {nbytes / seconds / 1e6:9.1f} MB/s")
+
+
+def populate(server, n_objects=0, object_size=4096, n_arrays=0, array_size=1 << 20):
+    """Fill the stand-in server with synthetic objects and float64 arrays."""
+    ds = dataspace_uri(DATASPACE)
+    object_uris = []
+    for _ in range(n_objects):
+        uri = f"{ds}/resqml20.obj_ContinuousProperty({uuid.uuid4()})"
+        server.add_object(uri, b"<x>" + b"0" * (object_size - 7) + b"</x>")
+        object_uris.append(uri)
+    epc_uri = f"{ds}/eml20.EpcExternalPartReference({uuid.uuid4()})"
+    arrays = []
+    for i in range(n_arrays):
+        pir = f"/RESQML/{uuid.uuid4()}/values_{i}"
+        server.add_array(epc_uri, pir, np.random.rand(array_size // 8))
+        arrays.append((epc_uri, pir))
+    return object_uris, arrays
+
+
+def make_data_objects(n_objects, object_size=4096):
+    ds = dataspace_uri(DATASPACE)
+    t = now_us()
+    return [
+        DataObject.parse_obj({
+            "resource": {
+                "uri": f"{ds}/resqml20.obj_ContinuousProperty({uuid.uuid4()})",
+                "alternateUris": [], "name": "bench", "sourceCount": None, "targetCount": None,
+                "lastChanged": t, "storeLastWrite": t, "storeCreated": t,
+                "activeStatus": "Inactive", "customData": {},
+            },
+            "format": "xml",
+            "blobId": None,
+            "data": b"<x>" + b"0" * (object_size - 7) + b"</x>",
+        })
+        for _ in range(n_objects)
+    ]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+#
+# session startup latency
+#
+def bench_connect(repeat=20):
+    with StandinEtpServer() as server:
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            session = EtpSession(server.host, server.port)
+            times.append((time.perf_counter() - t0) * 1e3)
+            session.close()
+        report("EtpSession connect + handshake", times)
+
+    port = free_port()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        try:
+            EtpSession("127.0.0.1", port)
+        except EtpConnectionError:
+            pass
+        times.append((time.perf_counter() - t0) * 1e3)
+    report("refused port, time to failure", times)
+
+
+#
+# crawl throughput against the size of the session pool
+#
+def bench_pool(sizes=(1, 2, 4, 8, 16), latency=0.002):
+    with StandinEtpServer(latency=latency) as server:
+        object_uris, arrays = populate(server, n_objects=2000, n_arrays=32)
+        for size in sizes:
+            with EtpSessionPool(server.host, server.port, size=size) as pool:
+                t0 = time.perf_counter()
+                objs = pool.run(pool.gather(*(pool.get_data_object(u) for u in object_uris)))
+                dt = time.perf_counter() - t0
+                nbytes = sum(len(do.data) for o in objs for do in o.values())
+                report_rate(f"pool={size:2d} GetDataObjects", len(objs), nbytes, dt)
+
+                t0 = time.perf_counter()
+                data = pool.run(pool.gather(*(pool.get_data_array(u, p) for u, p in arrays)))
+                dt = time.perf_counter() - t0
+                report_rate(f"pool={size:2d} GetDataArrays", len(data), sum(a.nbytes for a in data), dt)
+
+
+#
+# one GetDataObjects per object against batched GetDataObjects
+#
+def bench_objects(n_objects=5000, latency=0.002):
+    with StandinEtpServer(latency=latency) as server:
+        object_uris, _ = populate(server, n_objects=n_objects)
+        with EtpSession(server.host, server.port) as session:
+            for name, fetch in [
+                ("one URI per message", lambda: session.gather(*(session.get_data_object(u) for u in object_uris))),
+                ("batched GetDataObjects", lambda: session.get_data_objects(object_uris)),
+            ]:
+                requests = server.requests
+                t0 = time.perf_counter()
+                session.run(fetch())
+                dt = time.perf_counter() - t0
+                report_rate(f"{name} ({server.requests - requests} msgs)", n_objects, n_objects * 4096, dt)
+
+
+#
+# one acknowledged PutDataObjects per object against batched, windowed puts
+#
+def bench_put_objects(n_objects=2000, latency=0.001):
+    data_objects = make_data_objects(n_objects)
+    nbytes = sum(len(do.data) for do in data_objects)
+    with StandinEtpServer(latency=latency) as server:
+        with EtpSession(server.host, server.port) as session:
+
+            async def one_by_one():
+                for do in data_objects:
+                    await session.request(PutDataObjects.parse_obj({"dataObjects": {"0": do}}))
+
+            for name, put in [
+                ("one object per message", one_by_one),
+                ("batched PutDataObjects", lambda: session.put_data_object_list(data_objects)),
+            ]:
+                requests = server.requests
+                t0 = time.perf_counter()
+                session.run(put())
+                dt = time.perf_counter() - t0
+                report_rate(f"{name} ({server.requests - requests} msgs)", n_objects, nbytes, dt)
+
+
+#
+# fire-and-forget PutDataObjects paced by the send window
+#
+def bench_send_window(n_objects=2000, latency=0.002, windows=((4, 1 << 20), (16, 32 << 20), (256, 1 << 30))):
+    data_objects = make_data_objects(n_objects)
+    nbytes = sum(len(do.data) for do in data_objects)
+    with StandinEtpServer(latency=latency) as server:
+        for messages, max_bytes in windows:
+            with EtpSession(server.host, server.port, send_window_messages=messages, send_window_bytes=max_bytes) as session:
+
+                async def put():
+                    for do in data_objects:
+                        await session.send_no_wait(PutDataObjects.parse_obj({"dataObjects": {"0": do}}))
+                    await session.drain()
+
+                t0 = time.perf_counter()
+                session.run(put())
+                dt = time.perf_counter() - t0
+                stats = session.send_window.stats()
+                report_rate(f"window {messages:4d} msgs / {max_bytes >> 20:5d} MB", n_objects, nbytes, dt)
+                print(f"{'':<40s} {stats['stalls']:10d} stalls   {stats['stall_time']:9.3f} s stalled")
+
+
+#
+# listing a dataspace and filtering locally against server-side type filtering
+#
+def bench_discovery(n_objects=5000, n_properties=50, latency=0.002):
+    ds = dataspace_uri(DATASPACE)
+    with StandinEtpServer(latency=latency) as server:
+        populate(server, n_objects=n_objects)
+        for _ in range(n_properties):
+            server.add_object(f"{ds}/resqml20.obj_DiscreteProperty({uuid.uuid4()})", b"<x/>")
+        with EtpSession(server.host, server.port) as session:
+            t0 = time.perf_counter()
+            objs = session.sync.get_data_objects([r.uri for r in session.sync.get_resources(ds)])
+            found = [o for o in objs.values() if "DiscreteProperty" in o.resource.uri]
+            report_rate(f"fetch everything, filter ({len(found)} found)", len(found), 0, time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            objs = session.sync.get_data_objects(
+                [r.uri for r in session.sync.discover_resources(ds, ["resqml20.obj_DiscreteProperty"])]
+            )
+            report_rate(f"server-side type filter ({len(objs)} found)", len(objs), 0, time.perf_counter() - t0)
+
+
+#
+# properties of one grid by scanning the dataspace against a graph walk
+#
+def property_xml(support_uuid, epc_uuid, path):
+    return (
+        f"<ContinuousProperty><SupportingRepresentation><UUID>{support_uuid}</UUID></SupportingRepresentation>"
+        f"<Values><HdfProxy><UUID>{epc_uuid}</UUID></HdfProxy><PathInHdfFile>{path}</PathInHdfFile></Values>"
+        f"</ContinuousProperty>"
+    ).encode()
+
+
+def bench_graph_walk(n_grids=50, n_properties=8, latency=0.002, array_size=1 << 18):
+    ds = dataspace_uri(DATASPACE)
+    epc_uuid = uuid.uuid4()
+    grids = [uuid.uuid4() for _ in range(n_grids)]
+    with StandinEtpServer(latency=latency) as server:
+        for g in grids:
+            server.add_object(f"{ds}/resqml20.obj_UnstructuredGridRepresentation({g})", f"<Grid>{g}</Grid>".encode())
+            for _ in range(n_properties):
+                path = f"/RESQML/{uuid.uuid4()}/values"
+                server.add_object(f"{ds}/resqml20.obj_ContinuousProperty({uuid.uuid4()})", property_xml(g, epc_uuid, path))
+                server.add_array(f"{ds}/eml20.EpcExternalPartReference({epc_uuid})", path, np.random.rand(array_size // 8))
+        grid_uri = f"{ds}/resqml20.obj_UnstructuredGridRepresentation({grids[0]})"
+        with EtpSession(server.host, server.port) as session:
+
+            async def scan():
+                resources = await session.discover_resources(ds, ["resqml20.obj_ContinuousProperty"])
+                objs = await session.get_data_objects([r.uri for r in resources])
+                mine = [o for o in objs.values() if str(grids[0]).encode() in o.data]
+                return await asyncio.gather(*(
+                    session.get_data_array_chunked(epc_uri, pir)
+                    for o in mine for epc_uri, pir in hdfArrayRefs(o.data, ds)
+                ))
+
+            for name, walk in [
+                ("scan all properties", scan),
+                ("graph walk from the grid", lambda: session.get_supported_properties(grid_uri)),
+            ]:
+                t0 = time.perf_counter()
+                found = session.run(walk())
+                report_rate(f"{name} ({len(found)} found)", len(found), 0, time.perf_counter() - t0)
+
+
+#
+# re-pulling a mostly static dataspace in full against a delta sync
+#
+def bench_delta_sync(n_objects=2000, n_changed=10, latency=0.002):
+    ds = dataspace_uri(DATASPACE)
+    with StandinEtpServer(latency=latency) as server, tempfile.TemporaryDirectory() as directory:
+        object_uris, _ = populate(server, n_objects=n_objects)
+        with EtpSession(server.host, server.port) as session:
+            for name, change, full in [
+                ("first pull", 0, False),
+                ("full re-pull, nothing changed", 0, True),
+                ("delta pull, nothing changed", 0, False),
+                (f"delta pull, {n_changed} changed", n_changed, False),
+            ]:
+                for uri in object_uris[:change]:
+                    server.add_object(uri, f"<x>{uuid.uuid4()}</x>".encode())
+                t0 = time.perf_counter()
+                result = session.sync.pull_dataspace(ds, directory, full=full)
+                report_rate(
+                    f"{name} ({len(result['changed'])} fetched)",
+                    len(result["changed"]) + len(result["unchanged"]), 0, time.perf_counter() - t0,
+                )
+
+
+#
+# reading the same data objects again with and without the disk cache
+#
+def bench_object_cache(n_objects=2000, latency=0.002):
+    ds = dataspace_uri(DATASPACE)
+    with StandinEtpServer(latency=latency) as server, tempfile.TemporaryDirectory() as cache_dir:
+        populate(server, n_objects=n_objects)
+        for name, options in [("no cache", {}), ("disk cache", {"cache_dir": cache_dir})]:
+            for run in ("first session", "second session"):
+                with EtpSession(server.host, server.port, **options) as session:
+                    uris = [r.uri for r in session.sync.discover_resources(ds)]
+                    for read in ("read", "read again"):
+                        t0 = time.perf_counter()
+                        objs = session.sync.get_data_objects(uris)
+                        nbytes = sum(len(o.data) for o in objs.values())
+                        report_rate(f"{name}, {run}, {read}", len(objs), nbytes, time.perf_counter() - t0)
+
+
+#
+# downloading arrays again against opening them from the memory-mapped cache
+#
+def bench_array_cache(n_arrays=8, array_mb=64, latency=0.002):
+    with StandinEtpServer(latency=latency) as server, tempfile.TemporaryDirectory() as cache_dir:
+        _, arrays = populate(server, n_arrays=n_arrays, array_size=array_mb << 20)
+        nbytes = n_arrays * (array_mb << 20)
+        for name, options in [("no cache", {}), ("array cache", {"cache_dir": cache_dir})]:
+            for run in ("first session", "second session"):
+                with EtpSession(server.host, server.port, **options) as session:
+                    t0 = time.perf_counter()
+                    got = session.sync.gather(*(session.get_data_array_chunked(u, p) for u, p in arrays))
+                    opened = time.perf_counter() - t0
+                    for a in got:
+                        a.sum()
+                    report_rate(f"{name}, {run}, open", len(got), nbytes, opened)
+                    report_rate(f"{name}, {run}, open and read", len(got), nbytes, time.perf_counter() - t0)
+
+
+#
+# downloading a whole surface against reading windows of it through a RemoteArray
+#
+def bench_remote_array(shape=(4096, 4096), window=200, latency=0.002):
+    ds = dataspace_uri(DATASPACE)
+    epc_uri, pir = f"{ds}/eml20.EpcExternalPartReference({uuid.uuid4()})", "/RESQML/surface/zvalues"
+    with StandinEtpServer(latency=latency) as server:
+        server.add_array(epc_uri, pir, np.random.rand(*shape))
+        with EtpSession(server.host, server.port) as session:
+            t0 = time.perf_counter()
+            whole = session.sync.get_data_array_chunked(epc_uri, pir)
+            report_rate("whole array, then slice", 1, whole.nbytes, time.perf_counter() - t0)
+            z = session.sync.remote_array(epc_uri, pir)
+            for name, key in [
+                ("window", np.s_[1000:1000 + window, 500:500 + window]),
+                ("same window again", np.s_[1000:1000 + window, 500:500 + window]),
+                ("shifted window", np.s_[1100:1100 + window, 600:600 + window]),
+                ("one row", np.s_[2000]),
+            ]:
+                t0 = time.perf_counter()
+                values = z[key]
+                assert np.array_equal(values, whole[key])
+                report_rate(f"RemoteArray {name} ({z.fetched_blocks} blocks so far)", 1, values.nbytes, time.perf_counter() - t0)
+
+
+#
+# materialized listing and fetch against streaming with iter_objects
+#
+def bench_stream(n_objects=20000, latency=0.002):
+    ds = dataspace_uri(DATASPACE)
+    with StandinEtpServer(latency=latency) as server:
+        populate(server, n_objects=n_objects)
+        with EtpSession(server.host, server.port) as session:
+
+            async def materialized():
+                objs = await session.get_data_objects([r.uri for r in await session.get_resources(ds)])
+                first = time.perf_counter()
+                return first, sum(len(o.data) for o in objs.values())
+
+            async def streamed():
+                first, nbytes = None, 0
+                async for o in session.iter_objects(ds):
+                    first = first or time.perf_counter()
+                    nbytes += len(o.data)
+                return first, nbytes
+
+            for name, consume in [("materialized list", materialized), ("iter_objects", streamed)]:
+                tracemalloc.start()
+                t0 = time.perf_counter()
+                first, nbytes = session.run(consume())
+                elapsed = time.perf_counter() - t0
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                report_rate(name, n_objects, nbytes, elapsed)
+                print(f"{'':<40s} first object after {(first - t0) * 1e3:9.1f} ms   peak {peak / 1e6:9.1f} MB")
+
+
+#
+# setting up many dataspaces with and without the session's dataspace registry
+#
+def bench_dataspaces(n_dataspaces=200, n_existing=2000, latency=0.002):
+    with StandinEtpServer(latency=latency) as server:
+        for i in range(n_existing):
+            server.dataspace(f"bench/existing-{i}")
+        for name, ttl in [("listing on every add", 0), ("dataspace registry", 60)]:
+            with EtpSession(server.host, server.port, dataspace_ttl=ttl) as session:
+                paths = [f"bench/{name.replace(' ', '-')}-{i}" for i in range(n_dataspaces)]
+                requests = server.requests
+                t0 = time.perf_counter()
+                for path in paths:
+                    session.sync.add_dataspace(path)
+                for _ in range(3):
+                    session.sync.get_dataspaces()
+                elapsed = time.perf_counter() - t0
+                report_rate(f"{name} ({server.requests - requests} requests)", n_dataspaces, 0, elapsed)
+
+
+#
+# ingest committed message by message against one ETP transaction
+#
+def bench_transaction(n_objects=500, n_arrays=20, array_size=1 << 20, commit_cost=0.005, latency=0.002):
+    ds = dataspace_uri(DATASPACE)
+    epc_uri = f"{ds}/eml20.EpcExternalPartReference({uuid.uuid4()})"
+    arrays = [(epc_uri, f"/RESQML/{uuid.uuid4()}/values", np.random.rand(array_size // 8)) for _ in range(n_arrays)]
+    data_objects = make_data_objects(n_objects)
+    nbytes = sum(len(do.data) for do in data_objects) + n_arrays * array_size
+    with StandinEtpServer(latency=latency, commit_cost=commit_cost) as server:
+        with EtpSession(server.host, server.port) as session:
+
+            async def ingest():
+                # one PutDataObjects per object, as putDataObject sends the parts of an .epc
+                for do in data_objects:
+                    await session.send_no_wait(PutDataObjects.parse_obj({
+                        "dataObjects": {"0": do}, "pruneContainedObjects": False,
+                    }))
+                await session.drain()
+                await session.put_data_arrays(arrays)
+
+            async def in_transaction():
+                async with session.transaction(DATASPACE):
+                    await ingest()
+
+            for name, run in [("commit per message", ingest), ("one transaction", in_transaction)]:
+                commits = server.commits
+                t0 = time.perf_counter()
+                session.run(run())
+                report_rate(f"{name} ({server.commits - commits} commits)", n_objects + n_arrays, nbytes, time.perf_counter() - t0)
+
+
+#
+# starting an interrupted upload over against resuming it from its checkpoint
+#
+def bench_resume(n_objects=500, n_arrays=8, array_mb=32, latency=0.002):
+    ds = dataspace_uri(DATASPACE)
+    epc_uri = f"{ds}/eml20.EpcExternalPartReference({uuid.uuid4()})"
+    arrays = [(epc_uri, f"/RESQML/{uuid.uuid4()}/values", np.random.rand((array_mb << 20) // 8)) for _ in range(n_arrays)]
+    data_objects = make_data_objects(n_objects)
+    nbytes = n_arrays * (array_mb << 20)
+    with StandinEtpServer(latency=latency) as server, tempfile.TemporaryDirectory() as directory:
+        with EtpSession(server.host, server.port) as session:
+
+            async def upload(checkpoint, stop_after=None):
+                job = UploadJob(session, checkpoint)
+                try:
+                    run = asyncio.ensure_future(asyncio.gather(
+                        job.put_data_objects(data_objects), job.put_data_arrays(arrays),
+                    ))
+                    while stop_after is not None and not run.done() and job.sent < stop_after:
+                        await asyncio.sleep(0.001)
+                    if not run.done():
+                        run.cancel()  # the connection dropped
+                        with contextlib.suppress(asyncio.CancelledError):
+                            await run
+                    return job.sent, job.skipped
+                finally:
+                    job.close()
+
+            checkpoint = f"{directory}/upload.checkpoint"
+            sent, _ = session.run(upload(checkpoint, stop_after=n_objects + n_arrays))
+            print(f"{'interrupted after':<40s} {sent:10d} acknowledged")
+            for name, path in [("start over", f"{directory}/fresh.checkpoint"), ("resume from checkpoint", checkpoint)]:
+                t0 = time.perf_counter()
+                sent, skipped = session.run(upload(path))
+                report_rate(f"{name} ({sent} sent, {skipped} skipped)", n_objects + n_arrays, nbytes, time.perf_counter() - t0)
+
+
+#
+# re-uploading a model with one changed property, in full against
+# only the payloads whose content hash changed
+#
+def bench_dedup(n_objects=500, n_arrays=50, array_mb=8, latency=0.002):
+    ds = dataspace_uri(DATASPACE)
+    epc_uri = f"{ds}/eml20.EpcExternalPartReference({uuid.uuid4()})"
+    arrays = [(epc_uri, f"/RESQML/{uuid.uuid4()}/values", np.random.rand((array_mb << 20) // 8)) for _ in range(n_arrays)]
+    data_objects = make_data_objects(n_objects)
+    nbytes = n_arrays * (array_mb << 20)
+    with StandinEtpServer(latency=latency) as server, tempfile.TemporaryDirectory() as directory:
+        with EtpSession(server.host, server.port) as session:
+            ledger = UploadLedger(f"{directory}/uploads.ledger")
+            session.sync.put_changed_objects(data_objects, ledger)
+            session.sync.put_changed_arrays(arrays, ledger)
+            arrays[0][2][:] += 1.0
+
+            t0 = time.perf_counter()
+            objects = session.sync.put_changed_objects(data_objects, ledger)
+            counts = session.sync.put_changed_arrays(arrays, ledger)
+            report_rate(
+                f"changed only ({counts['sent']} arrays sent, {objects['skipped'] + counts['skipped']} skipped)",
+                n_objects + n_arrays, nbytes, time.perf_counter() - t0,
+            )
+
+            t0 = time.perf_counter()
+            session.sync.put_data_object_list(data_objects)
+            session.sync.put_data_arrays(arrays)
+            report_rate("upload everything", n_objects + n_arrays, nbytes, time.perf_counter() - t0)
+
+
+#
+# PutDataArrays through pydantic against the direct ndarray encoder
+#
+def _encode_pydantic(array, uri, pir):
+    pda = PutDataArrays.parse_obj({"dataArrays": {"0": {
+        "uid": {"uri": uri, "pathInResource": pir},
+        "array": {"dimensions": list(array.shape), "data": {"item": {"values": array.flatten().tolist()}}},
+        "customData": {},
+    }}})
+    return len(encode_message(pda, 2))
+
+
+def _encode_direct(array, uri, pir):
+    return encoded_size(encode_put_data_arrays([(uri, pir, array)], 2))
+
+
+def _encode_child(encode, n_elements, dtype, conn):
+    array = (np.random.rand(n_elements) * 1000).astype(dtype)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    nbytes = encode(array, "eml:///dataspace('bench')/eml20.EpcExternalPartReference(x)", "/values")
+    dt = time.perf_counter() - t0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    conn.send((dt, nbytes, (peak - baseline) / 1024))
+
+
+def bench_encode(n_elements=4_000_000, dtypes=("float64", "int64", "bool")):
+    ctx = multiprocessing.get_context("spawn")
+    for dtype in dtypes:
+        for name, encode in [("pydantic", _encode_pydantic), ("direct", _encode_direct)]:
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_encode_child, args=(encode, n_elements, dtype, child))
+            proc.start()
+            dt, nbytes, peak_mb = parent.recv()
+            proc.join()
+            print(
+                f"{dtype:>8s} {name:<10s} {n_elements / dt / 1e6:9.2f} M elements/s"
+                f"   {nbytes / 1e6:8.1f} MB message   peak RSS +{peak_mb:8.1f} MB"
+            )
+
+
+#
+# GetDataArraysResponse through etpproto/pydantic against the direct decoder
+#
+def _decode_etpproto(data):
+    msg = Message.decode_binary_message(data, dict_map_pro_to_class=ETPConnection.generic_transition_table)
+    (da,) = msg.body.data_arrays.values()
+    return np.array(da.data.item.values).reshape(da.dimensions)
+
+
+def _decode_direct(data):
+    (da,) = decode_data_array_response(data).body.data_arrays.values()
+    return np.asarray(da.data.item.values).reshape(da.dimensions)
+
+
+def bench_decode(n_elements=4_000_000, dtypes=("float64", "int64", "bool"), repeat=3):
+    for dtype in dtypes:
+        array = (np.random.rand(n_elements) * 1000).astype(dtype)
+        item, _ = any_array_item(array)
+        data = encode_message(GetDataArraysResponse.parse_obj(
+            {"dataArrays": {"0": {"dimensions": [n_elements], "data": {"item": item}}}}
+        ), 3)
+        for name, decode in [("etpproto", _decode_etpproto), ("direct", _decode_direct)]:
+            times = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                result = decode(data)
+                times.append(time.perf_counter() - t0)
+            assert np.array_equal(result, array)
+            dt = min(times)
+            print(
+                f"{dtype:>8s} {name:<10s} {n_elements / dt / 1e6:9.2f} M elements/s"
+                f"   {len(data) / dt / 1e6:9.1f} MB/s"
+            )
+
+
+#
+# gzip CPU time against bytes saved on the wire
+#
+LINK_SPEEDS_MBIT = (100, 1000, 10000)
+
+
+def typical_arrays(n=1000):
+    """Arrays shaped like the Grid2d surface and the hexa mesh properties."""
+    x, y = np.meshgrid(np.linspace(0, 8, n), np.linspace(0, 5, n))
+    surface = 2000 + 150 * np.sin(x) * np.cos(y) + np.random.normal(0, 0.5, x.shape)
+    surface[:, : n // 10] = 1e33  # xtgeo missing values
+    return {
+        "surface float64": surface,
+        "porosity float32": np.random.uniform(0.05, 0.35, n * n).astype(np.float32),
+        "temperature float64": np.repeat(np.linspace(5, 250, n), n) + np.random.normal(0, 0.01, n * n),
+        "layer id int32": np.repeat(np.arange(40, dtype=np.int32), n * n // 40),
+        "handedness bool": np.random.rand(n * n) < 0.5,
+    }
+
+
+def bench_compress(levels=(1, 6), link_speeds=LINK_SPEEDS_MBIT):
+    uri = "eml:///dataspace('bench')/eml20.EpcExternalPartReference(x)"
+    print(f"{'':<22s}{'':>6s}{'ratio':>7s}{'gzip MB/s':>11s}{'gunzip MB/s':>13s}"
+          + "".join(f"{f'{m} Mbit/s':>14s}" for m in link_speeds))
+    for name, array in typical_arrays().items():
+        data = b"".join(bytes(b) for b in encode_put_data_arrays([(uri, "/values", array)], 2))
+        wire = {m: len(data) * 8 / (m * 1e6) for m in link_speeds}
+        print(f"{name:<22s}{'plain':>6s}{1.0:7.2f}{'':>11s}{'':>13s}"
+              + "".join(f"{wire[m] * 1e3:11.1f} ms" for m in link_speeds))
+        for level in levels:
+            t0 = time.perf_counter()
+            compressed = compress_message(data, level)
+            t_gzip = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            decompress_message(compressed)
+            t_gunzip = time.perf_counter() - t0
+            total = {m: t_gzip + t_gunzip + len(compressed) * 8 / (m * 1e6) for m in link_speeds}
+            print(f"{'':<22s}{f'gzip {level}':>6s}{len(data) / len(compressed):7.2f}"
+                  f"{len(data) / t_gzip / 1e6:11.1f}{len(data) / t_gunzip / 1e6:13.1f}"
+                  + "".join(f"{total[m] * 1e3:11.1f} ms" for m in link_speeds))
+
+
+#
+# single PutDataArrays message against chunked PutDataSubarrays
+#
+ARRAY_SIZES_MB = (1, 8, 64, 512, 4096)
+
+
+def bench_put_arrays(sizes_mb=ARRAY_SIZES_MB, latency=0.002):
+    ds = dataspace_uri(DATASPACE)
+    epc_uri = f"{ds}/eml20.EpcExternalPartReference({uuid.uuid4()})"
+    with StandinEtpServer(latency=latency) as server:
+        with EtpSession(server.host, server.port) as session:
+            for size_mb in sizes_mb:
+                array = np.random.rand(size_mb * (1 << 20) // 8).reshape(-1, 1024)
+                if array.nbytes < session.max_message_size // 2:
+                    pda = {"dataArrays": {"0": {
+                        "uid": {"uri": epc_uri, "pathInResource": f"/single/{size_mb}"},
+                        "array": {"dimensions": list(array.shape), "data": {"item": {"values": array.flatten().tolist()}}},
+                        "customData": {},
+                    }}}
+                    t0 = time.perf_counter()
+                    session.run(putDataObjectArray(session, pda))
+                    report_rate(f"{size_mb:5d} MB single PutDataArrays", 1, array.nbytes, time.perf_counter() - t0)
+                else:
+                    print(f"{size_mb:5d} MB single PutDataArrays              exceeds the message size")
+                t0 = time.perf_counter()
+                session.sync.put_data_array(epc_uri, f"/chunked/{size_mb}", array)
+                report_rate(f"{size_mb:5d} MB chunked PutDataSubarrays", 1, array.nbytes, time.perf_counter() - t0)
+                del array
+
+
+#
+# single GetDataArrays message against parallel GetDataSubarrays tiles
+#
+def bench_get_arrays(sizes_mb=(1, 8, 64, 512), latency=0.002):
+    with StandinEtpServer(latency=latency) as server:
+        with EtpSession(server.host, server.port) as session:
+            for size_mb in sizes_mb:
+                _, [(uri, pir)] = populate(server, n_arrays=1, array_size=size_mb << 20)
+                if size_mb << 20 < session.max_message_size // 2:
+                    t0 = time.perf_counter()
+                    a = session.sync.get_data_array(uri, pir)
+                    report_rate(f"{size_mb:5d} MB single GetDataArrays", 1, a.nbytes, time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                a = session.sync.get_data_array_chunked(uri, pir)
+                report_rate(f"{size_mb:5d} MB GetDataSubarrays tiles", 1, a.nbytes, time.perf_counter() - t0)
+                del a
+
+
+#
+# fixed tiles against tiles sized by the session's TransferTuner
+#
+def bench_adaptive(size_mb=64, latencies=(0.0005, 0.02)):
+    settings = [
+        ("fixed 1 MB x 4", {"chunk_bytes": 1 << 20, "depth": 4}),
+        ("fixed message size x 4", {"depth": 4}),
+        ("adaptive", {}),
+    ]
+    for latency in latencies:
+        with StandinEtpServer(latency=latency) as server:
+            _, [(uri, pir)] = populate(server, n_arrays=1, array_size=size_mb << 20)
+            for name, options in settings:
+                with EtpSession(server.host, server.port) as session:
+                    for run in ("first", "second"):
+                        session.sync.get_data_array_chunked(uri, pir, **options)
+                        stats = session.transfer_stats[-1].summary()
+                        report_rate(f"{latency * 1e3:5.1f} ms {name} ({run})", 1, stats["bytes"], stats["seconds"])
+                        if stats["tile_bytes"]:
+                            print(f"{'':<40s} {stats['tiles']:6d} tiles, last {stats['tile_bytes'] >> 10} kB x {stats['depth']}")
+
+
+BENCHMARKS = {
+    "connect": bench_connect,
+    "pool": bench_pool,
+    "objects": bench_objects,
+    "put-objects": bench_put_objects,
+    "send-window": bench_send_window,
+    "discovery": bench_discovery,
+    "graph-walk": bench_graph_walk,
+    "delta-sync": bench_delta_sync,
+    "object-cache": bench_object_cache,
+    "array-cache": bench_array_cache,
+    "remote-array": bench_remote_array,
+    "stream": bench_stream,
+    "dataspaces": bench_dataspaces,
+    "transaction": bench_transaction,
+    "resume": bench_resume,
+    "dedup": bench_dedup,
+    "encode": bench_encode,
+    "decode": bench_decode,
+    "compress": bench_compress,
+    "put-arrays": bench_put_arrays,
+    "get-arrays": bench_get_arrays,
+    "adaptive": bench_adaptive,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=list(BENCHMARKS) + ["all"])
+    args = parser.parse_args()
+    for name, bench in BENCHMARKS.items():
+        if args.benchmark in (name, "all"):
+            print(f"== {name}")
+            bench()
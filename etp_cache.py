@@ -0,0 +1,215 @@
+"""
+Local caches of what the server holds, shared between sessions and processes
+through a directory.
+
+An entry is keyed by the URI and the lastChanged of the resource it was read
+from, so it is valid as long as the server reports the same lastChanged.  The
+object cache remembers the lastChanged it sees in discovery and GetDataObjects
+responses for `ttl` seconds; until then, or until the resource is put again
+by the session, reads of it are served from disk.  Writes by other clients
+are seen once the lastChanged is reported again or has expired.  The array cache is checked against the storeLastWrite of
+the array's GetDataArrayMetadata.  Files are evicted least recently used first
+(their mtime is bumped on every hit) once the directory holds more than
+`max_bytes`.
+"""
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+
+from etptypes.energistics.etp.v12.datatypes.object.data_object import DataObject
+
+
+DEFAULT_OBJECT_CACHE_BYTES = 256 << 20
+DEFAULT_OBJECT_CACHE_TTL = 30.0
+DEFAULT_ARRAY_CACHE_BYTES = 8 << 30
+
+
+class DirectoryLRU:
+    """Files under one directory, evicted by mtime once they exceed max_bytes."""
+
+    def __init__(self, directory, max_bytes, suffix):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(e.stat().st_size for e in self._entries())
+
+    def _entries(self):
+        return [e for e in os.scandir(self.directory) if e.name.endswith(self.suffix)]
+
+    def path(self, *key):
+        stem = hashlib.sha1("\0".join(str(k) for k in key[:-1]).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{stem}_{key[-1]}{self.suffix}")
+
+    def touch(self, path):
+        """Return whether `path` is cached, marking it as recently used."""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def stored(self, path, replaces=None):
+        """Account for a file just written to `path`, removing the version it `replaces`."""
+        if replaces is not None and replaces != path:
+            self._remove(replaces)
+        self.size += os.path.getsize(path)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self.size -= size
+        except OSError:  # gone already, or still mapped on Windows
+            pass
+
+    def evict(self):
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime)
+        self.size = sum(e.stat().st_size for e in entries)
+        for e in entries:
+            if self.size <= self.max_bytes:
+                break
+            self._remove(e.path)
+
+
+class ObjectCache:
+    """
+    Data-object XML on disk, keyed by (URI, lastChanged).  Each file holds the
+    Resource as one JSON line followed by the XML.  A lastChanged reported by
+    the server is trusted for `ttl` seconds.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_OBJECT_CACHE_BYTES, ttl=DEFAULT_OBJECT_CACHE_TTL):
+        self.files = DirectoryLRU(directory, max_bytes, ".xml")
+        self.ttl = ttl
+        self.last_changed = {}  # uri -> (lastChanged, time.monotonic() when reported)
+        self.hits = 0
+        self.misses = 0
+
+    def seen(self, resources):
+        """Remember the lastChanged the server reported for these Resources."""
+        now = time.monotonic()
+        for r in resources:
+            self.last_changed[r.uri] = (r.last_changed, now)
+
+    def current(self, uri):
+        """The lastChanged last reported for `uri`, or None if unknown or expired."""
+        entry = self.last_changed.get(uri)
+        if entry is None or time.monotonic() - entry[1] >= self.ttl:
+            return None
+        return entry[0]
+
+    def forget(self, uris):
+        """Stop trusting the cached copies of `uris`, e.g. after putting them."""
+        for uri in uris:
+            self.last_changed.pop(uri, None)
+
+    def get(self, uri):
+        """The cached DataObject of `uri`, or None if it is not known to be current."""
+        last_changed = self.current(uri)
+        path = self.files.path(uri, last_changed)
+        if last_changed is None or not self.files.touch(path):
+            self.misses += 1
+            return None
+        with open(path, "rb") as f:
+            resource = json.loads(f.readline())
+            data = f.read()
+        self.hits += 1
+        return DataObject.parse_obj({"resource": resource, "format": "xml", "blobId": None, "data": data})
+
+    def put(self, do):
+        """Store a DataObject read from the server."""
+        resource = do.resource
+        previous = self.last_changed.get(resource.uri)
+        self.seen([resource])
+        path = self.files.path(resource.uri, resource.last_changed)
+        if self.files.touch(path):  # the same version, fetched again once its lastChanged expired
+            return
+        part = _part_path(path)
+        with open(part, "wb") as f:
+            f.write(resource.json(by_alias=True).encode("utf-8") + b"\n")
+            f.write(do.data)
+        os.replace(part, path)
+        self.files.stored(path, previous and self.files.path(resource.uri, previous[0]))
+
+
+class ArrayCache:
+    """
+    Data arrays as .npy files, keyed by (EpcExternalPartReference URI,
+    pathInResource, storeLastWrite).  Hits are returned as copy-on-write
+    np.memmap views: opening one reads nothing until it is indexed, and
+    writing to it does not touch the cached file.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_ARRAY_CACHE_BYTES):
+        self.files = DirectoryLRU(directory, max_bytes, ".npy")
+        self.paths = {}  # (uri, pir) -> the version last stored by this process
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, uri, pir, last_write):
+        path = self.files.path(uri, pir, last_write)
+        if not self.files.touch(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return np.load(path, mmap_mode="c")
+
+    def put(self, uri, pir, last_write, array):
+        """Store an array read from the server; returns the cached view."""
+        path = self.files.path(uri, pir, last_write)
+        part = _part_path(path)
+        with open(part, "wb") as f:
+            np.save(f, array)
+        return self._stored(uri, pir, part, path)
+
+    def create(self, uri, pir, last_write, shape, dtype):
+        """
+        An array to download into, backed by a file in the cache directory so
+        that it never has to fit in memory; `publish` it once it is filled in,
+        or `discard` it.  Each download gets its own file, so concurrent
+        downloads of the same array do not write over each other.
+        """
+        if not all(shape):
+            return np.empty(shape, dtype)
+        path = self.files.path(uri, pir, last_write)
+        return np.lib.format.open_memmap(_part_path(path), mode="w+", dtype=dtype, shape=tuple(shape))
+
+    def publish(self, uri, pir, last_write, array):
+        if not isinstance(array, np.memmap):
+            return self.put(uri, pir, last_write, array)
+        array.flush()
+        return self._stored(uri, pir, array.filename, self.files.path(uri, pir, last_write))
+
+    def discard(self, array):
+        """Drop an array from `create` that will not be published."""
+        if isinstance(array, np.memmap):
+            _remove_part(array.filename)
+
+    def _stored(self, uri, pir, part, path):
+        if self.files.touch(path):  # published meanwhile by another download of the same version
+            _remove_part(part)
+            return np.load(path, mmap_mode="c")
+        os.replace(part, path)
+        view = np.load(path, mmap_mode="c")  # before eviction can remove the file
+        self.files.stored(path, self.paths.get((uri, pir)))
+        self.paths[(uri, pir)] = path
+        return view
+
+
+def _part_path(path):
+    """A temporary name for `path` that no other writer, thread or process, uses."""
+    return f"{path}.{os.getpid()}.{uuid.uuid4().hex}.part"
+
+
+def _remove_part(part):
+    try:
+        os.remove(part)
+    except OSError:  # gone already, or still mapped on Windows
+        pass
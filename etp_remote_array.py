@@ -0,0 +1,185 @@
+"""
+Lazy, ndarray-like view of an array held by the ETP server.
+
+Indexing a RemoteArray fetches only the blocks of the array that the index
+touches, with one GetDataSubarrays request per block, and keeps the blocks in
+an LRU cache so that browsing neighbouring windows does not fetch them again:
+
+    with EtpSession('127.0.0.1', 9002) as session:
+        z = session.sync.remote_array(epc_uri, path_in_resource)
+        window = z[1000:1200, 500:700]      # a few blocks, not the whole surface
+
+Plain indexing blocks on the session loop; async code awaits `fetch(key)`.
+Integer and slice indices (with steps) and Ellipsis are supported.
+"""
+import asyncio
+import collections
+import itertools
+import operator
+
+import numpy as np
+
+from etp_arrays import TRANSPORT_ITEMSIZE, transport_type, array_dtype
+from etpclient_helper import getDataArrayMetadata, getDataSubarray, subarrayBytes
+
+
+DEFAULT_BLOCK_BYTES = 1 << 20
+DEFAULT_REMOTE_CACHE_BYTES = 256 << 20
+
+
+def block_shape(shape, itemsize, max_bytes, preferred=()):
+    """
+    The shape of the blocks an array is fetched in: the server's preferred
+    subarray dimensions when it gives them, otherwise the array shape with its
+    largest dimension halved until a block is at most `max_bytes`.
+    """
+    if preferred and len(preferred) == len(shape) and all(preferred):
+        return [min(p, n) for p, n in zip(preferred, shape)]
+    block = [max(n, 1) for n in shape]
+    while block and int(np.prod(block, dtype=np.int64)) * itemsize > max_bytes and max(block) > 1:
+        i = block.index(max(block))
+        block[i] = (block[i] + 1) // 2
+    return block
+
+
+class RemoteArray:
+    """
+    An array on the server, addressed by EpcExternalPartReference `uri` and
+    `pir` (pathInResource), described by its DataArrayMetadata.  Build it with
+    `RemoteArray.open` or `EtpSession.remote_array`.
+    """
+
+    def __init__(self, session, uri, pir, metadata, block_bytes=DEFAULT_BLOCK_BYTES, cache_bytes=DEFAULT_REMOTE_CACHE_BYTES):
+        self.session = session
+        self.uri = uri
+        self.pir = pir
+        self.metadata = metadata
+        self.shape = tuple(metadata.dimensions)
+        self.dtype = array_dtype(metadata)
+        itemsize = TRANSPORT_ITEMSIZE[transport_type(metadata)]
+        self.block = block_shape(
+            self.shape, itemsize, min(block_bytes, subarrayBytes(session)),
+            metadata.preferred_subarray_dimensions,
+        )
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.fetched_blocks = 0
+        self._blocks = collections.OrderedDict()
+        self._loading = {}
+
+    @classmethod
+    async def open(cls, session, uri, pir, **options):
+        """Read the array's metadata; returns None when the server has no such array."""
+        found = await getDataArrayMetadata(session, uri, pir)
+        if not found:
+            return None
+        (metadata,) = found.values()
+        return cls(session, uri, pir, metadata, **options)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        if not self.shape:
+            raise TypeError("len() of unsized object")
+        return self.shape[0]
+
+    def __repr__(self):
+        return f"RemoteArray({self.uri!r}, {self.pir!r}, shape={self.shape}, dtype={self.dtype})"
+
+    def __getitem__(self, key):
+        return self.session.run(self.fetch(key))
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[...]
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    async def fetch(self, key=Ellipsis):
+        """The values at `key`, fetching the blocks not cached yet."""
+        ranges = self._ranges(key)
+        out_shape = [len(r) for r in ranges if isinstance(r, range)]
+        if not all(out_shape):
+            return np.empty(out_shape, self.dtype)
+        lo = [min(r[0], r[-1]) if isinstance(r, range) else r for r in ranges]
+        hi = [max(r[0], r[-1]) + 1 if isinstance(r, range) else r + 1 for r in ranges]
+        region = await self._region(lo, hi)
+        local = tuple(
+            slice(r.start - l, r.stop - l if r.stop - l >= 0 else None, r.step) if isinstance(r, range) else r - l
+            for r, l in zip(ranges, lo)
+        )
+        return region[local]
+
+    def _ranges(self, key):
+        """Per dimension, an int index or the range of indices selected by `key`."""
+        if not isinstance(key, tuple):
+            key = (key,)
+        ellipses = [i for i, k in enumerate(key) if k is Ellipsis]
+        if len(ellipses) > 1:
+            raise IndexError("an index can only have a single ellipsis ('...')")
+        if ellipses:
+            i = ellipses[0]
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1:]
+        if len(key) > self.ndim:
+            raise IndexError(f"too many indices for array: array is {self.ndim}-dimensional, but {len(key)} were indexed")
+        key = key + (slice(None),) * (self.ndim - len(key))
+        ranges = []
+        for axis, (k, n) in enumerate(zip(key, self.shape)):
+            if isinstance(k, slice):
+                ranges.append(range(*k.indices(n)))
+                continue
+            i = operator.index(k)
+            if not -n <= i < n:
+                raise IndexError(f"index {i} is out of bounds for axis {axis} with size {n}")
+            ranges.append(i % n)
+        return ranges
+
+    async def _region(self, lo, hi):
+        """The dense block [lo, hi) of the array, assembled from cached blocks."""
+        region = np.empty([h - l for l, h in zip(lo, hi)], self.dtype)
+        indices = list(itertools.product(*(
+            range(l // b, (h - 1) // b + 1) for l, h, b in zip(lo, hi, self.block)
+        )))
+        blocks = await asyncio.gather(*(self._get_block(index) for index in indices))
+        for index, block in zip(indices, blocks):
+            starts = [i * b for i, b in zip(index, self.block)]
+            src, dst = [], []
+            for l, h, s, c in zip(lo, hi, starts, block.shape):
+                a, z = max(l, s), min(h, s + c)
+                src.append(slice(a - s, z - s))
+                dst.append(slice(a - l, z - l))
+            region[tuple(dst)] = block[tuple(src)]
+        return region
+
+    async def _get_block(self, index):
+        block = self._blocks.get(index)
+        if block is not None:
+            self._blocks.move_to_end(index)
+            return block
+        task = self._loading.get(index)
+        if task is None:
+            task = self._loading[index] = asyncio.ensure_future(self._load_block(index))
+            task.add_done_callback(lambda _: self._loading.pop(index, None))
+        return await task
+
+    async def _load_block(self, index):
+        starts = [i * b for i, b in zip(index, self.block)]
+        counts = [min(b, n - s) for b, n, s in zip(self.block, self.shape, starts)]
+        block = await getDataSubarray(self.session, self.uri, self.pir, starts, counts, self.dtype)
+        if block is None:
+            raise LookupError(f"no data for block {starts} of {self.pir} in {self.uri}")
+        self.fetched_blocks += 1
+        self._blocks[index] = block
+        self.cached_bytes += block.nbytes
+        while self.cached_bytes > self.cache_bytes and len(self._blocks) > 1:
+            _, old = self._blocks.popitem(last=False)
+            self.cached_bytes -= old.nbytes
+        return block
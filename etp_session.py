@@ -0,0 +1,1052 @@
+import asyncio
+import collections
+import contextlib
+import functools
+import inspect
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+import websockets
+
+from etpproto.connection import ETPConnection
+from etpproto.messages import Message, MessageFlags
+
+from etptypes.energistics.etp.v12.protocol.core.request_session import RequestSession
+from etptypes.energistics.etp.v12.protocol.core.close_session import CloseSession
+
+from etp_arrays import (
+    encoded_size,
+    coalesce,
+    decode_data_array_response,
+    compress_message,
+    decompress_message,
+    is_compressed,
+    set_message_id,
+)
+from etp_cache import (
+    ObjectCache, ArrayCache, DEFAULT_OBJECT_CACHE_BYTES, DEFAULT_OBJECT_CACHE_TTL, DEFAULT_ARRAY_CACHE_BYTES,
+)
+from etp_sync import pull_dataspace
+from etp_remote_array import RemoteArray
+from etp_upload import resumable_upload, put_changed_arrays, put_changed_objects
+from etpclient_helper import (
+    EtpError,
+    EtpConnectionError,
+    EtpTransactionError,
+    startTransaction,
+    commitTransaction,
+    rollbackTransaction,
+    getDataspaces,
+    deleteDataspace,
+    addDataspace,
+    putDataObjects,
+    putEpcDataObjects,
+    putDataArrays,
+    getResources,
+    discoverResources,
+    getDataObject,
+    getDataObjects,
+    iterDataObjects,
+    getDataArray,
+    getDataArrays,
+    getDataArrayMetadata,
+    putDataArrayChunked,
+    getDataArrayChunked,
+    getSupportedProperties,
+    PROPERTY_TYPES,
+    TransferTuner,
+    DEFAULT_PUT_WINDOW,
+    DEFAULT_PREFETCH_OBJECTS,
+    DataspaceRegistry,
+    DEFAULT_DATASPACE_TTL,
+)
+
+
+ETP_SUBPROTOCOL = "etp12.energistics.org"
+
+# ETP protocol numbers requested when opening a session
+CORE, DISCOVERY, STORE, DATA_ARRAY, TRANSACTION, DATASPACE = 0, 3, 4, 9, 18, 24
+REQUESTED_PROTOCOLS = [DISCOVERY, STORE, DATA_ARRAY, TRANSACTION, DATASPACE]
+
+DEFAULT_MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+DEFAULT_MAX_IN_FLIGHT = 64
+
+# Credits of the send window for fire-and-forget messages (send_no_wait)
+DEFAULT_SEND_WINDOW_MESSAGES = 16
+DEFAULT_SEND_WINDOW_BYTES = 32 * 1024 * 1024
+
+# ETP message compression offered when opening a session; only messages of at
+# least DEFAULT_COMPRESSION_THRESHOLD bytes are compressed
+DEFAULT_COMPRESSION = "gzip"
+DEFAULT_COMPRESSION_THRESHOLD = 64 * 1024
+DEFAULT_COMPRESSION_LEVEL = 1
+
+
+def server_uri(serv_url, serv_port=None, serv_sub_path=None):
+    use_wss = 'azure' in serv_url
+    serv_uri = (
+        str(serv_url)
+        + (":" + str(serv_port) if serv_port else "")
+        + "/"
+        + (serv_sub_path + "/" if serv_sub_path else "")
+    )
+    protocol = "wss://" if use_wss else "ws://"
+    return protocol + serv_uri
+
+
+def encode_message(body, message_id, correlation_id=0, message_flags=MessageFlags.FINALPART):
+    msg = Message.get_object_message(
+        body, message_flags=message_flags, correlation_id=correlation_id
+    )
+    msg.header.message_id = message_id
+    return msg.encode_message()
+
+
+def decode_message(data):
+    data = decompress_message(data)
+    # array responses are decoded straight into ndarrays, everything else by etpproto
+    msg = decode_data_array_response(data)
+    if msg is not None:
+        return msg
+    return Message.decode_binary_message(
+        data, dict_map_pro_to_class=ETPConnection.generic_transition_table
+    )
+
+
+def is_final(msg):
+    return bool(msg.header.message_flags & MessageFlags.FINALPART)
+
+
+def is_protocol_exception(body):
+    return type(body).__name__ == "ProtocolException"
+
+
+# Field holding the payload of the responses that etpclient's WebSocketManager
+# used to unwrap for us.  Kept so that the helpers in etpclient_helper work
+# unchanged on top of an EtpSession.
+_RESPONSE_FIELDS = {
+    "GetDataspacesResponse": "dataspaces",
+    "GetResourcesResponse": "resources",
+    "GetDataObjectsResponse": "data_objects",
+    "GetDataArrayMetadataResponse": "array_metadata",
+    "PutDataObjectsResponse": "success",
+    "PutDataArraysResponse": "success",
+}
+
+
+def unwrap_response(bodies):
+    """Merge the parts of a (possibly multipart) response into its payload."""
+    bodies = [b for b in bodies if not is_protocol_exception(b)]
+    if not bodies:
+        return None
+    name = type(bodies[0]).__name__
+    if name == "GetDataArraysResponse":
+        data_arrays = {}
+        for body in bodies:
+            data_arrays.update(body.data_arrays)
+        arrays = [
+            np.array(da.data.item.values).reshape(da.dimensions)
+            for da in data_arrays.values()
+        ]
+        return arrays[0] if len(arrays) == 1 else arrays
+    field = _RESPONSE_FIELDS.get(name)
+    if field is None:
+        return bodies[-1]
+    merged = getattr(bodies[0], field)
+    for body in bodies[1:]:
+        part = getattr(body, field)
+        if isinstance(merged, dict):
+            merged.update(part)
+        else:
+            merged = merged + part
+    return merged
+
+
+class EtpSession:
+    """
+    A long-lived ETP session.
+
+    The session owns one event loop, running in a background thread, and one
+    websocket connection speaking ETP 1.2 directly.  All requests are coroutines
+    scheduled on that loop, so a full dataspace pull no longer creates and tears
+    down an event loop per call.
+
+    Async code awaits the methods directly (on the session's loop, see `run`),
+    while plain scripts go through the thin synchronous facade:
+
+        session = EtpSession('127.0.0.1', 9002)
+        gds = session.sync.get_dataspaces()
+
+    The session also implements `send_and_wait` / `send_no_wait`, so it can be
+    passed to the helpers in etpclient_helper in place of a WebSocketManager.
+
+    Passing an already running `loop` (see EtpSessionPool) makes the session
+    live on that loop instead of its own; it must then be connected with
+    `await session.connect()`.
+
+    The session offers ETP message `compression` (gzip) when it opens; once the
+    server accepts it, messages of at least `compression_threshold` bytes are
+    compressed, and compressed responses decompressed, in a worker thread.
+    Websocket permessage-deflate compresses every frame on the loop thread and
+    is only negotiated with `permessage_deflate=True`.
+
+    Fire-and-forget messages (`send_no_wait`) go through `send_window`: at most
+    `send_window_messages` messages and `send_window_bytes` bytes are sent and
+    not yet answered by the server, further sends wait for credit.
+
+    The dataspace listing is kept for `dataspace_ttl` seconds and updated by
+    the session's own add/delete_dataspace calls (see DataspaceRegistry).
+
+    With a `cache_dir`, data objects and arrays read are kept on disk (see
+    etp_cache) and read again from there while the server reports the same
+    lastChanged for them; a lastChanged seen is trusted for `object_cache_ttl`
+    seconds.  Cached arrays come back as np.memmap views.
+    """
+
+    def __init__(
+        self,
+        serv_url,
+        serv_port=None,
+        serv_sub_path=None,
+        serv_token=None,
+        connect=True,
+        loop=None,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+        compression=DEFAULT_COMPRESSION,
+        compression_threshold=DEFAULT_COMPRESSION_THRESHOLD,
+        compression_level=DEFAULT_COMPRESSION_LEVEL,
+        permessage_deflate=False,
+        send_window_messages=DEFAULT_SEND_WINDOW_MESSAGES,
+        send_window_bytes=DEFAULT_SEND_WINDOW_BYTES,
+        cache_dir=None,
+        object_cache_bytes=DEFAULT_OBJECT_CACHE_BYTES,
+        object_cache_ttl=DEFAULT_OBJECT_CACHE_TTL,
+        array_cache_bytes=DEFAULT_ARRAY_CACHE_BYTES,
+        dataspace_ttl=DEFAULT_DATASPACE_TTL,
+        **connect_options,
+    ):
+        self.serv_url = serv_url
+        self.serv_port = serv_port
+        self.serv_sub_path = serv_sub_path
+        self.serv_token = serv_token
+        self.uri = server_uri(serv_url, serv_port, serv_sub_path)
+
+        self.ws = None
+        self.open_session = None
+        self.endpoint_capabilities = {}
+        self.max_message_size = DEFAULT_MAX_MESSAGE_SIZE
+        self._message_id = 0
+        self._pending = {}
+        self._reader = None
+        self.in_flight_bytes = 0
+        self.leases = 0
+        self.max_in_flight = max_in_flight
+        self._window = asyncio.Semaphore(max_in_flight)
+        self._queued = 0
+        self.send_window = SendWindow(send_window_messages, send_window_bytes)
+        self.tuner = TransferTuner()
+        self.transfer_stats = collections.deque(maxlen=100)
+        self._unanswered = {}  # message id -> size of fire-and-forget messages
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+        self.permessage_deflate = permessage_deflate
+        self.message_compression = None
+        self.dataspace_registry = DataspaceRegistry(dataspace_ttl)
+        self.object_cache = None
+        self.array_cache = None
+        if cache_dir is not None:
+            self.object_cache = ObjectCache(os.path.join(cache_dir, "objects"), object_cache_bytes, object_cache_ttl)
+            self.array_cache = ArrayCache(os.path.join(cache_dir, "arrays"), array_cache_bytes)
+
+        if loop is None:
+            self._loop_thread = LoopThread("etp-session")
+            self.loop = self._loop_thread.loop
+        else:
+            self._loop_thread = None
+            self.loop = loop
+        self.sync = _SyncFacade(self)
+
+        if connect and self._loop_thread is not None:
+            try:
+                self.run(self.connect(**connect_options))
+            except BaseException:
+                self._loop_thread.stop()
+                raise
+
+    def run(self, coro):
+        """Run a coroutine on the session loop and block until it is done."""
+        return run_on_loop(self.loop, coro)
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        if self.ws is not None:
+            self.run(self.disconnect())
+        if self._loop_thread is not None:
+            self._loop_thread.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def is_connected(self):
+        return self.open_session is not None
+
+    #
+    # connection handling
+    #
+    async def connect(
+        self,
+        timeout=30.0,
+        retries=5,
+        backoff=0.05,
+        max_backoff=2.0,
+        retry_refused=False,
+    ):
+        """
+        Open the websocket and run the RequestSession/OpenSession handshake.
+
+        Resolves as soon as OpenSession arrives.  Failed attempts are retried up
+        to `retries` times with exponential backoff (starting at `backoff`
+        seconds, capped at `max_backoff`), all within `timeout` seconds.  A
+        refused port fails immediately unless `retry_refused` is set, e.g. while
+        the compose.yaml server is still starting.
+        """
+        deadline = self.loop.time() + timeout
+        delay = backoff
+        attempt = 0
+        while True:
+            try:
+                await asyncio.wait_for(self._open(), deadline - self.loop.time())
+                return self
+            except ConnectionRefusedError as e:
+                if not retry_refused:
+                    raise EtpConnectionError(f"connection to {self.uri} refused") from e
+                error = e
+            except asyncio.TimeoutError as e:
+                raise EtpConnectionError(f"no ETP session with {self.uri} after {timeout} s") from e
+            except (OSError, websockets.exceptions.WebSocketException) as e:
+                error = e
+            attempt += 1
+            if attempt > retries or self.loop.time() + delay >= deadline:
+                raise EtpConnectionError(
+                    f"could not connect to {self.uri} after {attempt} attempts"
+                ) from error
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, max_backoff)
+
+    async def _open(self):
+        headers = {}
+        # the token is a credential: only sent over TLS, as etpclient did for wss endpoints
+        if self.serv_token and self.uri.startswith("wss://"):
+            headers["Authorization"] = "Bearer " + self.serv_token
+        self.ws = await websockets.connect(
+            self.uri,
+            subprotocols=[ETP_SUBPROTOCOL],
+            additional_headers=headers,
+            max_size=None,
+            compression="deflate" if self.permessage_deflate else None,
+        )
+        self._reader = self.loop.create_task(self._read_loop(self.ws))
+        try:
+            (open_session,) = await self.request(self._request_session())
+        except BaseException:
+            await self._drop_connection()
+            raise
+        self.open_session = open_session
+        self.endpoint_capabilities = {
+            k: getattr(v, "item", v)
+            for k, v in (open_session.endpoint_capabilities or {}).items()
+        }
+        if self.compression and open_session.supported_compression == self.compression:
+            self.message_compression = self.compression
+        server_max = self.endpoint_capabilities.get("MaxWebSocketMessagePayloadSize")
+        if server_max:
+            self.max_message_size = min(self.max_message_size, int(server_max))
+
+    def _request_session(self):
+        version = {"major": 1, "minor": 2, "revision": 0, "patch": 0}
+        return RequestSession.parse_obj({
+            "applicationName": "resqml-etp-connector",
+            "applicationVersion": "0.1",
+            "clientInstanceId": uuid.uuid4().bytes,
+            "requestedProtocols": [
+                {"protocol": p, "protocolVersion": version, "role": "store", "protocolCapabilities": {}}
+                for p in REQUESTED_PROTOCOLS
+            ],
+            "supportedDataObjects": [
+                {"qualifiedType": "eml20.*", "dataObjectCapabilities": {}},
+                {"qualifiedType": "resqml20.*", "dataObjectCapabilities": {}},
+            ],
+            "supportedCompression": [self.compression] if self.compression else [],
+            "supportedFormats": ["xml"],
+            "currentDateTime": int(time.time() * 1e6),
+            "earliestRetainedChangeTime": 0,
+            "serverAuthorizationRequired": False,
+            "endpointCapabilities": {
+                "MaxWebSocketMessagePayloadSize": {"item": self.max_message_size},
+            },
+        })
+
+    async def disconnect(self):
+        if self.ws is None:
+            return
+        if self.open_session is not None:
+            try:
+                await self._send(CloseSession(reason="client closing"))
+            except websockets.exceptions.ConnectionClosed:
+                pass
+        await self._drop_connection()
+
+    async def _drop_connection(self):
+        ws, self.ws = self.ws, None
+        self.open_session = None
+        self.message_compression = None
+        await ws.close()
+        if self._reader is not None:
+            await self._reader
+            self._reader = None
+
+    async def _read_loop(self, ws):
+        try:
+            async for data in ws:
+                if is_compressed(data):
+                    msg = await asyncio.to_thread(decode_message, data)
+                else:
+                    msg = decode_message(data)
+                if msg is None:
+                    continue
+                pending = self._pending.get(msg.header.correlation_id)
+                if pending is None:
+                    if is_protocol_exception(msg.body):
+                        print("ETP error:", msg.body)
+                    if is_final(msg) and msg.header.correlation_id in self._unanswered:
+                        self.send_window.release(self._unanswered.pop(msg.header.correlation_id))
+                    continue
+                future, parts = pending
+                parts.append(msg.body)
+                if is_final(msg) and not future.done():
+                    future.set_result(parts)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            error = EtpConnectionError(f"connection to {self.uri} closed")
+            for future, _ in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            for size in self._unanswered.values():
+                self.send_window.release(size)
+            self._unanswered.clear()
+
+    #
+    # messaging
+    #
+    def _next_message_id(self):
+        # ETP 1.2: the client uses even message ids, the server odd ones
+        self._message_id += 2
+        return self._message_id
+
+    async def _send_bytes(self, data):
+        if self.ws is None:
+            raise EtpConnectionError(f"not connected to {self.uri}")
+        if isinstance(data, list):
+            # sent as one fragmented websocket message, without joining the buffers
+            data = coalesce(data)
+        await self.ws.send(data)
+
+    async def _compress(self, data, size):
+        """Compress a message over the threshold in a worker thread, once negotiated."""
+        if self.message_compression is None or size < self.compression_threshold:
+            return data
+        return await asyncio.to_thread(compress_message, data, self.compression_level)
+
+    async def _send(self, body):
+        message_id = self._next_message_id()
+        data = encode_message(body, message_id)
+        await self._send_bytes(await self._compress(data, len(data)))
+        return message_id
+
+    @property
+    def in_flight(self):
+        """Outstanding work: queued and unanswered requests and fire-and-forget messages, plus leased transfers."""
+        return (
+            self._queued + len(self._pending) + self.leases
+            + self.send_window.queued + self.send_window.messages
+        )
+
+    async def request(self, body):
+        """
+        Send one ETP request and return the bodies of all response parts.
+
+        Up to `max_in_flight` requests are pipelined on the socket; further
+        requests wait for a free slot.  Responses are matched to requests by
+        their correlationId, so they may arrive in any order.
+
+        Raises EtpError when the server answers with ProtocolExceptions only.
+        Partial failures (a ProtocolException among other parts) are returned
+        to the caller.
+        """
+        return await self.request_encoded(
+            lambda message_id: encode_message(body, message_id)
+        )
+
+    async def request_encoded(self, encode):
+        """
+        Like `request`, for a message encoded by `encode(message_id)`, which
+        returns the complete message as bytes or as a list of buffers (see
+        etp_arrays.encode_put_data_arrays).
+        """
+        self._queued += 1
+        try:
+            await self._window.acquire()
+        finally:
+            self._queued -= 1
+        future = self.loop.create_future()
+        parts = []
+        size = 0
+        message_id = self._next_message_id()
+        self._pending[message_id] = (future, parts)
+        try:
+            data = encode(message_id)
+            size = encoded_size(data) if isinstance(data, list) else len(data)
+            self.in_flight_bytes += size
+            await self._send_bytes(await self._compress(data, size))
+            await future
+        finally:
+            del self._pending[message_id]
+            self.in_flight_bytes -= size
+            self._window.release()
+        if all(is_protocol_exception(p) for p in parts):
+            raise EtpError(parts[0].error, parts[0].errors)
+        return parts
+
+    async def request_parts(self, body):
+        """
+        Like `request`, but yield the bodies of the response parts as they
+        arrive, e.g. the pages of a multipart GetResourcesResponse, instead of
+        collecting them all first.
+        """
+        self._queued += 1
+        try:
+            await self._window.acquire()
+        finally:
+            self._queued -= 1
+        future = self.loop.create_future()
+        queue = asyncio.Queue()
+        future.add_done_callback(lambda _: queue.put_nowait(None))
+        message_id = self._next_message_id()
+        self._pending[message_id] = (future, _QueuedParts(queue))
+        size = 0
+        failures = 0
+        count = 0
+        try:
+            data = encode_message(body, message_id)
+            size = len(data)
+            self.in_flight_bytes += size
+            await self._send_bytes(await self._compress(data, size))
+            while True:
+                part = await queue.get()
+                if part is None:
+                    break
+                count += 1
+                if is_protocol_exception(part):
+                    failures += 1
+                    if failures == count and future.done():
+                        raise EtpError(part.error, part.errors)
+                yield part
+            future.result()
+        finally:
+            del self._pending[message_id]
+            self.in_flight_bytes -= size
+            self._window.release()
+
+    def submit(self, body):
+        """
+        Dispatch a request without waiting for it, returning a future of its
+        response parts (see `request`).  Must be called on the session loop.
+        """
+        return self.loop.create_task(self.request(body))
+
+    async def gather(self, *aws):
+        """asyncio.gather on the session loop, e.g. `session.sync.gather(...)`."""
+        return await asyncio.gather(*aws)
+
+    async def send_and_wait(self, req):
+        parts = await self.request(req)
+        for part in parts:
+            if is_protocol_exception(part):
+                print("ETP error:", part.errors)
+        return unwrap_response(parts)
+
+    async def send_no_wait(self, req):
+        """
+        Send a request without waiting for its response, once the send window
+        has credit for it.  The credit returns when the response arrives.
+        """
+        data = encode_message(req, 0)
+        await self.send_window.acquire(len(data))
+        message_id = self._next_message_id()
+        self._unanswered[message_id] = len(data)
+        try:
+            await self._send_bytes(await self._compress(set_message_id(data, message_id), len(data)))
+        except BaseException:
+            self.send_window.release(self._unanswered.pop(message_id))
+            raise
+        return message_id
+
+    async def drain(self):
+        """Wait until every fire-and-forget message has been answered."""
+        await self.send_window.drain()
+
+    #
+    # async API
+    #
+    def transaction(self, *dataspaces, message=""):
+        """A Transaction over `dataspaces` (paths or URIs), for `with` or `async with`."""
+        return Transaction(self, dataspaces, message)
+
+    async def get_dataspaces(self, refresh=False):
+        """The dataspaces of the server, listed at most once per dataspace_ttl, see DataspaceRegistry."""
+        return await getDataspaces(self, refresh)
+
+    async def delete_dataspace(self, dataspace):
+        return await deleteDataspace(self, dataspace)
+
+    async def add_dataspace(self, dataspace):
+        return await addDataspace(self, dataspace)
+
+    async def put_data_objects(self, epc_file, dataspace, window=DEFAULT_PUT_WINDOW):
+        """Upload all parts of an .epc file; returns (succeeded, failed)."""
+        return await putEpcDataObjects(self, epc_file, dataspace, window)
+
+    async def put_data_object_list(self, data_objects, window=DEFAULT_PUT_WINDOW):
+        return await putDataObjects(self, data_objects, window)
+
+    async def put_data_arrays(self, arrays, depth=None):
+        """Upload a list of (uri, pathInResource, ndarray); returns (succeeded, failed), see putDataArrays."""
+        return await putDataArrays(self, arrays, depth)
+
+    async def put_data_array(self, uri, pir, array, chunk_bytes=None, depth=None):
+        """Upload one ndarray in PutDataSubarrays blocks, see putDataArrayChunked."""
+        return await putDataArrayChunked(self, uri, pir, array, chunk_bytes, depth)
+
+    async def get_resources(self, uri, depth=1):
+        return await getResources(self, uri, depth)
+
+    async def discover_resources(self, uri, data_object_types=(), scope="targetsOrSelf", depth=1, store_last_write_filter=None):
+        """Resources around `uri`, filtered by the server, see discoverResources."""
+        return await discoverResources(self, uri, data_object_types, scope, depth, store_last_write_filter)
+
+    async def iter_objects(self, uri, data_object_types=(), prefetch=DEFAULT_PREFETCH_OBJECTS):
+        """Yield the data objects of a dataspace as they arrive, see iterDataObjects."""
+        async for do in iterDataObjects(self, uri, data_object_types, prefetch):
+            yield do
+
+    async def get_data_object(self, uri):
+        return await getDataObject(self, uri)
+
+    async def get_data_objects(self, uris, per_message=None):
+        return await getDataObjects(self, uris, per_message)
+
+    async def get_data_array(self, uri, pir, dtype=None, metadata=None):
+        return await getDataArray(self, uri, pir, dtype, metadata)
+
+    async def get_data_arrays(self, uids):
+        """Fetch a list of (uri, pathInResource) with one metadata lookup, see getDataArrays."""
+        return await getDataArrays(self, uids)
+
+    async def get_data_array_chunked(self, uri, pir, chunk_bytes=None, depth=None):
+        """Download one array in parallel GetDataSubarrays tiles, see getDataArrayChunked."""
+        return await getDataArrayChunked(self, uri, pir, chunk_bytes, depth)
+
+    async def resumable_upload(self, checkpoint, epc_file=None, dataspace=None, data_objects=(), arrays=(), **options):
+        """Upload what `checkpoint` does not record as acknowledged yet, see etp_upload.UploadJob."""
+        return await resumable_upload(self, checkpoint, epc_file, dataspace, data_objects, arrays, **options)
+
+    async def put_changed_arrays(self, arrays, ledger=None, depth=None):
+        """Upload the arrays whose content hash the server does not hold yet, see etp_upload.put_changed_arrays."""
+        return await put_changed_arrays(self, arrays, ledger, depth)
+
+    async def put_changed_objects(self, data_objects, ledger=None, window=None):
+        """Upload the DataObjects whose content hash the server does not hold yet, see etp_upload.put_changed_objects."""
+        return await put_changed_objects(self, data_objects, ledger, window)
+
+    async def remote_array(self, uri, pir, **options):
+        """A lazy RemoteArray over one array, fetched block by block as it is indexed."""
+        return await RemoteArray.open(self, uri, pir, **options)
+
+    async def get_supported_properties(self, representation_uri, data_object_types=PROPERTY_TYPES, with_arrays=True, epc_uri=None):
+        """The properties of one representation and their arrays, see getSupportedProperties."""
+        return await getSupportedProperties(self, representation_uri, data_object_types, with_arrays, epc_uri)
+
+    async def pull_dataspace(self, dataspace_uri, directory, full=False, with_arrays=True):
+        """Bring a local copy of a dataspace up to date, see etp_sync.pull_dataspace."""
+        return await pull_dataspace(self, dataspace_uri, directory, full, with_arrays)
+
+    async def get_data_array_metadata(self, uri, pir):
+        return await getDataArrayMetadata(self, uri, pir)
+
+    async def get_dataspace(self, dataspace):
+        """Return the Dataspace record with the given path, or None."""
+        for ds in await self.get_dataspaces():
+            if ds.path == dataspace:
+                return ds
+        return None
+
+
+class EtpSessionPool:
+    """
+    A pool of `size` ETP sessions to the same server, sharing one event loop.
+
+    Single requests are sent on the session with the least in-flight work
+    (unanswered requests, then unanswered bytes).  Transfers made of several
+    requests lease one session with `pinned(key)`, so that their requests stay
+    on one socket; data array requests are routed this way keyed by
+    (uri, pathInResource).
+
+    The pool exposes the async API of EtpSession and the same `sync` facade:
+
+        pool = EtpSessionPool('127.0.0.1', 9002, size=8)
+        objs = pool.sync.gather(*(pool.get_data_object(u) for u in uris))
+    """
+
+    def __init__(
+        self,
+        serv_url,
+        serv_port=None,
+        serv_sub_path=None,
+        serv_token=None,
+        size=4,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+        compression=DEFAULT_COMPRESSION,
+        compression_threshold=DEFAULT_COMPRESSION_THRESHOLD,
+        compression_level=DEFAULT_COMPRESSION_LEVEL,
+        permessage_deflate=False,
+        send_window_messages=DEFAULT_SEND_WINDOW_MESSAGES,
+        send_window_bytes=DEFAULT_SEND_WINDOW_BYTES,
+        cache_dir=None,
+        object_cache_bytes=DEFAULT_OBJECT_CACHE_BYTES,
+        object_cache_ttl=DEFAULT_OBJECT_CACHE_TTL,
+        array_cache_bytes=DEFAULT_ARRAY_CACHE_BYTES,
+        dataspace_ttl=DEFAULT_DATASPACE_TTL,
+        **connect_options,
+    ):
+        self._loop_thread = LoopThread("etp-pool")
+        self.loop = self._loop_thread.loop
+        self.sessions = [
+            EtpSession(
+                serv_url, serv_port, serv_sub_path, serv_token,
+                connect=False, loop=self.loop, max_in_flight=max_in_flight,
+                compression=compression,
+                compression_threshold=compression_threshold,
+                compression_level=compression_level,
+                permessage_deflate=permessage_deflate,
+                send_window_messages=send_window_messages,
+                send_window_bytes=send_window_bytes,
+            )
+            for _ in range(size)
+        ]
+        dataspace_registry = DataspaceRegistry(dataspace_ttl)
+        for session in self.sessions:
+            session.dataspace_registry = dataspace_registry
+        if cache_dir is not None:
+            # one cache, so that lastChanged seen on any session validates reads on all
+            object_cache = ObjectCache(os.path.join(cache_dir, "objects"), object_cache_bytes, object_cache_ttl)
+            array_cache = ArrayCache(os.path.join(cache_dir, "arrays"), array_cache_bytes)
+            for session in self.sessions:
+                session.object_cache = object_cache
+                session.array_cache = array_cache
+        self._sticky = {}
+        self.sync = _SyncFacade(self)
+        try:
+            self.run(self.connect(**connect_options))
+        except BaseException:
+            self.run(self.disconnect())
+            self._loop_thread.stop()
+            raise
+
+    def run(self, coro):
+        """Run a coroutine on the pool loop and block until it is done."""
+        return self._loop_thread.run(coro)
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.run(self.disconnect())
+        self._loop_thread.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    async def connect(self, **connect_options):
+        await asyncio.gather(*(s.connect(**connect_options) for s in self.sessions))
+
+    async def disconnect(self):
+        await asyncio.gather(*(s.disconnect() for s in self.sessions))
+
+    async def drain(self):
+        await asyncio.gather(*(s.drain() for s in self.sessions))
+
+    def least_loaded(self):
+        return min(self.sessions, key=lambda s: (s.in_flight, s.in_flight_bytes))
+
+    @contextlib.asynccontextmanager
+    async def pinned(self, key=None):
+        """
+        Lease one session for a multi-request transfer.  Concurrent leases with
+        the same `key` share a session; the lease counts as in-flight work.
+        """
+        entry = self._sticky.get(key) if key is not None else None
+        if entry is None:
+            entry = [self.least_loaded(), 0]
+            if key is not None:
+                self._sticky[key] = entry
+        session = entry[0]
+        entry[1] += 1
+        session.leases += 1
+        try:
+            yield session
+        finally:
+            entry[1] -= 1
+            session.leases -= 1
+            if entry[1] == 0 and key is not None:
+                del self._sticky[key]
+
+    async def get_data_array(self, uri, pir, dtype=None, metadata=None):
+        async with self.pinned((uri, pir)) as session:
+            return await session.get_data_array(uri, pir, dtype, metadata)
+
+    async def get_data_array_chunked(self, uri, pir, chunk_bytes=None, depth=None):
+        async with self.pinned((uri, pir)) as session:
+            return await session.get_data_array_chunked(uri, pir, chunk_bytes, depth)
+
+    async def put_data_array(self, uri, pir, array, chunk_bytes=None, depth=None):
+        async with self.pinned((uri, pir)) as session:
+            return await session.put_data_array(uri, pir, array, chunk_bytes, depth)
+
+    def __getattr__(self, name):
+        # Any other coroutine method of EtpSession runs on the least loaded session
+        method = getattr(EtpSession, name, None)
+        if not name.startswith("_") and inspect.isasyncgenfunction(method):
+
+            @functools.wraps(method)
+            async def stream(*args, **kwargs):
+                async for item in getattr(self.least_loaded(), name)(*args, **kwargs):
+                    yield item
+
+            return stream
+        if name.startswith("_") or not asyncio.iscoroutinefunction(method):
+            raise AttributeError(name)
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            return await getattr(self.least_loaded(), name)(*args, **kwargs)
+
+        return call
+
+
+class Transaction:
+    """
+    An ETP transaction (protocol 18) on one session, as a context manager:
+
+        with session.transaction("demo/pss"):
+            session.sync.put_data_objects(epc_file, "demo/pss")
+            session.sync.put_data_arrays(arrays)
+
+    Every message the session sends inside the block belongs to the
+    transaction, so the server commits the whole ingest once.  Leaving the
+    block waits for the fire-and-forget messages to be answered and commits;
+    an exception rolls the transaction back and is re-raised.  Async code uses
+    `async with`.
+    """
+
+    def __init__(self, session, dataspaces, message=""):
+        self.session = session
+        self.dataspace_uris = [
+            ds if ds.startswith("eml:") else f"eml:///dataspace('{ds}')" for ds in dataspaces
+        ]
+        self.message = message
+        self.uuid = None
+
+    async def __aenter__(self):
+        self.uuid = await startTransaction(self.session, self.dataspace_uris, message=self.message)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            try:
+                await self.session.drain()
+            except BaseException:
+                await self._rollback()
+                raise
+            await commitTransaction(self.session, self.uuid)
+        else:
+            await self._rollback()
+        return False
+
+    async def _rollback(self):
+        try:
+            await rollbackTransaction(self.session, self.uuid)
+        except (EtpError, EtpTransactionError, EtpConnectionError) as e:
+            print("ETP error: rollback failed:", e)
+
+    def __enter__(self):
+        return self.session.run(self.__aenter__())
+
+    def __exit__(self, exc_type, exc, tb):
+        return self.session.run(self.__aexit__(exc_type, exc, tb))
+
+
+class SendWindow:
+    """
+    Credit-based flow control: at most `max_messages` messages and `max_bytes`
+    bytes may be outstanding.  A message larger than `max_bytes` is let through
+    alone once everything else has been answered.
+
+    `queued` is the number of senders waiting for credit; `stalls` and
+    `stall_time` count the waits and their total duration in seconds.
+    """
+
+    def __init__(self, max_messages=DEFAULT_SEND_WINDOW_MESSAGES, max_bytes=DEFAULT_SEND_WINDOW_BYTES):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.messages = 0
+        self.bytes = 0
+        self.queued = 0
+        self.stalls = 0
+        self.stall_time = 0.0
+        self._changed = asyncio.Event()  # set whenever credit returns
+
+    def _has_credit(self, size):
+        if self.messages == 0:
+            return True
+        return self.messages < self.max_messages and self.bytes + size <= self.max_bytes
+
+    async def _wait_until(self, predicate):
+        while not predicate():
+            self._changed.clear()
+            await self._changed.wait()
+
+    async def acquire(self, size):
+        if not self._has_credit(size):
+            self.queued += 1
+            self.stalls += 1
+            t0 = time.perf_counter()
+            try:
+                await self._wait_until(lambda: self._has_credit(size))
+            finally:
+                self.queued -= 1
+                self.stall_time += time.perf_counter() - t0
+        self.messages += 1
+        self.bytes += size
+
+    def release(self, size):
+        self.messages -= 1
+        self.bytes -= size
+        self._changed.set()
+
+    async def drain(self):
+        await self._wait_until(lambda: self.messages == 0)
+
+    def stats(self):
+        return {
+            "messages": self.messages,
+            "bytes": self.bytes,
+            "queued": self.queued,
+            "stalls": self.stalls,
+            "stall_time": self.stall_time,
+        }
+
+
+class _QueuedParts:
+    """The parts list of a pending `request_parts`, handing each part to its queue."""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def append(self, body):
+        self.queue.put_nowait(body)
+
+
+class _SyncFacade:
+    """
+    Blocking view of an EtpSession: `session.sync.<name>(...)` runs the
+    coroutine method `session.<name>(...)` on the session loop.  Async
+    generator methods become plain generators, advanced on the loop one item
+    at a time.
+    """
+
+    def __init__(self, session):
+        self._session = session
+
+    def __getattr__(self, name):
+        attr = getattr(self._session, name)
+        if inspect.isasyncgenfunction(attr):
+
+            @functools.wraps(attr)
+            def iterate(*args, **kwargs):
+                agen = attr(*args, **kwargs)
+                try:
+                    while True:
+                        try:
+                            yield self._session.run(agen.__anext__())
+                        except StopAsyncIteration:
+                            return
+                finally:
+                    self._session.run(agen.aclose())
+
+            return iterate
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def wrapper(*args, **kwargs):
+            return self._session.run(attr(*args, **kwargs))
+
+        return wrapper
+
+
+class LoopThread:
+    """An event loop running forever in a daemon thread."""
+
+    def __init__(self, name):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name=name, daemon=True
+        )
+        self._thread.start()
+
+    def run(self, coro):
+        return run_on_loop(self.loop, coro)
+
+    def stop(self):
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+def run_on_loop(loop, coro):
+    """Run a coroutine on a loop running in another thread and wait for it."""
+    if _running_loop() is loop:
+        coro.close()
+        raise RuntimeError("cannot block on the loop's own thread; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
@@ -0,0 +1,525 @@
+import asyncio
+import re
+import time
+import uuid
+
+import numpy as np
+import websockets
+
+from etpproto.messages import MessageFlags
+from etptypes.energistics.etp.v12.protocol.core.open_session import OpenSession
+from etptypes.energistics.etp.v12.protocol.core.protocol_exception import ProtocolException
+from etptypes.energistics.etp.v12.protocol.dataspace.get_dataspaces_response import GetDataspacesResponse
+from etptypes.energistics.etp.v12.protocol.dataspace.put_dataspaces_response import PutDataspacesResponse
+from etptypes.energistics.etp.v12.protocol.dataspace.delete_dataspaces_response import DeleteDataspacesResponse
+from etptypes.energistics.etp.v12.protocol.discovery.get_resources_response import GetResourcesResponse
+from etptypes.energistics.etp.v12.protocol.store.get_data_objects_response import GetDataObjectsResponse
+from etptypes.energistics.etp.v12.protocol.store.put_data_objects_response import PutDataObjectsResponse
+from etptypes.energistics.etp.v12.protocol.data_array.get_data_arrays_response import GetDataArraysResponse
+from etptypes.energistics.etp.v12.protocol.data_array.put_data_arrays_response import PutDataArraysResponse
+from etptypes.energistics.etp.v12.protocol.data_array.get_data_array_metadata_response import GetDataArrayMetadataResponse
+from etptypes.energistics.etp.v12.protocol.data_array.put_uninitialized_data_arrays_response import PutUninitializedDataArraysResponse
+from etptypes.energistics.etp.v12.protocol.data_array.put_data_subarrays_response import PutDataSubarraysResponse
+
+from etptypes.energistics.etp.v12.protocol.data_array.get_data_subarrays_response import GetDataSubarraysResponse
+from etptypes.energistics.etp.v12.protocol.transaction.start_transaction_response import StartTransactionResponse
+from etptypes.energistics.etp.v12.protocol.transaction.commit_transaction_response import CommitTransactionResponse
+from etptypes.energistics.etp.v12.protocol.transaction.rollback_transaction_response import RollbackTransactionResponse
+
+from etp_arrays import compress_message, array_dtype, item_dtype, any_array_item, array_metadata, block_slices
+
+from etp_session import (
+    ETP_SUBPROTOCOL,
+    DEFAULT_MAX_MESSAGE_SIZE,
+    DEFAULT_COMPRESSION_THRESHOLD,
+    encode_message,
+    decode_message,
+    LoopThread,
+)
+
+
+NOT_FOUND = 11
+RESOURCES_PER_PART = 1000
+
+# messages that write to the store, committed one by one outside a transaction
+WRITE_MESSAGES = {"PutDataObjects", "PutDataArrays", "PutUninitializedDataArrays", "PutDataSubarrays"}
+
+_DATASPACE_RE = re.compile(r"eml:///dataspace\('([^']*)'\)")
+
+
+_OBJECT_RE = re.compile(r"/([A-Za-z0-9]+\.[A-Za-z0-9_]+)\(([^)]*)\)$")
+_UUID_RE = re.compile(rb"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+
+def qualified_type(uri):
+    m = _OBJECT_RE.search(uri)
+    return m.group(1) if m else ""
+
+
+def object_uuid(uri):
+    m = _OBJECT_RE.search(uri)
+    return m.group(2).rsplit(",", 1)[0].lower() if m else ""
+
+
+def referenced_uuids(data):
+    return {m.decode().lower() for m in _UUID_RE.findall(data)}
+
+
+def type_matches(uri, types):
+    """Whether the object `uri` is of one of the qualified `types`, e.g. "resqml20.*"."""
+    if not types:
+        return True
+    qt = qualified_type(uri)
+    return any(qt == t or (t.endswith("*") and qt.startswith(t[:-1])) for t in types)
+
+
+def dataspace_path(uri):
+    m = _DATASPACE_RE.match(uri)
+    return m.group(1) if m else ""
+
+
+def dataspace_uri(path):
+    return f"eml:///dataspace('{path}')" if path else "eml:///"
+
+
+def custom_values(custom_data):
+    """The plain values of a customData map of DataValues."""
+    return {k: v.item for k, v in (custom_data or {}).items()}
+
+
+def now_us():
+    return int(time.time() * 1e6)
+
+
+class StandinEtpServer:
+    """
+    A minimal in-process ETP 1.2 server, used as a stand-in for the
+    open-etp-server of compose.yaml in benchmarks.
+
+    The server runs its own event loop in a background thread, so that it can
+    be driven by an EtpSession (or the legacy WebSocketManager) from the same
+    process.  `latency` adds a fixed delay before every response to emulate a
+    remote server.  Requests on one connection are handled concurrently.  When
+    the client offers gzip, replies of at least `compression_threshold` bytes
+    are compressed (None disables compression).
+
+    `commit_cost` emulates a durable commit: that many seconds, one commit at
+    a time, after every write message outside a transaction and once per
+    CommitTransaction.  A rolled back transaction (or one left open when its
+    connection closes) restores the objects and arrays it overwrote.
+
+        with StandinEtpServer(latency=0.005) as server:
+            session = EtpSession(server.host, server.port)
+    """
+
+    def __init__(
+        self, host="127.0.0.1", port=0, latency=0.0, max_message_size=DEFAULT_MAX_MESSAGE_SIZE,
+        compression_threshold=DEFAULT_COMPRESSION_THRESHOLD, commit_cost=0.0,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.max_message_size = max_message_size
+        self.compression_threshold = compression_threshold
+        self.commit_cost = commit_cost
+        self.requests = 0
+        self.commits = 0
+
+        # dataspace path -> {"created", "last_write", "objects", "arrays"}
+        self.dataspaces = {}
+
+        self._server = None
+        self._compressed = set()  # connections that negotiated gzip
+        self._transactions = {}  # connection -> {"uuid", "undo"}
+        self._current = None  # connection of the handler being run
+        self._commit_lock = None
+        self._message_id = -1
+        self._loop_thread = None
+
+    def start(self):
+        self._loop_thread = LoopThread("etp-standin")
+        self._loop_thread.run(self._start())
+        return self
+
+    def stop(self):
+        self._loop_thread.run(self._stop())
+        self._loop_thread.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    #
+    # in-memory store, also used to populate the server directly
+    #
+    def dataspace(self, path):
+        store = self.dataspaces.get(path)
+        if store is None:
+            t = now_us()
+            store = self.dataspaces[path] = {"created": t, "last_write": t, "objects": {}, "arrays": {}}
+        return store
+
+    def add_object(self, uri, data, last_changed=None, custom_data=None):
+        store = self.dataspace(dataspace_path(uri))
+        store["last_write"] = last_changed or now_us()
+        store["objects"][uri] = {
+            "data": data, "created": store["last_write"], "last_changed": store["last_write"],
+            "custom_data": dict(custom_data or {}),
+        }
+
+    def add_array(self, uri, path_in_resource, array, custom_data=None):
+        store = self.dataspace(dataspace_path(uri))
+        store["last_write"] = now_us()
+        store["arrays"][(uri, path_in_resource)] = {
+            "array": np.asarray(array), "last_changed": store["last_write"],
+            "custom_data": dict(custom_data or {}),
+        }
+
+    def _store(self, uri):
+        return self.dataspaces.get(dataspace_path(uri), {"objects": {}, "arrays": {}})
+
+    def _resource(self, uri, obj):
+        return {
+            "uri": uri,
+            "alternateUris": [],
+            "name": uri.rsplit("/", 1)[-1],
+            "sourceCount": None,
+            "targetCount": None,
+            "lastChanged": obj["last_changed"],
+            "storeLastWrite": obj["last_changed"],
+            "storeCreated": obj["created"],
+            "activeStatus": "Inactive",
+            "customData": {k: {"item": v} for k, v in obj.get("custom_data", {}).items()},
+        }
+
+    def _errors(self, errors):
+        return ProtocolException.parse_obj({
+            "error": None,
+            "errors": {k: {"code": NOT_FOUND, "message": f"{v} not found"} for k, v in errors.items()},
+        })
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    async def _start(self):
+        self._server = await websockets.serve(
+            self._connection,
+            self.host,
+            self.port,
+            subprotocols=[ETP_SUBPROTOCOL],
+            max_size=None,
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _commit(self):
+        if self._commit_lock is None:
+            self._commit_lock = asyncio.Lock()
+        async with self._commit_lock:
+            await asyncio.sleep(self.commit_cost)
+            self.commits += 1
+
+    async def _stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _next_message_id(self):
+        self._message_id += 2
+        return self._message_id
+
+    async def _connection(self, ws, path=None):
+        tasks = set()
+        try:
+            async for data in ws:
+                msg = decode_message(data)
+                task = asyncio.ensure_future(self._respond(ws, msg))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        for task in tasks:
+            task.cancel()
+        self._compressed.discard(ws)
+        if ws in self._transactions:
+            self._rollback(self._transactions.pop(ws))
+
+    async def _respond(self, ws, msg):
+        self.requests += 1
+        name = type(msg.body).__name__
+        handler = getattr(self, "on_" + name, None)
+        if handler is None:
+            return
+        self._current = ws
+        replies = handler(msg.body)
+        if self.commit_cost and (
+            name == "CommitTransaction" or (name in WRITE_MESSAGES and ws not in self._transactions)
+        ):
+            await self._commit()
+        if not replies:
+            return
+        if name == "RequestSession" and replies[0].supported_compression == "gzip":
+            self._compressed.add(ws)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        flags = MessageFlags.MULTIPART if len(replies) > 1 else 0
+        for i, body in enumerate(replies):
+            final = MessageFlags.FINALPART if i == len(replies) - 1 else 0
+            data = encode_message(
+                body,
+                self._next_message_id(),
+                correlation_id=msg.header.message_id,
+                message_flags=flags | final,
+            )
+            if ws in self._compressed and len(data) >= self.compression_threshold:
+                data = await asyncio.to_thread(compress_message, data, 1)
+            await ws.send(data)
+
+    #
+    # Core
+    #
+    def on_RequestSession(self, body):
+        return [OpenSession.parse_obj({
+            "applicationName": "etp-standin",
+            "applicationVersion": "0.1",
+            "serverInstanceId": uuid.uuid4().bytes,
+            "supportedProtocols": body.requested_protocols,
+            "supportedDataObjects": body.supported_data_objects,
+            "supportedCompression": "gzip" if self.compression_threshold is not None and "gzip" in body.supported_compression else "",
+            "supportedFormats": ["xml"],
+            "currentDateTime": int(time.time() * 1e6),
+            "earliestRetainedChangeTime": 0,
+            "sessionId": uuid.uuid4().bytes,
+            "endpointCapabilities": {
+                "MaxWebSocketMessagePayloadSize": {"item": self.max_message_size},
+                "MaxDataObjectSize": {"item": self.max_message_size},
+            },
+        })]
+
+    def on_CloseSession(self, body):
+        return []
+
+    #
+    # Dataspace
+    #
+    def on_GetDataspaces(self, body):
+        return [GetDataspacesResponse.parse_obj({"dataspaces": [
+            {
+                "uri": dataspace_uri(path),
+                "path": path,
+                "storeLastWrite": store["last_write"],
+                "storeCreated": store["created"],
+                "customData": {},
+            }
+            for path, store in self.dataspaces.items()
+        ]})]
+
+    def on_PutDataspaces(self, body):
+        for ds in body.dataspaces.values():
+            self.dataspace(ds.path or dataspace_path(ds.uri))
+        return [PutDataspacesResponse(success={k: "" for k in body.dataspaces})]
+
+    def on_DeleteDataspaces(self, body):
+        success, missing = {}, {}
+        for k, uri in body.uris.items():
+            if self.dataspaces.pop(dataspace_path(uri), None) is None:
+                missing[k] = uri
+            else:
+                success[k] = ""
+        replies = [DeleteDataspacesResponse(success=success)] if success else []
+        return replies + ([self._errors(missing)] if missing else [])
+
+    #
+    # Discovery
+    #
+    def _related(self, objects, uri, scope, depth):
+        """URIs reached from the object `uri` within `scope` and `depth` edges."""
+        uuids = {object_uuid(u): u for u in objects}
+        references = {u: {uuids[r] for r in referenced_uuids(o["data"]) if r in uuids and uuids[r] != u}
+                      for u, o in objects.items()}
+        found = {uri} if scope in ("self", "sourcesOrSelf", "targetsOrSelf") else set()
+        frontier = {uri}
+        for _ in range(depth if scope != "self" else 0):
+            if scope.startswith("sources"):
+                frontier = {u for u, refs in references.items() if refs & frontier}
+            else:
+                frontier = set().union(*(references[u] for u in frontier))
+            frontier -= found | {uri}
+            found |= frontier
+        return found
+
+    def on_GetResources(self, body):
+        context = body.context
+        objects = self._store(context.uri)["objects"]
+        scope = getattr(body.scope, "value", body.scope)
+        if context.uri in objects:
+            uris = self._related(objects, context.uri, scope, max(context.depth, 1))
+        else:
+            uris = objects  # a dataspace: every object in it
+        types = context.data_object_types
+        since = body.store_last_write_filter
+        resources = [
+            self._resource(uri, objects[uri]) for uri in uris
+            if type_matches(uri, types) and (since is None or objects[uri]["last_changed"] > since)
+        ]
+        # a multipart response of at most RESOURCES_PER_PART resources each, as a store server does
+        return [
+            GetResourcesResponse.parse_obj({"resources": resources[i:i + RESOURCES_PER_PART]})
+            for i in range(0, max(len(resources), 1), RESOURCES_PER_PART)
+        ]
+
+    #
+    # Store
+    #
+    def on_GetDataObjects(self, body):
+        found, missing = {}, {}
+        for k, uri in body.uris.items():
+            obj = self._store(uri)["objects"].get(uri)
+            if obj is None:
+                missing[k] = uri
+            else:
+                found[k] = {"resource": self._resource(uri, obj), "format": "xml", "blobId": None, "data": obj["data"]}
+        # split into parts of at most max_message_size, as a store server does
+        replies, part, size = [], {}, 0
+        for k, do in found.items():
+            if part and size + len(do["data"]) > self.max_message_size:
+                replies.append(GetDataObjectsResponse.parse_obj({"dataObjects": part}))
+                part, size = {}, 0
+            part[k] = do
+            size += len(do["data"])
+        if part:
+            replies.append(GetDataObjectsResponse.parse_obj({"dataObjects": part}))
+        return replies + ([self._errors(missing)] if missing else [])
+
+    def on_PutDataObjects(self, body):
+        for do in body.data_objects.values():
+            self._journal("objects", do.resource.uri, do.resource.uri)
+            self.add_object(do.resource.uri, do.data, custom_data=custom_values(do.resource.custom_data))
+        return [PutDataObjectsResponse.parse_obj({
+            "success": {k: {"createdContainedObjectUris": [], "deletedContainedObjectUris": [],
+                            "joinedContainedObjectUris": [], "unjoinedContainedObjectUris": []}
+                        for k in body.data_objects}
+        })]
+
+    #
+    # DataArray
+    #
+    def _array(self, uid):
+        return self._store(uid.uri)["arrays"].get((uid.uri, uid.path_in_resource))
+
+    def on_GetDataArrays(self, body):
+        found, missing = {}, {}
+        for k, uid in body.data_arrays.items():
+            entry = self._array(uid)
+            if entry is None:
+                missing[k] = uid.path_in_resource
+                continue
+            item, _ = any_array_item(entry["array"])
+            found[k] = {"dimensions": list(entry["array"].shape), "data": {"item": item}}
+        replies = [GetDataArraysResponse.parse_obj({"dataArrays": found})] if found else []
+        return replies + ([self._errors(missing)] if missing else [])
+
+    def on_PutDataArrays(self, body):
+        for pda in body.data_arrays.values():
+            self._journal("arrays", pda.uid.uri, (pda.uid.uri, pda.uid.path_in_resource))
+            values = np.asarray(pda.array.data.item.values, item_dtype(pda.array.data.item))
+            self.add_array(
+                pda.uid.uri, pda.uid.path_in_resource, values.reshape(pda.array.dimensions),
+                custom_values(pda.custom_data),
+            )
+        return [PutDataArraysResponse(success={k: "" for k in body.data_arrays})]
+
+    def on_GetDataArrayMetadata(self, body):
+        found, missing = {}, {}
+        for k, uid in body.data_arrays.items():
+            entry = self._array(uid)
+            if entry is None:
+                missing[k] = uid.path_in_resource
+                continue
+            found[k] = array_metadata(entry["array"], entry["last_changed"], entry.get("custom_data"))
+        replies = [GetDataArrayMetadataResponse.parse_obj({"arrayMetadata": found})] if found else []
+        return replies + ([self._errors(missing)] if missing else [])
+
+    def on_PutUninitializedDataArrays(self, body):
+        for pua in body.data_arrays.values():
+            self._journal("arrays", pua.uid.uri, (pua.uid.uri, pua.uid.path_in_resource))
+            self.add_array(
+                pua.uid.uri, pua.uid.path_in_resource, np.zeros(pua.metadata.dimensions, array_dtype(pua.metadata)),
+                custom_values(pua.metadata.custom_data),
+            )
+        return [PutUninitializedDataArraysResponse(success={k: "" for k in body.data_arrays})]
+
+    def on_PutDataSubarrays(self, body):
+        success, missing = {}, {}
+        for k, pds in body.data_subarrays.items():
+            entry = self._array(pds.uid)
+            if entry is None:
+                missing[k] = pds.uid.path_in_resource
+                continue
+            self._journal("arrays", pds.uid.uri, (pds.uid.uri, pds.uid.path_in_resource))
+            values = np.asarray(pds.data.item.values)
+            entry["array"][block_slices(pds.starts, pds.counts)] = values.reshape(pds.counts)
+            entry["last_changed"] = now_us()
+            success[k] = ""
+        replies = [PutDataSubarraysResponse(success=success)] if success else []
+        return replies + ([self._errors(missing)] if missing else [])
+
+    def on_GetDataSubarrays(self, body):
+        found, missing = {}, {}
+        for k, gds in body.data_subarrays.items():
+            entry = self._array(gds.uid)
+            if entry is None:
+                missing[k] = gds.uid.path_in_resource
+                continue
+            item, _ = any_array_item(entry["array"][block_slices(gds.starts, gds.counts)])
+            found[k] = {"dimensions": list(gds.counts), "data": {"item": item}}
+        replies = [GetDataSubarraysResponse.parse_obj({"dataSubarrays": found})] if found else []
+        return replies + ([self._errors(missing)] if missing else [])
+
+    #
+    # Transaction
+    #
+    def _journal(self, kind, uri, key):
+        """In a transaction, keep the entry about to be overwritten, for a rollback."""
+        transaction = self._transactions.get(self._current)
+        if transaction is None:
+            return
+        path = dataspace_path(uri)
+        if (kind, path, key) in transaction["undo"]:
+            return
+        entry = self._store(uri)[kind].get(key)
+        if entry is not None:
+            entry = dict(entry, array=entry["array"].copy()) if kind == "arrays" else dict(entry)
+        transaction["undo"][(kind, path, key)] = entry
+
+    def _rollback(self, transaction):
+        for (kind, path, key), entry in transaction["undo"].items():
+            store = self.dataspace(path)
+            if entry is None:
+                store[kind].pop(key, None)
+            else:
+                store[kind][key] = entry
+
+    def on_StartTransaction(self, body):
+        transaction_uuid = uuid.uuid4().bytes
+        if self._current in self._transactions:
+            return [StartTransactionResponse(
+                transactionUuid=transaction_uuid, successful=False, failureReason="a transaction is already open",
+            )]
+        self._transactions[self._current] = {"uuid": transaction_uuid, "undo": {}}
+        return [StartTransactionResponse(transactionUuid=transaction_uuid)]
+
+    def _end_transaction(self, body, response):
+        transaction = self._transactions.get(self._current)
+        if transaction is None or transaction["uuid"] != body.transaction_uuid:
+            return None, [response(
+                transactionUuid=body.transaction_uuid, successful=False, failureReason="no such transaction",
+            )]
+        del self._transactions[self._current]
+        return transaction, [response(transactionUuid=body.transaction_uuid)]
+
+    def on_CommitTransaction(self, body):
+        return self._end_transaction(body, CommitTransactionResponse)[1]
+
+    def on_RollbackTransaction(self, body):
+        transaction, replies = self._end_transaction(body, RollbackTransactionResponse)
+        if transaction is not None:
+            self._rollback(transaction)
+        return replies
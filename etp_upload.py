@@ -0,0 +1,345 @@
+"""
+Resumable uploads.
+
+An UploadJob records every object and every array block the server has
+acknowledged in a local checkpoint file, one JSON line per acknowledgement.
+Running the same job again, after a dropped connection or a crash, replays the
+checkpoint and sends only what is missing:
+
+    with EtpSession('127.0.0.1', 9002) as session:
+        session.sync.resumable_upload("hexa.checkpoint", epc_file, "demo/pss", arrays=put_arrays)
+
+Objects are recognised by URI and content hash, arrays by (URI,
+pathInResource) and content hash; a changed object or array is sent again
+from the start.  Arrays are sent as PutUninitializedDataArrays followed by
+PutDataSubarrays blocks of a fixed tiling, recorded with the array so that a
+resumed job cuts the same blocks.
+
+put_changed_arrays and put_changed_objects skip what the server already
+holds instead: each payload is sent with its content hash in its customData
+(CONTENT_HASH), and compared before sending with the hash the server returns
+in GetDataArrayMetadata or discovery.  For servers that do not keep
+customData, an UploadLedger remembers the hashes locally:
+
+    ledger = UploadLedger("uploads.ledger")
+    session.sync.put_changed_arrays(put_arrays, ledger)
+"""
+import asyncio
+import collections
+import json
+import os
+import re
+
+import numpy as np
+
+from etpclient.etp.requester import put_data_object_by_path
+from etptypes.energistics.etp.v12.datatypes.data_value import DataValue
+from etptypes.energistics.etp.v12.protocol.data_array.put_uninitialized_data_arrays import (
+    PutUninitializedDataArrays,
+)
+
+from etp_arrays import (
+    CONTENT_HASH,
+    TRANSPORT_ITEMSIZE,
+    array_metadata,
+    block_slices,
+    content_hash,
+    encode_put_data_subarrays,
+    subarray_blocks,
+)
+from etpclient_helper import (
+    DEFAULT_SUBARRAY_DEPTH,
+    discoverResources,
+    getDataArraysMetadata,
+    putDataArrays,
+    putDataObjects,
+    storedHash,
+    subarrayBytes,
+)
+
+
+class UploadJob:
+    """
+    An upload that can be interrupted and run again.  `checkpoint` is the path
+    of its journal; `fsync` makes every acknowledgement durable before the
+    next is recorded, at the cost of a disk flush each.
+    """
+
+    def __init__(self, session, checkpoint, chunk_bytes=None, depth=DEFAULT_SUBARRAY_DEPTH, fsync=False):
+        self.session = session
+        self.checkpoint = checkpoint
+        self.chunk_bytes = chunk_bytes
+        self.depth = depth
+        self.fsync = fsync
+        self.objects = {}  # uri -> content hash
+        self.arrays = {}  # "uri pir" -> {"hash", "chunk_bytes", "done": set of block numbers}
+        self.sent = 0
+        self.skipped = 0
+        torn = self._load()
+        self._journal = open(checkpoint, "a")
+        if torn:
+            self._journal.write("\n")
+
+    def _load(self):
+        """Replay the checkpoint; returns whether its last line was cut short."""
+        if not os.path.exists(self.checkpoint):
+            return False
+        line = "\n"
+        with open(self.checkpoint) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # the last line of an interrupted write
+                    continue
+                if "object" in entry:
+                    self.objects[entry["object"]] = entry["hash"]
+                elif "array" in entry:
+                    self.arrays[entry["array"]] = {"hash": entry["hash"], "chunk_bytes": entry["chunk_bytes"], "done": set()}
+                elif "block" in entry and entry["of"] in self.arrays:
+                    self.arrays[entry["of"]]["done"].add(entry["block"])
+        return not line.endswith("\n")
+
+    def _record(self, **entry):
+        self._journal.write(json.dumps(entry) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def close(self):
+        self._journal.close()
+
+    async def put_data_objects(self, data_objects, window=None):
+        """Upload the DataObjects not acknowledged yet; returns (succeeded, failed) as putDataObjects."""
+        hashes = {}
+        pending = []
+        for do in data_objects:
+            h = content_hash(do.data)
+            if self.objects.get(do.resource.uri) == h:
+                self.skipped += 1
+                continue
+            hashes[do.resource.uri] = h
+            pending.append(do)
+        if not pending:
+            return [], {}
+        options = {} if window is None else {"window": window}
+        succeeded, failed = await putDataObjects(self.session, pending, **options)
+        for uri in succeeded:
+            self.objects[uri] = hashes[uri]
+            self._record(object=uri, hash=hashes[uri])
+        self.sent += len(succeeded)
+        return succeeded, failed
+
+    async def put_epc(self, epc_file, dataspace):
+        """Upload the parts of an .epc file not acknowledged yet."""
+        data_objects = []
+        for msg in put_data_object_by_path(epc_file, dataspace):
+            data_objects.extend(msg.data_objects.values())
+        return await self.put_data_objects(data_objects)
+
+    async def put_data_arrays(self, arrays):
+        """Upload the blocks of `arrays`, (uri, pathInResource, ndarray), not acknowledged yet."""
+        slots = asyncio.Semaphore(self.depth)
+        await asyncio.gather(*(self._put_array(uri, pir, np.asarray(array), slots) for uri, pir, array in arrays))
+
+    async def _put_array(self, uri, pir, array, slots):
+        key = f"{uri} {pir}"
+        h = await asyncio.to_thread(content_hash, array)
+        state = self.arrays.get(key)
+        if state is None or state["hash"] != h:
+            metadata = array_metadata(array)
+            await self.session.request(PutUninitializedDataArrays.parse_obj({"dataArrays": {"0": {
+                "uid": {"uri": uri, "pathInResource": pir},
+                "metadata": metadata,
+            }}}))
+            state = self.arrays[key] = {"hash": h, "chunk_bytes": self.chunk_bytes or subarrayBytes(self.session), "done": set()}
+            self._record(array=key, hash=h, chunk_bytes=state["chunk_bytes"])
+        itemsize = TRANSPORT_ITEMSIZE[array_metadata(array)["transportArrayType"]]
+        array = np.ascontiguousarray(array)
+
+        async def put(n, starts, counts):
+            async with slots:
+                block = array[block_slices(starts, counts)]
+                await self.session.request_encoded(lambda message_id: encode_put_data_subarrays(
+                    uri, pir, block, starts, counts, message_id
+                ))
+            state["done"].add(n)
+            self._record(block=n, of=key)
+            self.sent += 1
+
+        blocks = list(enumerate(subarray_blocks(array.shape, itemsize, state["chunk_bytes"])))
+        self.skipped += sum(1 for n, _ in blocks if n in state["done"])
+        await asyncio.gather(*(put(n, starts, counts) for n, (starts, counts) in blocks if n not in state["done"]))
+
+
+async def resumable_upload(session, checkpoint, epc_file=None, dataspace=None, data_objects=(), arrays=(), **options):
+    """
+    Run an UploadJob: the parts of `epc_file` into `dataspace`, then
+    `data_objects`, then `arrays`.  Returns {"sent", "skipped", "failed"},
+    counting objects and array blocks.
+    """
+    job = UploadJob(session, checkpoint, **options)
+    try:
+        failed = {}
+        if epc_file is not None:
+            failed.update((await job.put_epc(epc_file, dataspace))[1])
+        if data_objects:
+            failed.update((await job.put_data_objects(data_objects))[1])
+        if arrays:
+            await job.put_data_arrays(arrays)
+        return {"sent": job.sent, "skipped": job.skipped, "failed": failed}
+    finally:
+        job.close()
+
+
+class UploadLedger:
+    """
+    Content hashes of uploaded objects and arrays, kept in a local JSON file
+    for servers that do not store customData.  Entries are keyed by object URI
+    or by "uri pathInResource", and hold only while the server reports the
+    lastChanged (objects) or storeLastWrite (arrays) they were recorded with.
+
+    Arrays being uploaded are marked `pending` until the server acknowledges
+    them: the hash in the customData of an array whose upload was interrupted
+    may describe data that never arrived, so it is not trusted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get(self, key, last_write):
+        entry = self.entries.get(key)
+        if entry is None or entry.get("lastWrite") != last_write:
+            return None
+        return entry["hash"]
+
+    def put(self, key, h, last_write):
+        self.entries[key] = {"hash": h, "lastWrite": last_write}
+
+    def pending(self, keys):
+        for key in keys:
+            self.entries[key] = {"pending": True}
+
+    def is_pending(self, key):
+        return "pending" in self.entries.get(key, {})
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    def save(self):
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.entries, f)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def _stored_hash(custom_data, ledger, key, last_write):
+    """The content hash the server holds for `key`: its customData, else the ledger entry."""
+    if ledger is not None and ledger.is_pending(key):
+        return None
+    h = storedHash(custom_data)
+    if h is None and ledger is not None:
+        h = ledger.get(key, last_write)
+    return h
+
+
+async def put_changed_arrays(session, arrays, ledger=None, depth=None):
+    """
+    Upload the `arrays`, (uri, pathInResource, ndarray), whose content hash
+    differs from the one stored with the server's copy, see putDataArrays.
+    Arrays are hashed in worker threads and checked with one
+    GetDataArrayMetadata request.  With a `ledger`, the arrays sent without a
+    hash in their customData are recorded in it, and arrays are marked
+    pending while they are sent, so that an upload cut short is sent again
+    even though its hash is already stored.  Without one, arrays sent in
+    blocks carry no hash, since it would be stored before their data: they
+    are sent every time.  Returns {"sent", "skipped", "failed"}: counts, and
+    the failures of putDataArrays.
+
+    A hash in customData is trusted as long as the array is only written
+    through putDataArrays: a PutDataSubarrays by another client leaves it
+    stale.
+    """
+    arrays = [(uri, pir, np.asarray(array)) for uri, pir, array in arrays]
+    hashes = dict(zip(
+        [(uri, pir) for uri, pir, _ in arrays],
+        await asyncio.gather(*(asyncio.to_thread(content_hash, array) for _, _, array in arrays)),
+    ))
+    stored = await getDataArraysMetadata(session, hashes)
+    changed = []
+    for uri, pir, array in arrays:
+        md = stored.get((uri, pir))
+        if md is None or _stored_hash(md.custom_data, ledger, f"{uri} {pir}", md.store_last_write) != hashes[(uri, pir)]:
+            changed.append((uri, pir, array))
+    succeeded, failed = [], {}
+    if changed:
+        if ledger is not None:
+            ledger.pending(f"{uri} {pir}" for uri, pir, _ in changed)
+            ledger.save()
+        succeeded, failed = await putDataArrays(
+            session, changed, depth, {(uri, pir): hashes[(uri, pir)] for uri, pir, _ in changed},
+            hash_chunked=ledger is not None,
+        )
+        if ledger is not None and succeeded:
+            for (uri, pir), md in (await getDataArraysMetadata(session, succeeded)).items():
+                if storedHash(md.custom_data) is None:
+                    ledger.put(f"{uri} {pir}", hashes[(uri, pir)], md.store_last_write)
+                else:
+                    ledger.discard(f"{uri} {pir}")
+            ledger.save()
+    return {"sent": len(succeeded), "skipped": len(arrays) - len(changed), "failed": failed}
+
+
+def _with_hash(do, h):
+    """A copy of DataObject `do` with content hash `h` in its resource customData."""
+    custom_data = dict(do.resource.custom_data or {}, **{CONTENT_HASH: DataValue(item=h)})
+    return do.copy(update={"resource": do.resource.copy(update={"custom_data": custom_data})})
+
+
+# dataspace URI ("eml:///" for the default dataspace) and qualified type of a data object URI
+_OBJECT_URI_RE = re.compile(r"(eml:///(?:dataspace\('[^']*'\))?)/?([^/(]+)\(")
+
+
+async def _discover_stored(session, uris):
+    """The Resources among `uris` the server holds, found with one discovery per dataspace."""
+    types = collections.defaultdict(set)
+    for uri in uris:
+        m = _OBJECT_URI_RE.match(uri)
+        if m is not None:  # anything else is not looked up, and sent
+            types[m.group(1)].add(m.group(2))
+    found = await asyncio.gather(*(discoverResources(session, ds, sorted(t)) for ds, t in types.items()))
+    return {r.uri: r for resources in found for r in resources if r.uri in uris}
+
+
+async def put_changed_objects(session, data_objects, ledger=None, window=None):
+    """
+    Upload the DataObjects whose content hash differs from the one stored
+    with the server's copy, with their hash added to their customData.  The
+    stored hashes are read from discovery of the objects' dataspaces, filtered
+    by their types.  With a `ledger`, the objects the server lists without a
+    hash are recorded in it.  Returns {"sent", "skipped", "failed"}: counts,
+    and the failures of putDataObjects, as put_changed_arrays.
+    """
+    data_objects = list(data_objects)
+    hashes = {do.resource.uri: content_hash(do.data) for do in data_objects}
+    stored = await _discover_stored(session, hashes)
+    pending, skipped = [], []
+    for do in data_objects:
+        uri = do.resource.uri
+        r = stored.get(uri)
+        if r is not None and _stored_hash(r.custom_data, ledger, uri, r.last_changed) == hashes[uri]:
+            skipped.append(uri)
+        else:
+            pending.append(_with_hash(do, hashes[uri]))
+    if not pending:
+        return {"sent": 0, "skipped": len(skipped), "failed": {}}
+    options = {} if window is None else {"window": window}
+    succeeded, failed = await putDataObjects(session, pending, **options)
+    if ledger is not None and succeeded:
+        for uri, r in (await _discover_stored(session, set(succeeded))).items():
+            if storedHash(r.custom_data) is None:
+                ledger.put(uri, hashes[uri], r.last_changed)
+        ledger.save()
+    return {"sent": len(succeeded), "skipped": len(skipped), "failed": failed}
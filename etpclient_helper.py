@@ -1,102 +1,284 @@
+import asyncio
+import math
 import numpy as np
 import time
 
+from lxml import etree
+
 #
 # NOTE: this code requires a patched version of etpclient
 #
 
-from etpclient.websocket_manager import WebSocketManager
 from etpclient.etp.requester import *
 # import etpclient.etp.serverprotocols
 
 from etptypes.energistics.etp.v12.protocol.data_array.put_data_arrays import (
     PutDataArrays,
 )
+from etptypes.energistics.etp.v12.protocol.data_array.put_uninitialized_data_arrays import (
+    PutUninitializedDataArrays,
+)
+from etptypes.energistics.etp.v12.protocol.data_array.get_data_subarrays import (
+    GetDataSubarrays,
+)
+from etptypes.energistics.etp.v12.protocol.data_array.get_data_array_metadata import (
+    GetDataArrayMetadata,
+)
+from etptypes.energistics.etp.v12.protocol.store.put_data_objects import (
+    PutDataObjects,
+)
+from etptypes.energistics.etp.v12.protocol.transaction.start_transaction import StartTransaction
+from etptypes.energistics.etp.v12.protocol.transaction.commit_transaction import CommitTransaction
+from etptypes.energistics.etp.v12.protocol.transaction.rollback_transaction import RollbackTransaction
+from etptypes.energistics.etp.v12.protocol.discovery.get_resources import (
+    GetResources,
+)
+
+from etp_arrays import (
+    CONTENT_HASH,
+    TRANSPORT_DTYPES,
+    TRANSPORT_ITEMSIZE,
+    transport_for,
+    transport_type,
+    array_dtype,
+    array_metadata,
+    subarray_blocks,
+    block_slices,
+    encode_put_data_arrays,
+    encode_put_data_subarrays,
+)
+
+
+# ETP error code of a request for a resource the server does not hold
+ENOT_FOUND = 11
+
+
+class EtpError(Exception):
+    """
+    A ProtocolException returned by the server, either with one `error` or with
+    a map of `errors` keyed like the request it answers.
+    """
+
+    def __init__(self, error=None, errors=None):
+        self.error = error
+        self.errors = errors or {}
+        self.code = getattr(error, "code", None)
+        if error is not None:
+            message = f"{error.message} (code {self.code})"
+        else:
+            message = "; ".join(f"{k}: {e.message} (code {e.code})" for k, e in self.errors.items())
+        super().__init__(message)
+
+    @property
+    def not_found(self):
+        """Whether all errors are ENOT_FOUND, i.e. nothing requested is stored."""
+        codes = [self.code] if self.error is not None else [e.code for e in self.errors.values()]
+        return bool(codes) and all(code == ENOT_FOUND for code in codes)
+
+
+class EtpConnectionError(ConnectionError):
+    """The websocket or the ETP session could not be established."""
+
+
+class EtpTransactionError(Exception):
+    """The server did not start, commit or roll back a transaction; the message is its failureReason."""
 
 
 def openWebSocket(
     serv_url=None,
     serv_port=None,
     serv_sub_path=None,
-    serv_token=None,   
-):
-    use_wss = 'azure' in serv_url
-    serv_uri = (
-        str(serv_url)
-        + (":" + str(serv_port) if serv_port else "")
-        + "/"
-        + (serv_sub_path + "/" if serv_sub_path else "")
-    )
-    protocol = "wss://" if use_wss else "ws://"
-    wsm = WebSocketManager(
-        protocol + serv_uri,
-        username=None,
-        password=None,
-        token=serv_token if use_wss else None,
+    serv_token=None,
+    timeout=30.0,
+):
+    """
+    Open an ETP session with the server: an etp_session.EtpSession, whose
+    connect() resolves on OpenSession instead of polling for the connection,
+    and which the helpers take in place of a WebSocketManager.  Raises
+    EtpConnectionError when no session is open after `timeout` seconds.
+    """
+    from etp_session import EtpSession  # etp_session imports this module
+
+    return EtpSession(
+        serv_url, serv_port, serv_sub_path,
+        serv_token if 'azure' in serv_url else None,
+        timeout=timeout,
     )
-    cpt_wait = 0
-    time_step = 0.01
-    while not wsm.is_connected() and (cpt_wait * time_step < 30):
-        # if (cpt_wait * 1000 % 1000) < 5:
-        #     print("\rwait for connection" + wait_symbol(cpt_wait), end="")
-        cpt_wait = cpt_wait + 1
-        time.sleep(time_step)
 
-    running = wsm.is_connected()
 
-    if not running and (cpt_wait * time_step >= 30):
-        print("Timeout...")
-    return wsm
+# Seconds a GetDataspaces listing is trusted by the session's DataspaceRegistry
+DEFAULT_DATASPACE_TTL = 60.0
+
+
+class DataspaceRegistry:
+    """
+    The dataspaces of a server as last listed by GetDataspaces, kept up to
+    date by the session's own PutDataspaces and DeleteDataspaces, so that
+    setting up many dataspaces does not list them all again for every one.
+
+    The listing is trusted for `ttl` seconds.  Dataspaces put by the session
+    since are known to exist, but make the listing incomplete: the next
+    getDataspaces asks the server again.
+    """
+
+    def __init__(self, ttl=DEFAULT_DATASPACE_TTL):
+        self.ttl = ttl
+        self.records = {}  # path -> Dataspace
+        self.added = set()  # paths put since the last listing
+        self.listed_at = None
+        self.listings = 0
+
+    def _expired(self):
+        return self.listed_at is None or time.monotonic() - self.listed_at >= self.ttl
+
+    def fresh(self):
+        """Whether the listing can be returned without asking the server."""
+        return not self.added and not self._expired()
+
+    def fill(self, dataspaces):
+        self.records = {ds.path: ds for ds in dataspaces}
+        self.added.clear()
+        self.listed_at = time.monotonic()
+        self.listings += 1
+
+    def exists(self, path):
+        """True or False when known, None when the server has to be asked."""
+        if path in self.added:
+            return True
+        if self._expired():
+            return None
+        return path in self.records
+
+    def put(self, path):
+        self.added.add(path)
+
+    def deleted(self, path):
+        self.records.pop(path, None)
+        self.added.discard(path)
+
+    def invalidate(self):
+        self.listed_at = None
+
 
 async def getDataspaces(
-    wsm=None,
+    wsm=None, refresh=False,
 ):
+    """
+    List the dataspaces of the server.  On a session with a
+    dataspace_registry, a listing younger than its ttl is returned without a
+    request unless `refresh` is set.
+    """
+    registry = getattr(wsm, "dataspace_registry", None)
+    if registry is not None and not refresh and registry.fresh():
+        return list(registry.records.values())
     result = await wsm.send_and_wait(get_dataspaces())
     if result:
         print("==== type ", type(result))
         pass
     else:
         print("No answer...")
+    if registry is not None and result is not None:
+        registry.fill(result)
     return result
 
 async def deleteDataspace(
     wsm, dataspacePath,
 ):
-    result = await wsm.send_and_wait(delete_dataspace([dataspacePath]))
+    """Delete a dataspace; one the server does not hold counts as deleted."""
+    registry = getattr(wsm, "dataspace_registry", None)
+    try:
+        result = await wsm.send_and_wait(delete_dataspace([dataspacePath]))
+    except EtpError as e:
+        if not e.not_found:
+            raise
+        if registry is not None:
+            registry.deleted(dataspacePath)
+        return None
     if result:
         # pretty_p.pprint(result)
-        pass
+        if registry is not None:
+            registry.deleted(dataspacePath)
     else:
         print("No answer...")
+        if registry is not None:
+            registry.invalidate()
 
 async def addDataspace(
     wsm, dataspacePath,
 ):
-    gds = await getDataspaces(wsm)
-    existingPaths = [ds.path for ds in gds]
-    if (dataspacePath in existingPaths):
+    registry = getattr(wsm, "dataspace_registry", None)
+    exists = registry.exists(dataspacePath) if registry is not None else None
+    if exists is None:
+        gds = await getDataspaces(wsm)
+        exists = dataspacePath in [ds.path for ds in gds or []]
+    if exists:
         print("Requested Dataspace already exists on server", dataspacePath )
         return
-    if (dataspacePath not in existingPaths):
-        # print("Trying to add Dataspace", dataspacePath)
-        try:
-            result = await wsm.send_and_wait(put_dataspace([dataspacePath]))
-        except Exception as e:
-            print(e)
+    # print("Trying to add Dataspace", dataspacePath)
+    try:
+        result = await wsm.send_and_wait(put_dataspace([dataspacePath]))
+    except Exception as e:
+        print(e)
+        result = None
+    if registry is not None:
+        if result:
+            registry.put(dataspacePath)
+        else:
+            registry.invalidate()
     return
 
+async def transactionResponse(wsm, msg):
+    response = (await wsm.request(msg))[-1]
+    if not response.successful:
+        raise EtpTransactionError(f"{type(msg).__name__}: {response.failure_reason}")
+    return response
+
+async def startTransaction(
+    wsm, dataspace_uris, read_only=False, message="",
+):
+    """
+    Open an ETP transaction (protocol 18) over `dataspace_uris`; returns its
+    transactionUuid.  Requires an EtpSession as wsm.
+    """
+    response = await transactionResponse(wsm, StartTransaction.parse_obj({
+        "readOnly": read_only,
+        "message": message,
+        "dataspaceUris": list(dataspace_uris),
+    }))
+    return response.transaction_uuid
+
+async def commitTransaction(
+    wsm, transaction_uuid,
+):
+    await transactionResponse(wsm, CommitTransaction(transactionUuid=transaction_uuid))
+
+async def rollbackTransaction(
+    wsm, transaction_uuid,
+):
+    await transactionResponse(wsm, RollbackTransaction(transactionUuid=transaction_uuid))
+
 async def putDataObject(
     wsm, file, dataspace
 ):
+    """
+    Send one PutDataObjects per part of an .epc file without waiting for the
+    responses.  On an EtpSession the sends are paced by its send window, and
+    the call returns once the server has answered them all.
+    """
+    cache = getattr(wsm, "object_cache", None)
     for putDataObj in put_data_object_by_path(
         file, dataspace
     ):
+        if cache is not None:
+            cache.forget(do.resource.uri for do in putDataObj.data_objects.values())
         result = await wsm.send_no_wait(putDataObj)
         if result:
             # pretty_p.pprint(result)
             pass
         else:
             print("No answer...")
+    if hasattr(wsm, "drain"):
+        await wsm.drain()
 
 async def putDataObjectArray(
     wsm, pda_dict,
@@ -129,37 +311,868 @@ async def getResources(
         pass
     else:
         print("No answer...")
+    objectCacheSeen(wsm, result or [])
     return result
 
 
+async def discoverResources(
+    wsm, uri, data_object_types=(), scope="targetsOrSelf", depth=1,
+    store_last_write_filter=None, active_status_filter=None, navigable_edges="Primary",
+):
+    """
+    List the resources around `uri` (a dataspace or a data object) with the
+    filtering done by the server: only resources of the qualified
+    `data_object_types` (e.g. "resqml20.obj_ContinuousProperty", or
+    "resqml20.*"; all types when empty), within `scope` ("self", "sources",
+    "targets", "sourcesOrSelf" or "targetsOrSelf") up to `depth` edges away,
+    and, with `store_last_write_filter` (microseconds since the epoch), only
+    those written since.  Returns Resources only, no object bodies.
+    """
+    result = await wsm.send_and_wait(getResourcesRequest(
+        uri, data_object_types, scope, depth,
+        store_last_write_filter, active_status_filter, navigable_edges,
+    ))
+    objectCacheSeen(wsm, result or [])
+    return result or []
+
+
+def getResourcesRequest(
+    uri, data_object_types=(), scope="targetsOrSelf", depth=1,
+    store_last_write_filter=None, active_status_filter=None, navigable_edges="Primary",
+):
+    """The GetResources message of discoverResources."""
+    return GetResources.parse_obj({
+        "context": {
+            "uri": uri,
+            "depth": depth,
+            "dataObjectTypes": list(data_object_types),
+            "navigableEdges": navigable_edges,
+        },
+        "scope": scope,
+        "countObjects": False,
+        "storeLastWriteFilter": store_last_write_filter,
+        "activeStatusFilter": active_status_filter,
+        "includeEdges": False,
+    })
+
+
 async def getDataArray(
-    wsm, uri, pir
+    wsm, uri, pir, dtype=None, metadata=None,
 ):
+    """
+    Fetch one array with GetDataArrays, returned with `dtype`, or else with
+    the dtype of the logical type in its DataArrayMetadata.  Pass `dtype` or
+    `metadata` when known: otherwise the metadata is requested alongside (see
+    getDataArrays to look it up for many arrays at once).  Returns None when
+    the server has no such array.
+    """
     get_data_arr = get_data_array( uri,pir )
-    print(f"\n\n{get_data_arr}\n\n")
-    result = await wsm.send_and_wait(get_data_arr)
+    # print(f"\n\n{get_data_arr}\n\n")
+    cache = getattr(wsm, "array_cache", None)
+    if cache is not None:
+        return await cachedDataArray(wsm, cache, uri, pir, get_data_arr, dtype, metadata)
+    if dtype is None and metadata is None:
+        found, result = await asyncio.gather(
+            getDataArrayMetadata(wsm, uri, pir),
+            sendDataArrayRequest(wsm, get_data_arr),
+        )
+        if not found:
+            return None
+        (metadata,) = found.values()
+    else:
+        result = await sendDataArrayRequest(wsm, get_data_arr)
+    if isinstance(result, np.ndarray):
+        result = result.astype(dtype or array_dtype(metadata), copy=False)
+    return result
+
+async def sendDataArrayRequest(wsm, get_data_arr):
+    """The array answering a GetDataArrays request, or None when it is not stored."""
+    try:
+        return await wsm.send_and_wait(get_data_arr)
+    except EtpError as e:
+        if not e.not_found:
+            raise
+        return None
+
+async def getDataArrays(
+    wsm, uids,
+):
+    """
+    Fetch several arrays, a list of (uri, pathInResource), with their
+    metadata read in one GetDataArrayMetadata request and one GetDataArrays
+    request per array.  Returns the arrays in the order of `uids`, None for
+    those the server does not hold.  Requires an EtpSession as wsm.
+    """
+    uids = list(uids)
+    metadata = await getDataArraysMetadata(wsm, uids)
+
+    async def get(uri, pir):
+        md = metadata.get((uri, pir))
+        return None if md is None else await getDataArray(wsm, uri, pir, metadata=md)
+
+    return await asyncio.gather(*(get(uri, pir) for uri, pir in uids))
+
+async def cachedDataArray(wsm, cache, uri, pir, get_data_arr, dtype=None, metadata=None):
+    """
+    getDataArray through an ArrayCache, validated by the storeLastWrite of
+    the array's `metadata` (requested when not given).
+    """
+    if metadata is None:
+        found = await getDataArrayMetadata(wsm, uri, pir)
+        if not found:
+            return None
+        (metadata,) = found.values()
+    cached = cache.get(uri, pir, metadata.store_last_write)
+    if cached is not None:
+        return cached if dtype is None else cached.astype(dtype, copy=False)
+    result = await sendDataArrayRequest(wsm, get_data_arr)
+    if isinstance(result, np.ndarray):
+        result = cache.put(uri, pir, metadata.store_last_write, result.astype(dtype or array_dtype(metadata), copy=False))
     return result
 
 async def getDataArrayMetadata(
     wsm, uri, pir
 ):
+    """
+    The GetDataArrayMetadata of one array, as {key: metadata}, or None when
+    the server has no such array.
+    """
     get_data_arr = get_data_array_metadata(uri, pir)
-    result = await wsm.send_and_wait(get_data_arr)
+    try:
+        result = await wsm.send_and_wait(get_data_arr)
+    except EtpError as e:
+        if not e.not_found:
+            raise
+        return None
     if result:
         pass
     else:
         print("No answer...")
+    return result
+
+async def getDataArraysMetadata(
+    wsm, uids,
+):
+    """
+    The DataArrayMetadata of many arrays with one GetDataArrayMetadata
+    request, as {(uri, pathInResource): metadata}; arrays the server does not
+    hold are left out.  Requires an EtpSession as wsm.
+    """
+    uids = list(uids)
+    if not uids:
+        return {}
+    try:
+        parts = await wsm.request(GetDataArrayMetadata.parse_obj({"dataArrays": {
+            str(i): {"uri": uri, "pathInResource": pir} for i, (uri, pir) in enumerate(uids)
+        }}))
+    except EtpError as e:
+        if not e.not_found:
+            raise
+        return {}
+    found = {}
+    for part in parts:
+        if type(part).__name__ == "GetDataArrayMetadataResponse":
+            found.update((uids[int(k)], md) for k, md in part.array_metadata.items())
+    return found
+
+
+def storedHash(custom_data):
+    """The CONTENT_HASH recorded in a customData map, or None."""
+    value = (custom_data or {}).get(CONTENT_HASH)
+    return None if value is None else value.item
+
+
+def objectCacheSeen(wsm, resources):
+    """Let the session's ObjectCache, if any, know the current lastChanged of `resources`."""
+    cache = getattr(wsm, "object_cache", None)
+    if cache is not None:
+        cache.seen(resources)
+
 
 async def getDataObject(
     wsm, uri
 ):
+    """
+    Fetch one data object; returns {key: DataObject}.  With a session
+    object_cache, a copy cached for the resource's current lastChanged is
+    returned without asking the server.
+    """
+    cache = getattr(wsm, "object_cache", None)
+    if cache is not None:
+        do = cache.get(uri)
+        if do is not None:
+            return {"0": do}
     get_data_obj = get_data_object([uri])
     # print("Sending : ", get_data_obj.__dict__)
     result = await wsm.send_and_wait(get_data_obj)
     if result:
-        print(type(result))
+        # print(type(result))
         pass
     else:
         print("No answer...")
+    if cache is not None:
+        for do in (result or {}).values():
+            cache.put(do)
+    return result
+
+
+
+# Used to size GetDataObjects batches when the server does not advertise
+# MaxDataObjectSize, or advertises a limit far above typical RESQML XML parts.
+EXPECTED_DATA_OBJECT_SIZE = 64 * 1024
+
+
+def objectsPerMessage(wsm):
+    """Number of data objects expected to fit in one response message."""
+    caps = wsm.endpoint_capabilities
+    object_size = min(int(caps.get("MaxDataObjectSize") or EXPECTED_DATA_OBJECT_SIZE), EXPECTED_DATA_OBJECT_SIZE)
+    count = max(1, wsm.max_message_size // object_size)
+    if caps.get("MaxResponseCount"):
+        count = min(count, int(caps["MaxResponseCount"]))
+    return count
+
+
+def batchUris(uris, per_message, max_message_size):
+    """Split uris into lists of at most per_message, each fitting one request message."""
+    batches, batch, size = [], [], 0
+    for uri in uris:
+        uri_size = len(uri) + 16  # map key and Avro length prefixes
+        if batch and (len(batch) == per_message or size + uri_size > max_message_size):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(uri)
+        size += uri_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def mergeDataObjects(parts):
+    """
+    Merge the parts of a GetDataObjects response into {uri: DataObject}.
+    Objects sent as chunks (a DataObject with a blobId and no data, followed by
+    Chunk messages) are reassembled.
+    """
+    objects, chunks = {}, {}
+    for part in parts:
+        name = type(part).__name__
+        if name == "GetDataObjectsResponse":
+            for do in part.data_objects.values():
+                objects[do.resource.uri] = do
+        elif name == "Chunk":
+            chunks.setdefault(part.blob_id, []).append(part.data)
+        elif name == "ProtocolException":
+            print("ETP error:", part.errors)
+    for uri, do in objects.items():
+        if do.blob_id is not None and not do.data:
+            objects[uri] = do.copy(update={"data": b"".join(chunks.pop(do.blob_id, []))})
+    return objects
+
+
+async def getDataObjects(
+    wsm, uris, per_message=None,
+):
+    """
+    Fetch many data objects with as few GetDataObjects messages as the
+    negotiated message size allows; the batches are pipelined.  Returns a single
+    dict {uri: DataObject}.  Objects the server could not find are left out.
+    With a session object_cache, only the objects without a copy cached for
+    their current lastChanged are requested.  Requires an EtpSession as wsm.
+    """
+    if per_message is None:
+        per_message = objectsPerMessage(wsm)
+    cache = getattr(wsm, "object_cache", None)
+    result = {}
+    if cache is not None:
+        for uri in uris:
+            do = cache.get(uri)
+            if do is not None:
+                result[uri] = do
+        uris = [uri for uri in uris if uri not in result]
+
+    async def fetch(batch):
+        try:
+            return mergeDataObjects(await wsm.request(get_data_object(batch)))
+        except EtpError as e:
+            if not e.errors:
+                raise
+            print("ETP error:", e)
+            return {}
+
+    for objects in await asyncio.gather(*(
+        fetch(batch) for batch in batchUris(uris, per_message, wsm.max_message_size)
+    )):
+        result.update(objects)
+        if cache is not None:
+            for do in objects.values():
+                cache.put(do)
     return result
 
+
+# Data objects requested ahead of the consumer by iterDataObjects
+DEFAULT_PREFETCH_OBJECTS = 512
+
+
+async def iterDataObjects(
+    wsm, uri, data_object_types=(), prefetch=DEFAULT_PREFETCH_OBJECTS, per_message=None,
+):
+    """
+    Yield the DataObjects of a dataspace (or around a data object, as in
+    discoverResources) as they arrive.  The GetResources response is read part
+    by part, each part's resources are fetched in GetDataObjects batches, and
+    at most `prefetch` objects are requested ahead of the consumer, so memory
+    does not grow with the size of the dataspace.  Objects the server could
+    not find are skipped.  Requires an EtpSession as wsm.
+    """
+    if per_message is None:
+        per_message = objectsPerMessage(wsm)
+    per_message = max(1, min(per_message, prefetch))
+    fetches = asyncio.Queue(maxsize=max(1, prefetch // per_message))
+    outstanding = set()  # fetches started and not consumed yet, queued or not
+
+    def fetch(batch):
+        future = asyncio.ensure_future(getDataObjects(wsm, batch, per_message))
+        outstanding.add(future)
+        return future
+
+    async def discover():
+        batch = []
+        parts = wsm.request_parts(getResourcesRequest(uri, data_object_types))
+        try:
+            async for part in parts:
+                if type(part).__name__ != "GetResourcesResponse":
+                    print("ETP error:", part.errors)
+                    continue
+                objectCacheSeen(wsm, part.resources)
+                for resource in part.resources:
+                    batch.append(resource.uri)
+                    if len(batch) == per_message:
+                        await fetches.put(fetch(batch))
+                        batch = []
+            if batch:
+                await fetches.put(fetch(batch))
+        except Exception as e:
+            await fetches.put(e)
+            return
+        finally:
+            # cancelled while waiting for room in the queue: end the request now, not at garbage collection
+            await parts.aclose()
+        await fetches.put(None)
+
+    producer = asyncio.ensure_future(discover())
+    try:
+        while True:
+            future = await fetches.get()
+            if future is None:
+                break
+            if isinstance(future, Exception):
+                raise future
+            objects = await future
+            outstanding.discard(future)
+            for do in objects.values():
+                yield do
+    finally:
+        # the consumer may stop early: no request is left running behind it
+        producer.cancel()
+        for future in outstanding:
+            future.cancel()
+        await asyncio.gather(producer, *outstanding, return_exceptions=True)
+
+
+DEFAULT_PUT_WINDOW = 8
+
+
+def batchDataObjects(data_objects, max_message_size):
+    """Group DataObjects into lists whose encoded size fits one message."""
+    batches, batch, size = [], [], 0
+    for do in data_objects:
+        do_size = len(do.data) + len(do.resource.uri) + 256  # resource fields and Avro framing
+        if batch and size + do_size > max_message_size:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(do)
+        size += do_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def putDataObjects(
+    wsm, data_objects, window=DEFAULT_PUT_WINDOW,
+):
+    """
+    Upload DataObjects with as few PutDataObjects messages as the negotiated
+    message size allows.  At most `window` messages are unacknowledged at any
+    time.  Returns (succeeded, failed): the list of stored URIs and a dict
+    {uri: error message}.  Requires an EtpSession as wsm.
+    """
+    slots = asyncio.Semaphore(window)
+    succeeded, failed = [], {}
+    cache = getattr(wsm, "object_cache", None)
+    if cache is not None:
+        data_objects = list(data_objects)
+        cache.forget(do.resource.uri for do in data_objects)
+
+    def record_errors(uris, errors):
+        for k, err in errors.items():
+            failed[uris[k]] = f"{err.message} (code {err.code})"
+
+    async def put(batch):
+        uris = {str(i): do.resource.uri for i, do in enumerate(batch)}
+        async with slots:
+            # built once a slot is free, so at most `window` messages are held
+            msg = PutDataObjects.parse_obj({
+                "dataObjects": {str(i): do for i, do in enumerate(batch)},
+                "pruneContainedObjects": False,
+            })
+            try:
+                parts = await wsm.request(msg)
+            except EtpError as e:
+                if e.error is not None:
+                    failed.update({uri: str(e) for uri in uris.values()})
+                else:
+                    record_errors(uris, e.errors)
+                return
+        for part in parts:
+            name = type(part).__name__
+            if name == "PutDataObjectsResponse":
+                succeeded.extend(uris[k] for k in part.success)
+            elif name == "ProtocolException":
+                record_errors(uris, part.errors)
+
+    await asyncio.gather(*(put(b) for b in batchDataObjects(data_objects, wsm.max_message_size)))
+    return succeeded, failed
+
+
+async def putEpcDataObjects(
+    wsm, file, dataspace, window=DEFAULT_PUT_WINDOW,
+):
+    """Upload all parts of an .epc file with putDataObjects."""
+    data_objects = []
+    for putDataObj in put_data_object_by_path(
+        file, dataspace
+    ):
+        data_objects.extend(putDataObj.data_objects.values())
+    return await putDataObjects(wsm, data_objects, window)
+
+
+DEFAULT_SUBARRAY_DEPTH = 4
+
+
+def subarrayBytes(wsm):
+    """Payload budget of one PutDataSubarrays/GetDataSubarrays block."""
+    return int(wsm.max_message_size * 0.9)
+
+
+class TransferTuner:
+    """
+    Picks the tile size and in-flight depth of chunked array transfers from
+    the round-trip time and throughput measured on one session.
+
+    Like TCP slow start, the tile size doubles after every round (one window
+    of `depth` tiles) for as long as the throughput of the round grows by at
+    least `growth`, up to the message size.  The depth follows the
+    bandwidth-delay product, enough tiles in flight to cover the fastest
+    round trip.  A round whose throughput falls below half the best seen
+    halves the tile size and restarts slow start.
+
+    The session's tuner only keeps what was learnt: each transfer measures its
+    rounds on its own tuner, seeded by `begin` and handed back to `learn` when
+    the transfer is done, so overlapping transfers do not mix their samples.
+    What was learnt carries over to the next transfer on the session.
+    """
+
+    def __init__(self, tile_bytes=256 * 1024, depth=2, max_depth=16, growth=1.25):
+        self.tile_bytes = tile_bytes
+        self.depth = depth
+        self.max_depth = max_depth
+        self.growth = growth
+        self.slow_start = True
+        self.min_rtt = None
+        self.throughput = 0.0
+        self.best_throughput = 0.0
+        self.rounds = 0
+        self._round_start = None
+        self._round_bytes = 0
+        self._round_tiles = 0
+
+    def begin(self, max_tile_bytes):
+        """
+        Start a transfer whose tiles must not exceed `max_tile_bytes`; returns
+        the tuner of that transfer, seeded with what this one has learnt, and
+        its TransferStats.
+        """
+        tuner = TransferTuner(min(self.tile_bytes, max_tile_bytes), self.depth, self.max_depth, self.growth)
+        tuner.slow_start = self.slow_start
+        tuner.min_rtt = self.min_rtt
+        tuner.throughput = self.throughput
+        tuner.best_throughput = self.best_throughput
+        tuner.max_tile_bytes = max_tile_bytes
+        tuner._round_start = time.perf_counter()
+        return tuner, TransferStats(tuner)
+
+    def learn(self, tuner):
+        """Keep the tile size and depth a finished transfer's `tuner` converged to."""
+        if tuner.rounds == 0:  # too short to measure a round
+            return
+        self.tile_bytes = tuner.tile_bytes
+        self.depth = tuner.depth
+        self.slow_start = tuner.slow_start
+        self.min_rtt = tuner.min_rtt if self.min_rtt is None else min(self.min_rtt, tuner.min_rtt)
+        self.throughput = tuner.throughput
+        self.best_throughput = tuner.best_throughput
+
+    def record(self, stats, nbytes, rtt):
+        """Account for one tile of `nbytes` that took `rtt` seconds."""
+        stats.record(nbytes, rtt)
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        self._round_bytes += nbytes
+        self._round_tiles += 1
+        if self._round_tiles >= self.depth:
+            self._end_round()
+
+    def _end_round(self):
+        now = time.perf_counter()
+        rate = self._round_bytes / max(now - self._round_start, 1e-9)
+        if self.slow_start:
+            if rate >= self.throughput * self.growth and self.tile_bytes < self.max_tile_bytes:
+                self.tile_bytes = min(2 * self.tile_bytes, self.max_tile_bytes)
+            else:
+                self.slow_start = False
+        elif rate < self.best_throughput / 2:
+            self.tile_bytes = max(self.tile_bytes // 2, 64 * 1024)
+            self.slow_start = True
+            self.best_throughput = 0.0
+        self.throughput = rate
+        self.best_throughput = max(self.best_throughput, rate)
+        bdp = rate * self.min_rtt
+        self.depth = max(2, min(self.max_depth, math.ceil(bdp / self.tile_bytes) + 1))
+        self.rounds += 1
+        self._round_start = now
+        self._round_bytes = self._round_tiles = 0
+
+
+class TransferStats:
+    """Statistics of one chunked transfer, with the parameters the tuner chose."""
+
+    def __init__(self, tuner=None):
+        self.tuner = tuner
+        self.bytes = 0
+        self.tiles = 0
+        self.rtt = []
+        self.tile_bytes = []
+        self.depth = []
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def record(self, nbytes, rtt):
+        self.bytes += nbytes
+        self.tiles += 1
+        self.rtt.append(rtt)
+        if self.tuner is not None:
+            self.tile_bytes.append(self.tuner.tile_bytes)
+            self.depth.append(self.tuner.depth)
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+        return self
+
+    def summary(self):
+        return {
+            "bytes": self.bytes,
+            "tiles": self.tiles,
+            "seconds": self.seconds,
+            "throughput": self.bytes / self.seconds if self.seconds else 0.0,
+            "min_rtt": min(self.rtt, default=None),
+            "tile_bytes": self.tile_bytes[-1] if self.tile_bytes else None,
+            "max_tile_bytes": max(self.tile_bytes, default=None),
+            "depth": self.depth[-1] if self.depth else None,
+            "max_depth": max(self.depth, default=None),
+        }
+
+
+async def transferTiles(
+    wsm, shape, itemsize, transfer, chunk_bytes=None, depth=None,
+):
+    """
+    Cover an array of `shape` with tiles along the leading dimension and run
+    `await transfer(starts, counts)` for each, with several in flight.  With
+    neither `chunk_bytes` nor `depth` given, a tuner seeded from the session's
+    TransferTuner sizes the tiles and the depth as the transfer goes;
+    otherwise tiles are fixed at `chunk_bytes` (default: the message budget)
+    with `depth` in flight.  The TransferStats are appended to
+    wsm.transfer_stats and returned.
+    """
+    budget = subarrayBytes(wsm)
+    row_bytes = int(np.prod(shape[1:], dtype=np.int64)) * itemsize
+    adaptive = chunk_bytes is None and depth is None and len(shape) > 0 and 0 < row_bytes <= budget
+    if adaptive:
+        tuner, stats = wsm.tuner.begin(budget)
+    else:
+        tuner, stats = None, TransferStats()
+        blocks = subarray_blocks(shape, itemsize, chunk_bytes or budget)
+        depth = depth or DEFAULT_SUBARRAY_DEPTH
+
+    def next_block(start):
+        if not adaptive:
+            return next(blocks, None)
+        if start >= shape[0]:
+            return None
+        rows = min(max(1, tuner.tile_bytes // row_bytes), shape[0] - start)
+        return [start] + [0] * (len(shape) - 1), [rows] + list(shape[1:])
+
+    async def timed(starts, counts):
+        t0 = time.perf_counter()
+        await transfer(starts, counts)
+        nbytes = int(np.prod(counts, dtype=np.int64)) * itemsize
+        if adaptive:
+            tuner.record(stats, nbytes, time.perf_counter() - t0)
+        else:
+            stats.record(nbytes, time.perf_counter() - t0)
+
+    running, start = set(), 0
+    try:
+        while True:
+            while len(running) < (tuner.depth if adaptive else depth):
+                block = next_block(start)
+                if block is None:
+                    break
+                starts, counts = block
+                start = starts[0] + counts[0]
+                running.add(asyncio.ensure_future(timed(starts, counts)))
+            if not running:
+                break
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+    finally:
+        for task in running:
+            task.cancel()
+    if adaptive:
+        wsm.tuner.learn(tuner)
+    wsm.transfer_stats.append(stats.finish())
+    return stats
+
+
+async def putDataArrayChunked(
+    wsm, uri, pir, array, chunk_bytes=None, depth=None, custom_data=None,
+):
+    """
+    Upload an array of any size: PutUninitializedDataArrays, with the string
+    `custom_data` in its metadata, then PutDataSubarrays blocks along the
+    leading dimension, see transferTiles.  Blocks are Avro-encoded straight
+    from the array buffer when they are sent, so memory stays bounded.
+    Requires an EtpSession as wsm.
+    """
+    array = np.ascontiguousarray(array)
+    uid = {"uri": uri, "pathInResource": pir}
+    metadata = array_metadata(array, custom_data=custom_data)
+    await wsm.request(PutUninitializedDataArrays.parse_obj(
+        {"dataArrays": {"0": {"uid": uid, "metadata": metadata}}}
+    ))
+    itemsize = TRANSPORT_ITEMSIZE[metadata["transportArrayType"]]
+
+    async def put(starts, counts):
+        block = array[block_slices(starts, counts)]
+        await wsm.request_encoded(lambda message_id: encode_put_data_subarrays(
+            uri, pir, block, starts, counts, message_id
+        ))
+
+    await transferTiles(wsm, array.shape, itemsize, put, chunk_bytes, depth)
+
+
+async def putDataArrays(
+    wsm, arrays, depth=None, content_hashes=None, hash_chunked=False,
+):
+    """
+    Upload `arrays`, a list of (uri, pathInResource, ndarray).  Arrays are
+    Avro-encoded straight from their buffers and packed into PutDataArrays
+    messages up to the negotiated message size.  Arrays too large for one
+    message, and arrays whose dtype is not that of their transport type (e.g.
+    int8 sent as arrayOfInt), go through putDataArrayChunked, which declares
+    their logical type.  `content_hashes`, {(uri, pathInResource): hash}, are
+    stored as the CONTENT_HASH customData of the arrays sent in PutDataArrays.
+    A chunked array gets its hash in its PutUninitializedDataArrays metadata,
+    before any block is sent, only with `hash_chunked`: an interrupted upload
+    then leaves a partial array behind a complete hash, which the caller must
+    know to distrust (see etp_upload.put_changed_arrays).  Returns
+    (succeeded, failed): the list of stored (uri, pathInResource) and a dict
+    {(uri, pathInResource): error message}.  Requires an EtpSession as wsm.
+    """
+    custom_data = {key: {CONTENT_HASH: h} for key, h in (content_hashes or {}).items()}
+    budget = subarrayBytes(wsm)
+    batches, batch, size, chunked = [], [], 0, []
+    for uri, pir, array in arrays:
+        array = np.asarray(array)
+        transport = transport_for(array.dtype)
+        array_size = array.size * TRANSPORT_ITEMSIZE[transport] + len(uri) + len(pir) + 64
+        if array_size > budget or array.dtype != TRANSPORT_DTYPES[transport]:
+            chunked.append((uri, pir, array))
+            continue
+        if batch and size + array_size > budget:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append((uri, pir, array))
+        size += array_size
+    if batch:
+        batches.append(batch)
+
+    succeeded, failed = [], {}
+
+    def record_errors(keys, errors):
+        for k, err in errors.items():
+            failed[keys[k]] = f"{err.message} (code {err.code})"
+
+    async def put(batch):
+        keys = {str(i): (uri, pir) for i, (uri, pir, _) in enumerate(batch)}
+        try:
+            parts = await wsm.request_encoded(lambda message_id: encode_put_data_arrays(batch, message_id, custom_data))
+        except EtpError as e:
+            if e.error is not None:
+                failed.update({key: str(e) for key in keys.values()})
+            else:
+                record_errors(keys, e.errors)
+            return
+        for part in parts:
+            name = type(part).__name__
+            if name == "PutDataArraysResponse":
+                succeeded.extend(keys[k] for k in part.success)
+            elif name == "ProtocolException":
+                record_errors(keys, part.errors)
+
+    async def put_chunked(uri, pir, array):
+        try:
+            await putDataArrayChunked(
+                wsm, uri, pir, array, depth=depth, custom_data=custom_data.get((uri, pir)) if hash_chunked else None,
+            )
+        except EtpError as e:
+            failed[(uri, pir)] = str(e)
+        else:
+            succeeded.append((uri, pir))
+
+    await asyncio.gather(
+        *(put(batch) for batch in batches),
+        *(put_chunked(uri, pir, array) for uri, pir, array in chunked),
+    )
+    return succeeded, failed
+
+
+async def getDataArrayChunked(
+    wsm, uri, pir, chunk_bytes=None, depth=None,
+):
+    """
+    Download an array of any size: read its GetDataArrayMetadata, allocate the
+    result once with the dtype of its logical type, then fetch GetDataSubarrays
+    tiles along the leading dimension (see transferTiles), writing each tile
+    into its slice.  Returns None when the server has no such array.  With a
+    session array_cache, the tiles are written straight into the cache file
+    and a cached copy of the same storeLastWrite is returned without a
+    download.  Requires an EtpSession as wsm.
+    """
+    found = await getDataArrayMetadata(wsm, uri, pir)
+    if not found:
+        return None
+    (metadata,) = found.values()
+    key = (uri, pir, metadata.store_last_write)
+    cache = getattr(wsm, "array_cache", None)
+    if cache is None:
+        result = np.empty(metadata.dimensions, array_dtype(metadata))
+    else:
+        result = cache.get(*key)
+        if result is not None:
+            return result
+        result = cache.create(*key, metadata.dimensions, array_dtype(metadata))
+    itemsize = TRANSPORT_ITEMSIZE[transport_type(metadata)]
+    uid = {"uri": uri, "pathInResource": pir}
+
+    async def get(starts, counts):
+        parts = await wsm.request(GetDataSubarrays.parse_obj({"dataSubarrays": {"0": {
+            "uid": uid,
+            "starts": starts,
+            "counts": counts,
+        }}}))
+        for part in parts:
+            if type(part).__name__ == "GetDataSubarraysResponse":
+                for da in part.data_subarrays.values():
+                    result[block_slices(starts, counts)] = np.asarray(da.data.item.values).reshape(counts)
+
+    if cache is None:
+        await transferTiles(wsm, result.shape, itemsize, get, chunk_bytes, depth)
+        return result
+    try:
+        await transferTiles(wsm, result.shape, itemsize, get, chunk_bytes, depth)
+    except BaseException:
+        cache.discard(result)
+        raise
+    return cache.publish(*key, result)
+
+
+async def getDataSubarray(
+    wsm, uri, pir, starts, counts, dtype=None,
+):
+    """
+    Fetch the block of `counts` elements at `starts` of one array with a
+    single GetDataSubarrays request, as an ndarray of `dtype` (the transport
+    dtype by default).  Returns None if the server sent no data.
+    """
+    parts = await wsm.request(GetDataSubarrays.parse_obj({"dataSubarrays": {"0": {
+        "uid": {"uri": uri, "pathInResource": pir},
+        "starts": list(starts),
+        "counts": list(counts),
+    }}}))
+    for part in parts:
+        if type(part).__name__ == "GetDataSubarraysResponse":
+            for da in part.data_subarrays.values():
+                block = np.asarray(da.data.item.values).reshape(counts)
+                return block if dtype is None else block.astype(dtype, copy=False)
+    return None
+
+
+PROPERTY_TYPES = (
+    "resqml20.obj_ContinuousProperty",
+    "resqml20.obj_DiscreteProperty",
+    "resqml20.obj_CategoricalProperty",
+)
+
+
+def hdfArrayRefs(xml, dataspace_uri):
+    """
+    The arrays a data object refers to, as (EpcExternalPartReference URI,
+    PathInHdfFile) pairs, from the HdfProxy next to each PathInHdfFile.
+    """
+    refs = []
+    for path in etree.fromstring(xml).iter("{*}PathInHdfFile"):
+        proxy = path.getparent().find("{*}HdfProxy")
+        proxy_uuid = proxy.findtext("{*}UUID") if proxy is not None else None
+        if proxy_uuid:
+            refs.append((f"{dataspace_uri}/eml20.EpcExternalPartReference({proxy_uuid})", path.text))
+    return refs
+
+
+async def getSupportedProperties(
+    wsm, representation_uri, data_object_types=PROPERTY_TYPES, with_arrays=True, epc_uri=None,
+):
+    """
+    Fetch the properties of one representation: Discovery with scope=sources
+    lists only the objects of `data_object_types` that reference it, those
+    are fetched in bulk and all their arrays concurrently.  The arrays are
+    read from the HdfProxy each property refers to, or from `epc_uri` when
+    given.  Returns {uri: {"object": DataObject, "arrays": {pathInHdfFile:
+    ndarray}}}.  Requires an EtpSession as wsm.
+    """
+    dataspace_uri = representation_uri.rsplit("/", 1)[0]
+    resources = await discoverResources(wsm, representation_uri, data_object_types, scope="sources")
+    objects = await getDataObjects(wsm, [r.uri for r in resources])
+    result = {uri: {"object": do, "arrays": {}} for uri, do in objects.items()}
+    if not with_arrays:
+        return result
+
+    async def get(uri, epc_uri, pir):
+        result[uri]["arrays"][pir] = await getDataArrayChunked(wsm, epc_uri, pir)
+
+    await asyncio.gather(*(
+        get(uri, epc_uri or proxy_uri, pir)
+        for uri, do in objects.items()
+        for proxy_uri, pir in hdfArrayRefs(do.data, dataspace_uri)
+    ))
+    return result
@@ -1,6 +1,5 @@
 import numpy as np
 import requests
-import asyncio
 import time
 import json
 import argparse
@@ -13,7 +12,7 @@ import resqpy.surface as rs
 
 import xtgeo
 
-from etpclient_helper import openWebSocket, getDataspaces, deleteDataspace, addDataspace, putDataObject, putDataObjectArray, getResources, getDataObject, getDataArray
+from etp_session import EtpSession
 
 
 
@@ -101,11 +100,12 @@ jwt_token = None
 # }
 
 
-wsm = openWebSocket(
+session = EtpSession(
     serv_url = args['host'],
     serv_port = args['port'],
     serv_sub_path = None,
     serv_token = args['token'],
+    cache_dir = '.etp_cache',   # objects and arrays read are kept here while unchanged on the server
 )
 
 dataspace = "demo/pss"
@@ -113,36 +113,27 @@ dataspace = "demo/pss"
 #
 # start from a clean dataspace (delete and recreate the dataspace)
 #
-gds = asyncio.run(
-    deleteDataspace(wsm, dataspace)
-)
-gds = asyncio.run(
-    addDataspace(wsm, dataspace)
-)
-
-#
-# write the data object.  this does not yet write the data array.
-#
-pdo = asyncio.run(
-    putDataObject(wsm, epc_file, dataspace)
-)
+gds = session.sync.delete_dataspace(dataspace)
+gds = session.sync.add_dataspace(dataspace)
 
 #
-# create a etpproto-specific dict for the "put data object array" call
+# list the (uri, pathInResource, array) triplets for the "put data arrays" call
 # TODO: improce the XML parsing here..
 #
 pathInResource = model2.roots()[1][3][3][1][1][0][0].text
 
 url = f'eml:///dataspace(\'{dataspace}\')/eml20.EpcExternalPartReference({str(mesh.uuid)})'
-# dims = list(mysurf.values.data.shape)
-# vals = mysurf.values.data.flatten().tolist()
-dims = list(z.shape)
-vals = z.flatten().tolist()
-put_array_dict = {'dataArrays': {'0': {'uid': {'uri': url, 'pathInResource': pathInResource}, 'array': {'dimensions': dims, 'data':{'item':{'values': vals }}}, 'customData':{}}}}
-
-pdoa = asyncio.run(
-    putDataObjectArray(wsm, put_array_dict)
-)
+# the arrays are encoded straight from the numpy buffers
+put_arrays = [(url, pathInResource, z)]
+
+#
+# write the data object and its array in one transaction, committed once (rolled back on error)
+#
+with session.transaction(dataspace):
+    pdo_ok, pdo_failed = session.sync.put_data_objects(epc_file, dataspace)
+    assert not pdo_failed, pdo_failed
+    pda_ok, pda_failed = session.sync.put_data_arrays(put_arrays)
+    assert not pda_failed, pda_failed
 
 
 
@@ -164,14 +155,13 @@ part_names = []
 PathInHdfFile = ""
 res2 = None
 
-gds = asyncio.run( getDataspaces(wsm) )
+gds = session.sync.get_dataspaces()
 for ii,ds in enumerate(gds):
     if (dataspace == ds.path):
-        res0 = asyncio.run( getResources(wsm, ds.uri) )
+        res0 = session.sync.discover_resources(ds.uri, ['resqml20.obj_Grid2dRepresentation'])
         # print("res0", type(res0))
-        for res in res0:
-            res1 = asyncio.run( getDataObject(wsm, res.uri ) )
-            vv = list(res1.values())[0]
+        objs = session.sync.get_data_objects([res.uri for res in res0 if guid4 in res.uri])
+        for vv in objs.values():
             # print("res1[0]", type(vv), vv.resource, dir(vv))
             if (guid4 in vv.resource.uri and 'Grid2dRepresentation' in vv.resource.uri):
                 object_xml_2 = vv.data
@@ -179,11 +169,13 @@ for ii,ds in enumerate(gds):
                 PathInHdfFile = root[3][3][1][1][0][0].text  # NOTE: same structure as line pathInResource above..
                 root[3][3][1][1].tag   ## references the name of the DataArray (should be ZValues)
                 uri = f'eml:///dataspace(\'{dataspace}\')/eml20.EpcExternalPartReference({str(mesh_uuid)})'
-                res2 = asyncio.run( getDataArray(wsm, uri, PathInHdfFile ) )
+                res2 = session.sync.get_data_array_chunked(uri, PathInHdfFile)
                 # print("mesh uuid", str(mesh_uuid))
                 # print("res2", type(res2) )
                 # print("res2", res2.shape )
 
+session.close()
+
 if len(PathInHdfFile)>0 and res2 is not None:
     # 
     # Create the .epc file; i.e. a zip archive containing multiple .xml files
@@ -1,6 +1,5 @@
 import numpy as np
 # import requests
-import asyncio
 
 import resqpy.property as rqp
 import resqpy.crs as rqc
@@ -9,7 +8,7 @@ import resqpy.olio.uuid as bu
 import resqpy.unstructured as rug
 import resqpy.time_series as rts
 
-from etpclient_helper import openWebSocket, getDataspaces, deleteDataspace, addDataspace, putDataObject, putDataObjectArray, getResources, getDataObject, getDataArray
+from etp_session import EtpSession
 
 
 # ======================================================================
@@ -124,11 +123,12 @@ jwt_token = None
 # }
 
 
-wsm = openWebSocket(
+session = EtpSession(
     serv_url = args['host'],
     serv_port = args['port'],
     serv_sub_path = None,
     serv_token = args['token'],
+    cache_dir = '.etp_cache',   # objects and arrays read are kept here while unchanged on the server
 )
 
 dataspace = "demo/pss"
@@ -136,19 +136,14 @@ dataspace = "demo/pss"
 #
 # start from a clean dataspace (delete and recreate the dataspace)
 #
-gds = asyncio.run(
-    deleteDataspace(wsm, dataspace)
-)
-gds = asyncio.run(
-    addDataspace(wsm, dataspace)
-)
+gds = session.sync.delete_dataspace(dataspace)
+gds = session.sync.add_dataspace(dataspace)
 
 #
 # write the data object.  this does not yet write the data arrays
 #
-pdo = asyncio.run(
-    putDataObject(wsm, input_mesh_file, dataspace)
-)
+pdo_ok, pdo_failed = session.sync.put_data_objects(input_mesh_file, dataspace)
+assert not pdo_failed, pdo_failed
 
 
 
@@ -160,15 +155,15 @@ pdo = asyncio.run(
 
 guid4 = str(hexa_uuid)  # Guid of target object
 dot4 = 'resqml20.obj_UnstructuredGridRepresentation'   # data object type of target object
+property_types = ['resqml20.obj_ContinuousProperty', 'resqml20.obj_DiscreteProperty']
 
 ug = None
-gds = asyncio.run( getDataspaces(wsm) )
+gds = session.sync.get_dataspaces()
 for ii,ds in enumerate(gds):
     if (dataspace == ds.path):
-        res0 = asyncio.run( getResources(wsm, ds.uri) )
-        for res in res0:
-            res1 = asyncio.run( getDataObject(wsm, res.uri ) )
-            vv = list(res1.values())[0]
+        res0 = session.sync.discover_resources(ds.uri, [dot4])
+        objs = session.sync.get_data_objects([res.uri for res in res0 if guid4 in res.uri])
+        for vv in objs.values():
             if (guid4 in vv.resource.uri and 'UnstructuredGridRepresentation' in vv.resource.uri):
                 object_xml_2 = vv.data.decode('utf-8')
                 ug = xml_to_ug(object_xml_2)
@@ -180,10 +175,9 @@ dps = []  # discrete properties
 
 for ii,ds in enumerate(gds):
     if (dataspace == ds.path):
-        res0 = asyncio.run( getResources(wsm, ds.uri) )
-        for res in res0:
-            res1 = asyncio.run( getDataObject(wsm, res.uri ) )
-            vv = list(res1.values())[0]
+        res0 = session.sync.discover_resources(ds.uri, property_types)
+        objs = session.sync.get_data_objects([res.uri for res in res0])
+        for vv in objs.values():
             if ('ContinuousProperty' in vv.resource.uri):
                 cp = xml_to_cp(vv.data.decode('utf-8'))
                 cps.append(cp)
@@ -195,111 +189,25 @@ for ii,ds in enumerate(gds):
 
 
 #
-# create a etpproto-specific dict for the "put data object array" call
+# list the (uri, pathInResource, array) triplets for the "put data arrays" call
 #
 url_ExternalPartReference = f'eml:///dataspace(\'{dataspace}\')/eml20.EpcExternalPartReference({str(hexa.uuid)})'
 
 #
 # out mesh is defined by six arrays:
 #
-put_array_dict = {'dataArrays':
-                  {
-                      '0': {
-                          'uid': {
-                              'uri': url_ExternalPartReference,
-                              'pathInResource': ug.geometry.points.coordinates.path_in_hdf_file
-                          },
-                          'array': {
-                              'dimensions': list(hexa.points_cached.shape),
-                              'data': {
-                                  'item': {
-                                      'values': hexa.points_cached.flatten().tolist()
-                                  }
-                              }
-                          },
-                          'customData': {}
-                      },
-                      '1': {
-                          'uid': {
-                              'uri': url_ExternalPartReference,
-                              'pathInResource': ug.geometry.nodes_per_face.elements.values.path_in_hdf_file
-                          },
-                          'array': {
-                              'dimensions': list( hexa.nodes_per_face.shape),
-                              'data': {
-                                  'item': {
-                                      'values':  hexa.nodes_per_face.flatten().tolist()
-                                  }
-                              }
-                          },
-                          'customData': {}
-                      },
-                      '2': {
-                          'uid': {
-                              'uri': url_ExternalPartReference,
-                              'pathInResource': ug.geometry.nodes_per_face.cumulative_length.values.path_in_hdf_file
-                          },
-                          'array': {
-                              'dimensions': list( hexa.nodes_per_face_cl.shape),
-                              'data': {
-                                  'item': {
-                                      'values':  hexa.nodes_per_face_cl.flatten().tolist()
-                                  }
-                              }
-                          },
-                          'customData': {}
-                      },
-                      '3': {
-                          'uid': {
-                              'uri': url_ExternalPartReference,
-                              'pathInResource': ug.geometry.faces_per_cell.elements.values.path_in_hdf_file
-                          },
-                          'array': {
-                              'dimensions': list( hexa.faces_per_cell.shape),
-                              'data': {
-                                  'item': {
-                                      'values':  hexa.faces_per_cell.flatten().tolist()
-                                  }
-                              }
-                          },
-                          'customData': {}
-                      },
-                      '4': {
-                          'uid': {
-                              'uri': url_ExternalPartReference,
-                              'pathInResource': ug.geometry.faces_per_cell.cumulative_length.values.path_in_hdf_file
-                          },
-                          'array': {
-                              'dimensions': list( hexa.faces_per_cell_cl.shape),
-                              'data': {
-                                  'item': {
-                                      'values':  hexa.faces_per_cell_cl.flatten().tolist()
-                                  }
-                              }
-                          },
-                          'customData': {}
-                      },
-                      '5': {
-                          'uid': {
-                              'uri': url_ExternalPartReference,
-                              'pathInResource': ug.geometry.cell_face_is_right_handed.values.path_in_hdf_file
-                          },
-                          'array': {
-                              'dimensions': list( hexa.cell_face_is_right_handed.shape),
-                              'data': {
-                                  'item': {
-                                      'values':  hexa.cell_face_is_right_handed.flatten().tolist()
-                                  }
-                              }
-                          },
-                          'customData': {}
-                      },
-                  }
-                }
+put_arrays = [
+    (url_ExternalPartReference, ug.geometry.points.coordinates.path_in_hdf_file, hexa.points_cached),
+    (url_ExternalPartReference, ug.geometry.nodes_per_face.elements.values.path_in_hdf_file, hexa.nodes_per_face),
+    (url_ExternalPartReference, ug.geometry.nodes_per_face.cumulative_length.values.path_in_hdf_file, hexa.nodes_per_face_cl),
+    (url_ExternalPartReference, ug.geometry.faces_per_cell.elements.values.path_in_hdf_file, hexa.faces_per_cell),
+    (url_ExternalPartReference, ug.geometry.faces_per_cell.cumulative_length.values.path_in_hdf_file, hexa.faces_per_cell_cl),
+    (url_ExternalPartReference, ug.geometry.cell_face_is_right_handed.values.path_in_hdf_file, hexa.cell_face_is_right_handed),
+]
 
 
 #
-# add properties to put_array_dict
+# add properties to put_arrays
 #  
 prop_titles=['Temperature', 'Age', 'LayerID', 'Porosity_initial', 'Porosity_decay', 'Density_solid', 'insulance_thermal', 'Radiogenic_heat_production']
 
@@ -312,31 +220,15 @@ for title in prop_titles:
     except IndexError:
         cp_prop = [dp for dp in dps if dp.citation.title==title and dp.supporting_representation.uuid==str(hexa_uuid)][0]
     # print(title, prop.indexable_element(), prop.uom(), prop.array_ref()[0:10], cp_prop )
-    ind = len(put_array_dict['dataArrays'])
     pihf = cp_prop.patch_of_values[0].values.values.path_in_hdf_file   # assume only one patch_of_values
-    dd = {
-            'uid': {
-                'uri': url_ExternalPartReference,
-                'pathInResource': pihf
-            },
-            'array': {
-                'dimensions': list(  prop.array_ref().shape ),
-                'data': {
-                    'item': {
-                        'values':   prop.array_ref().flatten().tolist()
-                    }
-                }
-            },
-            'customData': {}
-        }
-    put_array_dict['dataArrays'][str(ind)] = dd
+    put_arrays.append((url_ExternalPartReference, pihf, prop.array_ref()))
 
     
-# put data object arrays using etpclient-python
+# put data object arrays, encoded straight from the numpy buffers, in one transaction
 #
-pdoa = asyncio.run(
-    putDataObjectArray(wsm, put_array_dict)
-)
+with session.transaction(dataspace):
+    pda_ok, pda_failed = session.sync.put_data_arrays(put_arrays)
+    assert not pda_failed, pda_failed
 
 
 
@@ -352,63 +244,55 @@ pdoa = asyncio.run(
 
 # get UnstructuredGrid data object and the six mesh-related data arrays
 #
-gds = asyncio.run( getDataspaces(wsm) )
+gds = session.sync.get_dataspaces()
 for ii,ds in enumerate(gds):
     if (dataspace == ds.path):
-        res0 = asyncio.run( getResources(wsm, ds.uri) )
-        for res in res0:
-            res1 = asyncio.run( getDataObject(wsm, res.uri ) )
-            vv = list(res1.values())[0]
+        res0 = session.sync.discover_resources(ds.uri, [dot4])
+        objs = session.sync.get_data_objects([res.uri for res in res0 if guid4 in res.uri])
+        for vv in objs.values():
             if (guid4 in vv.resource.uri and 'UnstructuredGridRepresentation' in vv.resource.uri):
                 object_xml_2 = vv.data.decode('utf-8')
                 ug = xml_to_ug(object_xml_2)    
                 uri = url_ExternalPartReference
-                points = asyncio.run( getDataArray(wsm, uri, ug.geometry.points.coordinates.path_in_hdf_file ) )
-                npf = asyncio.run( getDataArray(wsm, uri, ug.geometry.nodes_per_face.elements.values.path_in_hdf_file ) )
-                npf_cl = asyncio.run( getDataArray(wsm, uri, ug.geometry.nodes_per_face.cumulative_length.values.path_in_hdf_file ) )
-                fpc = asyncio.run( getDataArray(wsm, uri, ug.geometry.faces_per_cell.elements.values.path_in_hdf_file ) )
-                fpc_cl = asyncio.run( getDataArray(wsm, uri, ug.geometry.faces_per_cell.cumulative_length.values.path_in_hdf_file ) )
-                cfrh = asyncio.run( getDataArray(wsm, uri, ug.geometry.cell_face_is_right_handed.values.path_in_hdf_file ) )
+                points, (npf, npf_cl, fpc, fpc_cl, cfrh) = session.sync.gather(
+                    session.get_data_array_chunked(uri, ug.geometry.points.coordinates.path_in_hdf_file),
+                    session.get_data_arrays([
+                        (uri, ug.geometry.nodes_per_face.elements.values.path_in_hdf_file),
+                        (uri, ug.geometry.nodes_per_face.cumulative_length.values.path_in_hdf_file),
+                        (uri, ug.geometry.faces_per_cell.elements.values.path_in_hdf_file),
+                        (uri, ug.geometry.faces_per_cell.cumulative_length.values.path_in_hdf_file),
+                        (uri, ug.geometry.cell_face_is_right_handed.values.path_in_hdf_file),
+                    ]),
+                )
 
 #
 # get all properties that use our mesh as support and store in dict "props"
-# NOTE: for now we fetch *every data object* in the dataspace, and filter by type and support. This is wasteful!
+# NOTE: discovery lists only the properties that reference the mesh; their arrays are fetched concurrently
 #
 props = {}
-gds = asyncio.run( getDataspaces(wsm) )
-for ii,ds in enumerate(gds):
-    if (dataspace == ds.path):
-        res0 = asyncio.run( getResources(wsm, ds.uri) )
-        for res in res0:
-            res1 = asyncio.run( getDataObject(wsm, res.uri ) )
-            vv = list(res1.values())[0]
-            if ( 'ContinuousProperty' in vv.resource.uri):
-                object_xml_2 = vv.data.decode('utf-8')
-                cp = xml_to_cp(object_xml_2)   
-                if cp.supporting_representation.uuid==str(hexa_uuid):
-                    pihf = cp.patch_of_values[0].values.values.path_in_hdf_file 
-                    dd = asyncio.run( getDataArray(wsm, url_ExternalPartReference, pihf ) )
-                    props[cp.citation.title] = {
-                        'title': cp.citation.title,
-                        'data': dd,
-                        'indexable_element': cp.indexable_element.value,
-                        'uom': cp.uom,
-                        'is_integer': type(cp.patch_of_values[0].values)=="resqml_objects.generated.IntegerHdf5Array",
-                    }
-            if ( 'DiscreteProperty' in vv.resource.uri):
-                object_xml_2 = vv.data.decode('utf-8')
-                dp = xml_to_dp(object_xml_2)   
-                if dp.supporting_representation.uuid==str(hexa_uuid):
-                    pihf = dp.patch_of_values[0].values.values.path_in_hdf_file
-                    dd = asyncio.run( getDataArray(wsm, url_ExternalPartReference, pihf ) )
-                    props[dp.citation.title] = {
-                        'title': dp.citation.title,
-                        'data': dd,
-                        'indexable_element': dp.indexable_element.value,
-                        'uom': 'integer',
-                        'is_integer': type(dp.patch_of_values[0].values)=="resqml_objects.generated.IntegerHdf5Array",
-                    }
-
+hexa_uri = f"eml:///dataspace('{dataspace}')/{dot4}({guid4})"
+# the arrays were stored under url_ExternalPartReference, not the HdfProxy of the property XML
+for prop_uri, prop in session.sync.get_supported_properties(hexa_uri, epc_uri=url_ExternalPartReference).items():
+    object_xml_2 = prop['object'].data.decode('utf-8')
+    if ('ContinuousProperty' in prop_uri):
+        cp = xml_to_cp(object_xml_2)
+        uom = cp.uom
+    elif ('DiscreteProperty' in prop_uri):
+        cp = xml_to_dp(object_xml_2)
+        uom = 'integer'
+    else:
+        continue
+    pihf = cp.patch_of_values[0].values.values.path_in_hdf_file   # assume only one patch_of_values
+    props[cp.citation.title] = {
+        'title': cp.citation.title,
+        'path_in_hdf_file': pihf,
+        'indexable_element': cp.indexable_element.value,
+        'uom': uom,
+        'is_integer': type(cp.patch_of_values[0].values)=="resqml_objects.generated.IntegerHdf5Array",
+        'data': prop['arrays'][pihf],
+    }
+
+session.close()
 
 
 
@@ -482,7 +366,7 @@ if age_per_vertex is not None:
 lid_per_cell = [p for p in props.values() if p['title']=='LayerID' and p['indexable_element']=='cells']
 if lid_per_cell is not None:
     _ = rqp.Property.from_array(model_out,
-                                lid_per_cell[0]['data'].astype(np.int32),
+                                lid_per_cell[0]['data'],   # arrives in the integer dtype it was uploaded with
                                 source_info = 'SubsHeat',
                                 keyword = 'LayerID',
                                 support_uuid = hexa.uuid,
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def server():
+    """A StandinEtpServer running in-process for the test."""
+    for module in ("numpy", "etpproto", "etptypes", "etpclient", "websockets"):
+        pytest.importorskip(module)
+    from etp_standin_server import StandinEtpServer
+
+    with StandinEtpServer() as server:
+        yield server
+
+
+@pytest.fixture
+def session(server):
+    from etp_session import EtpSession
+
+    with EtpSession(server.host, server.port) as session:
+        yield session
@@ -0,0 +1,149 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("etpproto")
+pytest.importorskip("websockets")
+
+from etpproto.connection import ETPConnection
+from etpproto.messages import Message
+from etptypes.energistics.etp.v12.datatypes.array_of_string import ArrayOfString
+from etptypes.energistics.etp.v12.protocol.data_array.get_data_arrays_response import GetDataArraysResponse
+from etptypes.energistics.etp.v12.protocol.data_array.get_data_subarrays_response import GetDataSubarraysResponse
+
+from etp_arrays import (
+    CONTENT_HASH,
+    HAS_HEADER_EXTENSION,
+    any_array_item,
+    compress_message,
+    decode_data_array_response,
+    decode_header,
+    encode_header,
+    encode_put_data_arrays,
+    encode_put_data_subarrays,
+)
+from etp_session import decode_message, encode_message
+
+
+URI = "eml:///dataspace('test')/eml20.EpcExternalPartReference(0d2d7ad5-6a11-4d5e-9d4c-2b1a9e0c6f11)"
+
+ARRAYS = {
+    "float64": np.random.default_rng(0).random((3, 4)),
+    "float32": np.random.default_rng(1).random(5).astype(np.float32),
+    "int32": (np.arange(-6, 6, dtype=np.int32) * 100_000).reshape(3, 4),
+    "int64": np.array([-2**62, -1, 0, 1, 2**62], np.int64),
+    "bool": np.array([[True, False, True], [False, False, True]]),
+    "non-contiguous": np.random.default_rng(2).random((6, 4))[::2, ::-1],
+    "big-endian float64": np.arange(12, dtype=">f8").reshape(3, 4) / 7,
+    "big-endian int32": np.arange(-6, 6, dtype=">i4").reshape(2, 6) * 1000,
+}
+
+
+def etpproto_decode(data):
+    """The message decoded by etpproto from the Avro schema, as the stand-in server reads it."""
+    if isinstance(data, list):
+        data = b"".join(data)
+    return Message.decode_binary_message(bytes(data), dict_map_pro_to_class=ETPConnection.generic_transition_table)
+
+
+def assert_values(item, array):
+    values = np.asarray(item.values, dtype=array.dtype.newbyteorder("="))
+    np.testing.assert_array_equal(values.reshape(array.shape), array)
+
+
+@pytest.mark.parametrize("array", ARRAYS.values(), ids=ARRAYS.keys())
+def test_put_data_arrays_decodes_to_input(array):
+    data = encode_put_data_arrays([(URI, "/values", array)], 7, {(URI, "/values"): {CONTENT_HASH: "abc"}})
+    msg = etpproto_decode(data)
+    assert msg.header.message_id == 7
+    (pda,) = msg.body.data_arrays.values()
+    assert (pda.uid.uri, pda.uid.path_in_resource) == (URI, "/values")
+    assert list(pda.array.dimensions) == list(array.shape)
+    assert_values(pda.array.data.item, array)
+    assert pda.custom_data[CONTENT_HASH].item == "abc"
+
+
+def test_put_data_arrays_with_several_arrays():
+    arrays = [(URI, f"/values/{name}", array) for name, array in ARRAYS.items()]
+    msg = etpproto_decode(encode_put_data_arrays(arrays, 3))
+    assert len(msg.body.data_arrays) == len(arrays)
+    for k, (uri, pir, array) in enumerate(arrays):
+        pda = msg.body.data_arrays[str(k)]
+        assert pda.uid.path_in_resource == pir
+        assert pda.custom_data == {}
+        assert_values(pda.array.data.item, array)
+
+
+@pytest.mark.parametrize("array", ARRAYS.values(), ids=ARRAYS.keys())
+def test_put_data_subarrays_decodes_to_input(array):
+    block = array[1:]
+    starts = [1] + [0] * (array.ndim - 1)
+    msg = etpproto_decode(encode_put_data_subarrays(URI, "/values", block, starts, list(block.shape), 9))
+    assert msg.header.message_id == 9
+    (pds,) = msg.body.data_subarrays.values()
+    assert (pds.uid.uri, pds.uid.path_in_resource) == (URI, "/values")
+    assert list(pds.starts) == starts
+    assert list(pds.counts) == list(block.shape)
+    assert_values(pds.data.item, block)
+
+
+def data_arrays(*arrays):
+    return {str(k): {"dimensions": list(a.shape), "data": {"item": any_array_item(a)[0]}} for k, a in enumerate(arrays)}
+
+
+def encode_response(body, message_id=12, correlation_id=5):
+    return bytes(encode_message(body, message_id, correlation_id))
+
+
+def assert_same_message(fast, slow):
+    for field in ("protocol", "message_type", "correlation_id", "message_id"):
+        assert getattr(fast.header, field) == getattr(slow.header, field)
+    fast_arrays = getattr(fast.body, "data_arrays", None) or fast.body.data_subarrays
+    slow_arrays = getattr(slow.body, "data_arrays", None) or slow.body.data_subarrays
+    assert fast_arrays.keys() == slow_arrays.keys()
+    for k, slow_da in slow_arrays.items():
+        fast_da = fast_arrays[k]
+        assert list(fast_da.dimensions) == list(slow_da.dimensions)
+        assert type(fast_da.data.item) is type(slow_da.data.item)
+        values = np.asarray(fast_da.data.item.values)
+        np.testing.assert_array_equal(values, np.asarray(slow_da.data.item.values, dtype=values.dtype))
+
+
+@pytest.mark.parametrize("array", ARRAYS.values(), ids=ARRAYS.keys())
+def test_decode_data_arrays_response_matches_etpproto(array):
+    data = encode_response(GetDataArraysResponse.parse_obj({"dataArrays": data_arrays(array)}))
+    assert_same_message(decode_data_array_response(data), etpproto_decode(data))
+
+
+def test_decode_multi_array_response_matches_etpproto():
+    data = encode_response(GetDataArraysResponse.parse_obj({"dataArrays": data_arrays(*ARRAYS.values())}))
+    fast = decode_data_array_response(data)
+    assert len(fast.body.data_arrays) == len(ARRAYS)
+    assert_same_message(fast, etpproto_decode(data))
+
+
+def test_decode_data_subarrays_response_matches_etpproto():
+    data = encode_response(GetDataSubarraysResponse.parse_obj({"dataSubarrays": data_arrays(*ARRAYS.values())}))
+    assert_same_message(decode_data_array_response(data), etpproto_decode(data))
+
+
+def test_compressed_response_falls_back_to_decompression():
+    data = encode_response(GetDataArraysResponse.parse_obj({"dataArrays": data_arrays(*ARRAYS.values())}))
+    compressed = compress_message(data)
+    assert decode_data_array_response(compressed) is None
+    assert_same_message(decode_message(compressed), etpproto_decode(data))
+
+
+def test_header_extension_is_left_to_etpproto():
+    data = encode_response(GetDataArraysResponse.parse_obj({"dataArrays": data_arrays(ARRAYS["float64"])}))
+    (protocol, message_type, correlation_id, message_id, flags), pos = decode_header(data)
+    # same body behind an empty MessageHeaderExtension
+    extended = encode_header(protocol, message_type, message_id, correlation_id, flags | HAS_HEADER_EXTENSION)
+    assert decode_data_array_response(extended + b"\x00" + data[pos:]) is None
+
+
+def test_string_array_is_left_to_etpproto():
+    names = ArrayOfString(values=["a", "bb", ""])
+    body = GetDataArraysResponse.parse_obj({"dataArrays": {"0": {"dimensions": [3], "data": {"item": names}}}})
+    data = encode_response(body)
+    assert decode_data_array_response(data) is None
+    assert decode_message(data).body.data_arrays["0"].data.item.values == ["a", "bb", ""]
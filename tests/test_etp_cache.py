@@ -0,0 +1,48 @@
+import os
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("etptypes")
+
+from etp_cache import ArrayCache
+
+
+URI = "eml:///dataspace('test')/resqml20.obj_ContinuousProperty(8c4f2d1a-3b6e-4f70-9a15-6e2d0b7c4a93)"
+
+
+def test_object_written_by_another_session_is_read_after_the_ttl(server, session, tmp_path):
+    from etp_session import EtpSession
+
+    server.add_object(URI, b"<x>v1</x>")
+    with EtpSession(server.host, server.port, cache_dir=str(tmp_path), object_cache_ttl=0.5) as reader:
+        (do,) = reader.sync.get_data_object(URI).values()
+        assert do.data == b"<x>v1</x>"
+        assert reader.sync.get_data_objects([URI])[URI].data == b"<x>v1</x>"
+        assert reader.object_cache.hits == 1
+
+        succeeded, failed = session.sync.put_data_object_list([do.copy(update={"data": b"<x>v2</x>"})])
+        assert (succeeded, failed) == ([URI], {})
+        time.sleep(0.5)
+
+        (do,) = reader.sync.get_data_object(URI).values()
+        assert do.data == b"<x>v2</x>"
+        assert reader.sync.get_data_objects([URI])[URI].data == b"<x>v2</x>"
+        assert reader.object_cache.hits == 2
+
+
+def test_concurrent_downloads_of_one_array(tmp_path):
+    cache = ArrayCache(str(tmp_path))
+    key = (URI, "/values", 42)
+    first, second = (cache.create(*key, [3, 4], np.float64) for _ in range(2))
+    assert first.filename != second.filename
+    first[:] = second[:] = np.arange(12.0).reshape(3, 4)
+    for array in (first, second):
+        np.testing.assert_array_equal(cache.publish(*key, array), np.arange(12.0).reshape(3, 4))
+    np.testing.assert_array_equal(cache.get(*key), np.arange(12.0).reshape(3, 4))
+    assert cache.files.size == os.path.getsize(cache.files.path(*key))
+
+    third = cache.create(URI, "/values", 43, [2], np.int32)
+    cache.discard(third)
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".part")] == []
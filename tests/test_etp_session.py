@@ -0,0 +1,34 @@
+import uuid
+
+import pytest
+
+pytest.importorskip("etpclient")
+
+from etpclient_helper import EtpError, delete_dataspace
+from etp_session import EtpSession
+from etp_standin_server import StandinEtpServer
+
+
+def test_delete_missing_dataspace_raises_not_found(session):
+    with pytest.raises(EtpError) as e:
+        session.sync.send_and_wait(delete_dataspace(["test/missing"]))
+    assert e.value.not_found
+
+
+def test_delete_dataspace_tolerates_missing(session, server):
+    session.sync.delete_dataspace("test/missing")
+    session.sync.add_dataspace("test/present")
+    assert "test/present" in server.dataspaces
+    session.sync.delete_dataspace("test/present")
+    assert "test/present" not in server.dataspaces
+
+
+def test_stopping_iter_objects_early_cancels_its_fetches():
+    with StandinEtpServer(latency=0.02) as server:
+        for _ in range(40):
+            server.add_object(f"eml:///dataspace('test')/resqml20.obj_ContinuousProperty({uuid.uuid4()})", b"<x/>")
+        with EtpSession(server.host, server.port) as session:
+            objects = session.sync.iter_objects("eml:///dataspace('test')", prefetch=4)
+            next(objects)
+            objects.close()
+            assert session._pending == {}
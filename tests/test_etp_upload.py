@@ -0,0 +1,85 @@
+import uuid
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("etpclient")
+pytest.importorskip("websockets")
+
+from etptypes.energistics.etp.v12.datatypes.object.data_object import DataObject
+
+from etp_session import EtpSession
+from etp_standin_server import StandinEtpServer, now_us
+from etp_upload import UploadLedger
+
+
+URI = "eml:///dataspace('test')/eml20.EpcExternalPartReference(5b0f6c1e-2f35-4e0a-8d47-1c9a3e6b7d20)"
+
+
+@pytest.fixture
+def small_server():
+    """A stand-in server with 64 kB messages, so that arrays go in many blocks."""
+    with StandinEtpServer(max_message_size=1 << 16) as server:
+        with EtpSession(server.host, server.port) as session:
+            yield server, session
+
+
+def data_object(uri):
+    t = now_us()
+    return DataObject.parse_obj({
+        "resource": {
+            "uri": uri, "alternateUris": [], "name": "test", "sourceCount": None, "targetCount": None,
+            "lastChanged": t, "storeLastWrite": t, "storeCreated": t, "activeStatus": "Inactive", "customData": {},
+        },
+        "format": "xml",
+        "blobId": None,
+        "data": b"<x>" + uri.encode() + b"</x>",
+    })
+
+
+def fail_after(request_encoded, n):
+    """`request_encoded` letting `n` requests through, then failing as a dropped connection would."""
+    calls = 0
+
+    async def failing(encode):
+        nonlocal calls
+        calls += 1
+        if calls > n:
+            raise ConnectionError("connection dropped")
+        return await request_encoded(encode)
+
+    return failing
+
+
+@pytest.mark.parametrize("with_ledger", [False, True], ids=["no ledger", "ledger"])
+def test_interrupted_chunked_put_is_sent_again(small_server, monkeypatch, tmp_path, with_ledger):
+    server, session = small_server
+    # int8 always goes through putDataArrayChunked, here in about a dozen blocks
+    array = (np.arange(200_000) % 251 - 125).astype(np.int8)
+    arrays = [(URI, "/values", array)]
+
+    def ledger():
+        return UploadLedger(str(tmp_path / "uploads.ledger")) if with_ledger else None
+
+    def stored():
+        return server.dataspaces["test"]["arrays"][(URI, "/values")]["array"]
+
+    monkeypatch.setattr(session, "request_encoded", fail_after(session.request_encoded, 1))
+    with pytest.raises(ConnectionError):
+        session.sync.put_changed_arrays(arrays, ledger())
+    monkeypatch.undo()
+    assert not np.array_equal(stored(), array)
+
+    assert session.sync.put_changed_arrays(arrays, ledger()) == {"sent": 1, "skipped": 0, "failed": {}}
+    np.testing.assert_array_equal(stored(), array)
+
+    # once complete, the hash is trusted where an interruption could be noticed
+    counts = session.sync.put_changed_arrays(arrays, ledger())
+    assert counts["skipped"] == (1 if with_ledger else 0)
+
+
+@pytest.mark.parametrize("dataspace", ["eml:///", "eml:///dataspace('demo/pss')/"])
+def test_unchanged_objects_are_skipped(session, dataspace):
+    data_objects = [data_object(f"{dataspace}resqml20.obj_ContinuousProperty({uuid.uuid4()})") for _ in range(3)]
+    assert session.sync.put_changed_objects(data_objects) == {"sent": 3, "skipped": 0, "failed": {}}
+    assert session.sync.put_changed_objects(data_objects) == {"sent": 0, "skipped": 3, "failed": {}}